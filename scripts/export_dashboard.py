@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+# Ensure local src/ is importable when running from repo root
+_HERE = os.path.dirname(__file__)
+_SRC = os.path.abspath(os.path.join(_HERE, "..", "src"))
+if _SRC not in sys.path:
+    sys.path.insert(0, _SRC)
+
+from mof_investviz.share import SHARE_SCALES, SHARE_SORTS, SHARE_VIEWS, write_share_html
+from mof_investviz.summary_codec import VALUE_ENCODINGS, loads_summary
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Write a single self-contained dashboard HTML (data embedded, opens offline)")
+    ap.add_argument("--build-dir", "-b", default="build", help="Build directory containing summary.json")
+    ap.add_argument("--summary", help="summary.json to embed (default: <build-dir>/summary.json)")
+    ap.add_argument("--output", "-o", help="Output HTML (default: <build-dir>/investviz_share.html)")
+    ap.add_argument("--summary-values", choices=VALUE_ENCODINGS, default="auto", help="Value encoding of the embedded data (f32 trades precision for size)")
+    ap.add_argument("--view", choices=SHARE_VIEWS, help="Initial view")
+    ap.add_argument("--measure", type=int, help="Initial series (index in summary.json)")
+    ap.add_argument("--region", help="Initial region filter (time-series views)")
+    ap.add_argument("--year", help="Initial year (country views)")
+    ap.add_argument("--top-n", type=int, help="Number of countries shown (country views)")
+    ap.add_argument("--sort-by", choices=SHARE_SORTS, help="Country ranking order")
+    ap.add_argument("--scale", choices=SHARE_SCALES, help="Country bar scale")
+    ap.add_argument("--others", action="store_true", help="Show the 'others' slice in the country pie")
+    ap.add_argument("--trend", action="store_true", help="Show trend lines")
+    ap.add_argument("--overlay", action="store_true", help="Overlay all series")
+    args = ap.parse_args()
+
+    summary_path = args.summary or os.path.join(args.build_dir, "summary.json")
+    if not os.path.isfile(summary_path):
+        raise SystemExit(f"summary.json not found: {summary_path} (run scripts/run_pipeline.py first)")
+    with open(summary_path, "rb") as f:
+        summary = loads_summary(f.read())
+
+    state = {
+        "view": args.view, "measure": args.measure, "region": args.region, "year": args.year,
+        "top_n": args.top_n, "sort_by": args.sort_by, "scale": args.scale,
+        "others": args.others, "trend": args.trend, "overlay": args.overlay,
+    }
+    out = args.output or os.path.join(args.build_dir, "investviz_share.html")
+    write_share_html(out, summary, {k: v for k, v in state.items() if v is not None},
+                     encoding=args.summary_values)
+    print(f"Wrote: {out} ({os.path.getsize(out)} bytes; summary.json {os.path.getsize(summary_path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
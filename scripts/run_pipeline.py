@@ -17,10 +17,16 @@ if _SRC not in sys.path:
 from mof_investviz.io import write_csv
 from mof_investviz.normalize import (
     SCHEMA_HEADERS,
+    build_pivot_year_measure,
     build_summary_multi_measure,
     normalize_file,
 )
 from mof_investviz.schema import copy_schema_to_build, schema_meta
+from mof_investviz.sessions import write_country_rankings
+from mof_investviz.sqlstore import DB_FILE, write_sqlite
+from mof_investviz.static import write_gzip_sidecar
+from mof_investviz.summary_codec import VALUE_ENCODINGS, write_summary
+from mof_investviz.zonemap import sort_rows, write_csv_with_zonemap
 from mof_investviz.ui import write_index_html
 
 
@@ -37,6 +43,9 @@ def main() -> None:
     ap = argparse.ArgumentParser(description="Run minimal normalization pipeline")
     ap.add_argument("--input", "-i", required=True, help="CSV file or directory containing CSVs")
     ap.add_argument("--build-dir", "-b", default="build", help="Output build directory")
+    ap.add_argument("--pretty-summary", action="store_true", help="Write summary.json in the legacy indented format (for debugging)")
+    ap.add_argument("--summary-values", choices=VALUE_ENCODINGS, default="auto", help="Value encoding of the compact summary.json (f32 trades precision for size)")
+    ap.add_argument("--sqlite", action="store_true", help="Also write normalized.sqlite (indexed; used by filtered exports)")
     args = ap.parse_args()
 
     os.makedirs(args.build_dir, exist_ok=True)
@@ -54,27 +63,21 @@ def main() -> None:
     for path in files:
         result = normalize_file(path)
         all_norm.extend(result.rows)
-        parse_log["inputs"].append({
-            "path": result.meta.get("path"),
-            "encoding": result.meta.get("encoding"),
-            "delimiter": result.meta.get("delimiter"),
-            "header_rows": result.meta.get("header_rows"),
-            "headers": result.headers,
-            "unit_detected": result.meta.get("unit_detected"),
-            "scale_factor": result.meta.get("scale_factor"),
-            "side": result.meta.get("side"),
-            "metric": result.meta.get("metric"),
-            "stats": result.stats,
-        })
-
-    # Write normalized CSV
+        parse_log["inputs"].append(result.log_entry())
+
+    # Write normalized CSV sorted by (segment_region, year), with a zone-map index for seekable exports
     out_csv = os.path.join(args.build_dir, "normalized.csv")
-    write_csv(out_csv, all_norm, SCHEMA_HEADERS)
+    sort_rows(all_norm)
+    write_csv_with_zonemap(out_csv, all_norm, SCHEMA_HEADERS)
+    if args.sqlite:
+        write_sqlite(os.path.join(args.build_dir, DB_FILE), all_norm)
 
     # Summary for dashboard (multi-measure)
     summary = build_summary_multi_measure(all_norm)
-    with open(os.path.join(args.build_dir, "summary.json"), "w", encoding="utf-8") as f:
-        json.dump(summary, f, ensure_ascii=False, indent=2)
+    write_summary(os.path.join(args.build_dir, "summary.json"), summary, pretty=args.pretty_summary, encoding=args.summary_values)
+    write_gzip_sidecar(os.path.join(args.build_dir, "summary.json"))
+    # Per-year country rankings (served by the country-view export)
+    write_country_rankings(args.build_dir, summary)
 
     # Copy schema for reference
     copy_schema_to_build(args.build_dir)
@@ -84,33 +87,20 @@ def main() -> None:
         json.dump(parse_log, f, ensure_ascii=False, indent=2)
 
     # Optional: year x measure pivot for spreadsheet analysis
-    pivot_map = {}
-    measures = set()
-    for r in all_norm:
-        y = r.get('year')
-        if y is None:
-            continue
-        m = str(r.get('measure'))
-        v = float(r.get('value_100m_yen') or 0.0)
-        measures.add(m)
-        d = pivot_map.setdefault(int(y), {})
-        d[m] = d.get(m, 0.0) + v
-    measures_sorted = sorted(measures)
-    pivot_headers = ['year'] + measures_sorted
-    pivot_rows = []
-    for y in sorted(pivot_map.keys()):
-        row = {'year': y}
-        row.update({m: pivot_map[y].get(m, 0.0) for m in measures_sorted})
-        pivot_rows.append(row)
+    pivot_headers, pivot_rows = build_pivot_year_measure(all_norm)
     write_csv(os.path.join(args.build_dir, 'pivot_year_measure.csv'), pivot_rows, pivot_headers)
 
     # Write dashboard page
     write_index_html(args.build_dir)
 
     print(f"Wrote: {out_csv}")
+    print(f"Wrote: {out_csv}.zmap.json")
     print(f"Wrote: {os.path.join(args.build_dir, 'summary.json')}")
     print(f"Wrote: {os.path.join(args.build_dir, 'parse_log.json')}")
     print(f"Wrote: {os.path.join(args.build_dir, 'pivot_year_measure.csv')}")
+    print(f"Wrote: {os.path.join(args.build_dir, 'country_rankings.json')}")
+    if args.sqlite:
+        print(f"Wrote: {os.path.join(args.build_dir, DB_FILE)}")
     print(f"Wrote: {os.path.join(args.build_dir, 'index.html')}")
     print("Next: python scripts/serve_dashboard.py --build-dir", args.build_dir)
 
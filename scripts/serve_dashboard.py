@@ -11,6 +11,7 @@ _SRC = os.path.abspath(os.path.join(_HERE, "..", "src"))
 if _SRC not in sys.path:
     sys.path.insert(0, _SRC)
 
+from mof_investviz.server import SERVER_MODES
 from mof_investviz.ui import serve_build_dir, write_index_html
 
 
@@ -19,13 +20,21 @@ def main() -> None:
     ap.add_argument("--build-dir", "-b", default="build", help="Build directory to serve")
     ap.add_argument("--host", default="127.0.0.1", help="Host/IP to bind (e.g., 0.0.0.0 for WSL)")
     ap.add_argument("--port", "-p", type=int, default=8000, help="Port")
+    ap.add_argument("--server", choices=SERVER_MODES, default="pool", help="pool: fixed worker pool with 503 backpressure (default); threading: thread per connection")
+    ap.add_argument("--http-workers", type=int, default=32, help="Worker threads in pool mode (default: 32)")
+    ap.add_argument("--http-queue", type=int, default=128, help="Pending connections before answering 503 in pool mode (default: 128)")
+    ap.add_argument("--idle-timeout", type=float, default=5.0, help="Keep-alive idle timeout in seconds (default: 5)")
     args = ap.parse_args()
 
     if not os.path.isdir(args.build_dir):
         os.makedirs(args.build_dir, exist_ok=True)
     # Always (re)write the latest dashboard HTML so UI changes reflect without a separate step
     write_index_html(args.build_dir)
-    serve_build_dir(args.build_dir, host=args.host, port=args.port)
+    serve_build_dir(
+        args.build_dir, host=args.host, port=args.port,
+        server_mode=args.server, http_workers=args.http_workers,
+        http_queue=args.http_queue, idle_timeout=args.idle_timeout,
+    )
 
 
 if __name__ == "__main__":
@@ -1,39 +1,60 @@
-#!/usr/bin/env python3
-"""Serve the interactive dashboard with upload capability."""
-from __future__ import annotations
-
-import argparse
-import os
-import sys
-
-# Ensure local src/ is importable when running from repo root
-_HERE = os.path.dirname(__file__)
-_SRC = os.path.abspath(os.path.join(_HERE, "..", "src"))
-if _SRC not in sys.path:
-    sys.path.insert(0, _SRC)
-
-from mof_investviz.ui import serve_build_dir, write_index_html
-
-
-def main() -> None:
-    ap = argparse.ArgumentParser(description="Serve the interactive dashboard with upload capability")
-    ap.add_argument("--build-dir", "-b", default="build", help="Build directory to serve")
-    ap.add_argument("--host", default="0.0.0.0", help="Host/IP to bind (e.g., 0.0.0.0 for WSL)")
-    ap.add_argument("--port", "-p", type=int, default=8000, help="Port")
-    args = ap.parse_args()
-
-    if not os.path.isdir(args.build_dir):
-        os.makedirs(args.build_dir, exist_ok=True)
-    
-    # Write the latest dashboard HTML with upload capability
-    write_index_html(args.build_dir)
-    
-    print(f"Starting dashboard server at http://{args.host}:{args.port}")
-    print(f"Build directory: {os.path.abspath(args.build_dir)}")
-    print("Press Ctrl+C to stop")
-    
-    serve_build_dir(args.build_dir, host=args.host, port=args.port)
-
-
-if __name__ == "__main__":
-    main()
+#!/usr/bin/env python3
+"""Serve the interactive dashboard with upload capability."""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+# Ensure local src/ is importable when running from repo root
+_HERE = os.path.dirname(__file__)
+_SRC = os.path.abspath(os.path.join(_HERE, "..", "src"))
+if _SRC not in sys.path:
+    sys.path.insert(0, _SRC)
+
+from mof_investviz.server import SERVER_MODES
+from mof_investviz.ui import serve_build_dir, write_index_html
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Serve the interactive dashboard with upload capability")
+    ap.add_argument("--build-dir", "-b", default="build", help="Build directory to serve")
+    ap.add_argument("--host", default="0.0.0.0", help="Host/IP to bind (e.g., 0.0.0.0 for WSL)")
+    ap.add_argument("--port", "-p", type=int, default=8000, help="Port")
+    ap.add_argument("--server", choices=SERVER_MODES, default="pool", help="pool: fixed worker pool with 503 backpressure (default); threading: thread per connection")
+    ap.add_argument("--http-workers", type=int, default=32, help="Worker threads in pool mode (default: 32)")
+    ap.add_argument("--http-queue", type=int, default=128, help="Pending connections before answering 503 in pool mode (default: 128)")
+    ap.add_argument("--idle-timeout", type=float, default=5.0, help="Keep-alive idle timeout in seconds (default: 5)")
+    ap.add_argument("--job-workers", type=int, default=2, help="Concurrent normalization jobs for async uploads (default: 2)")
+    ap.add_argument("--processes", type=int, default=None, help="Normalization worker processes (default: min(4, CPUs); 0 = in-thread)")
+    ap.add_argument("--session-ttl-hours", type=float, default=168.0, help="Delete sessions not accessed for this long (default: 168 = 7 days; 0 = never)")
+    ap.add_argument("--uploads-quota-mb", type=int, default=2048, help="Total size limit of uploads/ before LRU eviction (default: 2048; 0 = unlimited)")
+    ap.add_argument("--max-sessions", type=int, default=1000, help="Session count limit before LRU eviction (default: 1000; 0 = unlimited)")
+    ap.add_argument("--sqlite", action="store_true", help="Also store each session's normalized rows in an indexed SQLite file used by filtered exports")
+    ap.add_argument("--session-secret", default=None, help="Session ID key file, kept outside the build directory (default: .<build dir name>.session-secret next to it)")
+    args = ap.parse_args()
+
+    if not os.path.isdir(args.build_dir):
+        os.makedirs(args.build_dir, exist_ok=True)
+    
+    # Write the latest dashboard HTML with upload capability
+    write_index_html(args.build_dir)
+    
+    print(f"Starting dashboard server at http://{args.host}:{args.port}")
+    print(f"Build directory: {os.path.abspath(args.build_dir)}")
+    print("Press Ctrl+C to stop")
+    
+    serve_build_dir(
+        args.build_dir, host=args.host, port=args.port,
+        job_workers=args.job_workers, processes=args.processes,
+        server_mode=args.server, http_workers=args.http_workers,
+        http_queue=args.http_queue, idle_timeout=args.idle_timeout,
+        session_ttl=args.session_ttl_hours * 3600 or None,
+        uploads_quota=args.uploads_quota_mb * 1024 * 1024 or None,
+        max_sessions=args.max_sessions or None,
+        sqlite=args.sqlite, secret_path=args.session_secret,
+    )
+
+
+if __name__ == "__main__":
+    main()
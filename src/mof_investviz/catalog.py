@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import copy
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .downsample import downsample_series, lttb_indices
+from .summary_codec import encode_summary, loads_summary
+
+
+# ダッシュボードの遅延読み込みモード。
+# 初回はカタログ（ラベル・年の軸・構成比・ランキングと、系列ごとの小さな集計）だけを送り、
+# 系列の値はダッシュボードが選んだものを GET /api/series でまとめて取りに来る。
+#
+#   系列キー: "<ブロック>:<番号>"（ブロックは series / regions / countries、番号は各 series 配列の位置）
+#   カタログ: 系列を空にしたサマリのコンパクト形式に、系列ごとの見出しを
+#     "lazy": {"series": {ブロック: [{"label", "spark", "last", "min", "max", "points"}, ...]}, "max_batch"}
+#   として足したもの（ダッシュボードの DataStore が見出しを各 series 配列に戻す）。
+#   spark は LTTB で選んだ点を系列内の最小〜最大で 0〜100 の整数にしたもの（形だけを表す）
+#   derive: 時系列・前年比差分ビュー用に、間引く前の全解像度の系列から計算した値を付けて返す
+#     （"level" は値そのまま、"yoy" は前年差。どちらも 3 点移動平均 trend と 1 つ前の年の値 y_prev を付ける）
+SERIES_BLOCKS = ("series", "regions", "countries")
+SERIES_DERIVES = ("level", "yoy")
+# カタログに載せるスパークラインの点数
+SPARK_POINTS = 24
+# 1 回の /api/series で返す系列数の上限
+MAX_SERIES_PER_REQUEST = 256
+
+
+class SeriesKeyError(ValueError):
+    """系列キーの指定が不正（400 を返す）"""
+
+
+def _values(series: Dict[str, object]) -> List[float]:
+    return [float(v or 0.0) for v in series.get("y", [])]  # type: ignore[union-attr]
+
+
+def series_stub(series: Dict[str, object], spark_points: int = SPARK_POINTS) -> Dict[str, object]:
+    """系列の値を除いた見出し（スパークラインと最新値・最小・最大・点数）"""
+    ys = _values(series)
+    spark: List[int] = []
+    if ys:
+        lo, hi = min(ys), max(ys)
+        span = (hi - lo) or 1.0
+        spark = [round((ys[i] - lo) / span * 100) for i in lttb_indices(ys, spark_points)]
+    return {
+        "label": series.get("label", ""),
+        "spark": spark,
+        "last": ys[-1] if ys else None,
+        "min": min(ys) if ys else None,
+        "max": max(ys) if ys else None,
+        "points": len(ys),
+    }
+
+
+def _series_block(summary: Dict[str, object], block: str) -> List[Dict[str, object]]:
+    if block == "series":
+        items = summary.get("series")
+    else:
+        parent = summary.get(block)
+        items = parent.get("series") if isinstance(parent, dict) else None
+    return items if isinstance(items, list) else []
+
+
+def summary_catalog(summary: Dict[str, object]) -> Dict[str, object]:
+    """サマリの系列を見出しに置き換えたカタログ（コンパクト形式）を返す
+
+    系列の値の配列は含まないので、大きさは系列の長さによらない。
+    """
+    stripped = copy.copy(summary)
+    stubs: Dict[str, List[Dict[str, object]]] = {}
+    for block in SERIES_BLOCKS:
+        items = _series_block(summary, block)
+        if block == "series":
+            stripped["series"] = []
+        elif isinstance(summary.get(block), dict):
+            parent = dict(summary[block])  # type: ignore[arg-type]
+            parent["series"] = []
+            stripped[block] = parent
+        else:
+            continue
+        stubs[block] = [series_stub(s) for s in items]
+    out = encode_summary(stripped)
+    out["lazy"] = {"series": stubs, "max_batch": MAX_SERIES_PER_REQUEST}
+    return out
+
+
+def catalog_bytes(summary: Dict[str, object]) -> bytes:
+    return json.dumps(summary_catalog(summary), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def parse_series_keys(text: str) -> List[Tuple[str, int]]:
+    """"series:0,regions:3" のようなキー列を [(ブロック, 番号)] にする（重複は除く）"""
+    keys: List[Tuple[str, int]] = []
+    seen = set()
+    for part in (text or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        block, _, num = part.partition(":")
+        if block not in SERIES_BLOCKS or not num.isdigit():
+            raise SeriesKeyError(f"invalid series key: {part}")
+        key = (block, int(num))
+        if key not in seen:
+            seen.add(key)
+            keys.append(key)
+    if not keys:
+        raise SeriesKeyError("keys is required")
+    if len(keys) > MAX_SERIES_PER_REQUEST:
+        raise SeriesKeyError(f"too many series (max {MAX_SERIES_PER_REQUEST})")
+    return keys
+
+
+def derive_series(series: Dict[str, object], derive: str) -> Dict[str, object]:
+    """全解像度の系列に前年差（derive="yoy"）・3 点移動平均 trend・1 つ前の年の値 y_prev を付ける
+
+    間引いた系列で隣り合う点の差や平均を取ると間引いた年をまたいでしまうので、間引く前に計算する。
+    trend・y_prev は y と同じ長さで、downsample_series が y と同じ点を選ぶ。
+    """
+    ys = _values(series)
+    if derive == "yoy":
+        ys = [0.0] + [ys[i] - ys[i - 1] for i in range(1, len(ys))] if ys else []
+    out = dict(series)
+    out.update({"y": ys, "derive": derive, "y_prev": [None] + ys[:-1] if ys else []})
+    if len(ys) >= 3:
+        out["trend"] = [ys[0]] + [(ys[i - 1] + ys[i] + ys[i + 1]) / 3 for i in range(1, len(ys) - 1)] + [ys[-1]]
+    return out
+
+
+def select_series(summary: Dict[str, object], keys: Sequence[Tuple[str, int]],
+                  width: Optional[int] = None, derive: Optional[str] = None) -> List[Dict[str, object]]:
+    """キーで指定した系列を返す。width を指定すると時系列表示用の系列を間引く
+
+    derive（SERIES_DERIVES）を指定すると間引く前に derive_series を適用する。
+    countries は国別ビューが任意の年を引くため downsample_summary と同じく全解像度のまま返す。
+    """
+    if derive is not None and derive not in SERIES_DERIVES:
+        raise SeriesKeyError(f"invalid derive: {derive}")
+    out = []
+    for block, i in keys:
+        items = _series_block(summary, block)
+        if i >= len(items):
+            raise SeriesKeyError(f"series not found: {block}:{i}")
+        s = items[i]
+        if derive and block != "countries":
+            s = derive_series(s, derive)
+        if width and block != "countries":
+            s = downsample_series(s, width)
+        entry = {"key": f"{block}:{i}"}
+        entry.update(s)
+        out.append(entry)
+    return out
+
+
+class SummaryCache:
+    """展開済みサマリを保持する LRU（ファイルの更新時刻・サイズが変われば読み直す）
+
+    /api/series は 1 リクエストで数系列しか返さないので、毎回 summary.json を展開しないようにする。
+    カタログの JSON のようにサマリから作るものも、サマリと同じ寿命でメモする（derived）。
+    """
+
+    def __init__(self, max_entries: int = 8) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], Dict[str, object], Dict[str, object]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, path: str, stamp: Tuple[int, int]):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+        with open(path, "rb") as f:
+            summary = loads_summary(f.read())
+        entry = (stamp, summary, {})
+        with self._lock:
+            self.misses += 1
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get(self, path: str, stamp: Tuple[int, int]) -> Dict[str, object]:
+        return self._entry(path, stamp)[1]
+
+    def derived(self, path: str, stamp: Tuple[int, int], name: str, build: Callable[[Dict[str, object]], object]):
+        _, summary, memo = self._entry(path, stamp)
+        with self._lock:
+            if name in memo:
+                return memo[name]
+        value = build(summary)
+        with self._lock:
+            memo[name] = value
+        return value
+
+
+SUMMARIES = SummaryCache()
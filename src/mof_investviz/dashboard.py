@@ -4,6 +4,8 @@ import http.server
 import os
 import socketserver
 
+from .summary_codec import SUMMARY_DECODER_JS
+
 
 INDEX_HTML = """<!doctype html>
 <html lang="ja">
@@ -24,12 +26,13 @@ INDEX_HTML = """<!doctype html>
     label { font-size: 14px; color: #374151; }
   </style>
   <script>
+/*__SUMMARY_DECODER__*/
 let gData = null;
 
 async function loadSummary() {
   const res = await fetch('summary.json');
   if (!res.ok) throw new Error('summary.json が見つかりません');
-  const data = await res.json();
+  const data = decodeSummary(await res.json());
   gData = data;
   document.getElementById('title').textContent = data.title || 'InvestViz Dashboard (MVP)';
   
@@ -191,6 +194,7 @@ window.addEventListener('load', () => { loadSummary().catch(err => { document.ge
 </body>
 </html>
 """
+INDEX_HTML = INDEX_HTML.replace("/*__SUMMARY_DECODER__*/", SUMMARY_DECODER_JS.strip())
 
 
 def write_index_html(build_dir: str) -> str:
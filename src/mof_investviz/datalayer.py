@@ -0,0 +1,831 @@
+from __future__ import annotations
+
+
+# ダッシュボードのデータ層（JavaScript）。
+# サマリの展開と、ビューごとの描画用データ（型付き配列）の計算を受け持つ。
+# ページ内の <script id="investviz-data-layer"> として読み込まれ、同じソースから
+# Blob URL で Web Worker を起動する（Worker が使えない環境ではメインスレッドで同じコードを使う）。
+DATA_LAYER_JS = r"""
+// 計算の中断（新しいリクエストで置き換えられた・キャンセルされた）
+class InvestvizCancelled extends Error {
+  constructor() { super('cancelled'); this.cancelled = true; }
+}
+
+// 長い計算の途中でイベントループに制御を返し、キャンセル確認と進捗通知を行う
+class ComputeControl {
+  constructor(isCancelled, onProgress) {
+    this.isCancelled = isCancelled || (() => false);
+    this.onProgress = onProgress || (() => {});
+    this.last = Date.now();
+  }
+  async tick(done, total) {
+    if (Date.now() - this.last < 8) return;
+    this.onProgress(done, total);
+    await new Promise(r => setTimeout(r, 0));
+    this.last = Date.now();
+    if (this.isCancelled()) throw new InvestvizCancelled();
+  }
+  check() { if (this.isCancelled()) throw new InvestvizCancelled(); }
+}
+
+function f64(a) { return Float64Array.from(a || [], Number); }
+
+// 各点の横位置（0〜1）。サーバで間引いた系列は元のインデックス i と総点数 n を使う
+function seriesPositions(s, len) {
+  const pos = new Float64Array(len);
+  if (s && s.i && s.n > 1) { for (let k = 0; k < len; k++) pos[k] = s.i[k] / (s.n - 1); return pos; }
+  const d = Math.max(1, len - 1);
+  for (let k = 0; k < len; k++) pos[k] = k / d;
+  return pos;
+}
+
+function yoyDiff(ys) {
+  const out = new Float64Array(ys.length);
+  for (let i = 1; i < ys.length; i++) out[i] = ys[i] - ys[i - 1];
+  return out;
+}
+
+// 3 点移動平均（両端はそのまま）
+function movingAverage3(ys) {
+  const out = Float64Array.from(ys);
+  for (let i = 1; i < ys.length - 1; i++) out[i] = (ys[i - 1] + ys[i] + ys[i + 1]) / 3;
+  return out;
+}
+
+// 各点の前年の値（先頭は NaN）。サーバで間引いた系列は間引く前の系列から取った y_prev を使う
+function previousValues(ys, yPrev) {
+  if (yPrev) return Float64Array.from(yPrev, v => v === null ? NaN : Number(v));
+  const out = new Float64Array(ys.length).fill(NaN);
+  for (let i = 1; i < ys.length; i++) out[i] = ys[i - 1];
+  return out;
+}
+
+// 上位系列の索引（データの読み込み時に 1 回だけ作り、ビューの計算で共有する）
+//   years/col: 年の軸と 年→列 の対応、ys: 系列ごとの値（Float64Array）
+//   matrix: 系列×年の行列（行優先、欠損は 0）と全セルの最小・最大
+//   sorted/counts: 年ごとに系列の値を昇順に並べたもの（列優先）、stats/has: 年ごとの五数要約
+// 系列ごと・年ごとのループで ctl.tick を呼び、進捗通知とキャンセル確認を行う
+async function buildSeriesIndex(d, ctl) {
+  ctl = ctl || new ComputeControl();
+  const years = (d.years || []).map(String);
+  const col = new Map();
+  years.forEach((y, j) => col.set(y, j));
+  const all = d.series || [];
+  const M = all.length, N = years.length;
+  const labels = all.map(s => String(s.label || ''));
+  const ys = [];
+  const matrix = new Float64Array(M * N);
+  for (let i = 0; i < M; i++) {
+    const s = all[i], xs = s.x || [];
+    const y = f64(s.y);
+    ys.push(y);
+    for (let k = 0; k < xs.length; k++) {
+      const j = col.get(String(xs[k]));
+      if (j !== undefined) matrix[i * N + j] = y[k] || 0;
+    }
+    await ctl.tick(i + 1, M + N);
+  }
+  let vmin = Infinity, vmax = -Infinity;
+  for (let c = 0; c < matrix.length; c++) {
+    if (matrix[c] < vmin) vmin = matrix[c];
+    if (matrix[c] > vmax) vmax = matrix[c];
+  }
+  if (!isFinite(vmin) || !isFinite(vmax)) { vmin = 0; vmax = 1; }
+
+  const sorted = new Float64Array(N * M);
+  const counts = new Int32Array(N);
+  const stats = new Float64Array(N * 5);
+  const has = new Uint8Array(N);
+  let lo = Infinity, hi = -Infinity;
+  for (let j = 0; j < N; j++) {
+    const base = j * M;
+    let n = 0;
+    for (let i = 0; i < M; i++) {
+      const v = matrix[i * N + j];
+      if (isFinite(v)) sorted[base + n++] = v;
+    }
+    const vals = sorted.subarray(base, base + n).sort();
+    counts[j] = n;
+    if (!n) continue;
+    const q = p => { const idx = (n - 1) * p, i = Math.floor(idx), f = idx - i; return f ? vals[i] * (1 - f) + vals[i + 1] * f : vals[i]; };
+    stats[j * 5] = vals[0];
+    stats[j * 5 + 1] = q(0.25);
+    stats[j * 5 + 2] = q(0.5);
+    stats[j * 5 + 3] = q(0.75);
+    stats[j * 5 + 4] = vals[n - 1];
+    has[j] = 1;
+    if (vals[0] < lo) lo = vals[0];
+    if (vals[n - 1] > hi) hi = vals[n - 1];
+    await ctl.tick(M + j + 1, M + N);
+  }
+  if (!isFinite(lo) || !isFinite(hi)) { lo = 0; hi = 1; }
+  return {years, col, labels, ys, matrix, vmin, vmax, sorted, counts, stats, has, lo, hi};
+}
+
+function buffersOf(obj, out) {
+  // 結果に含まれる型付き配列のバッファ（transfer 対象）を集める
+  out = out || [];
+  if (!obj || typeof obj !== 'object') return out;
+  if (ArrayBuffer.isView(obj)) { if (!out.includes(obj.buffer)) out.push(obj.buffer); return out; }
+  for (const k of Object.keys(obj)) buffersOf(obj[k], out);
+  return out;
+}
+
+// ラベル検索の正規化：全角英数・半角カナを揃え（NFKC）、小文字化し、カタカナをひらがなに寄せる
+function normalizeLabel(s) {
+  s = String(s || '');
+  if (s.normalize) s = s.normalize('NFKC');
+  return s.toLowerCase().replace(/[ァ-ヶ]/g, c => String.fromCharCode(c.charCodeAt(0) - 0x60));
+}
+
+function labelWords(s) {
+  return normalizeLabel(s).split(/[\s/|,()（）・、]+/).filter(Boolean);
+}
+
+// 系列・地域ラベルの検索索引（データセットごとに 1 回だけ作る）。
+// ラベルは「日本語 / English / ...」の形なので区切りと空白で語に分け、
+//   hay: ラベルごとの正規化済み文字列（語を \u0001 で連結、先頭にも \u0001）… 部分一致と語頭一致の判定用
+//   tokens/starts/ids: 異なり語の昇順と、語ごとのラベル番号（ids[starts[k]..starts[k+1]]）… 前方一致を二分探索で引く
+function buildLabelSearch(labels) {
+  const hay = [], postings = new Map();
+  labels.forEach((label, id) => {
+    const words = labelWords(label);
+    hay.push('\u0001' + words.join('\u0001'));
+    for (const w of words) {
+      const list = postings.get(w);
+      if (!list) postings.set(w, [id]);
+      else if (list[list.length - 1] !== id) list.push(id);
+    }
+  });
+  const tokens = Array.from(postings.keys()).sort();
+  const starts = new Int32Array(tokens.length + 1);
+  let n = 0;
+  tokens.forEach((w, k) => { starts[k] = n; n += postings.get(w).length; });
+  starts[tokens.length] = n;
+  const ids = new Int32Array(n);
+  tokens.forEach((w, k) => ids.set(postings.get(w), starts[k]));
+  return {hay, tokens, starts, ids};
+}
+
+// 検索索引に対する逐次検索。空白で区切った語はすべて含むもの（順不同）に一致する。
+// 直前の問い合わせを延長した入力（1 文字追加など）は直前の結果だけを絞り込むので、
+// 打鍵ごとの計算は一致件数に比例する
+class LabelSearch {
+  constructor(index) {
+    this.index = index || {hay: [], tokens: [], starts: new Int32Array(1), ids: new Int32Array(0)};
+    this.lastQuery = null;
+    this.lastHits = null;
+  }
+
+  get size() { return this.index.hay.length; }
+
+  // 一致したラベル番号（すべての語が語頭で一致するものが先、同順位はラベル順）。空の問い合わせは null（全件）
+  find(query) {
+    const words = labelWords(query);
+    if (!words.length) { this.lastQuery = null; this.lastHits = null; return null; }
+    const key = words.join(' ');
+    const hay = this.index.hay;
+    const head = [], tail = [];
+    if (this.lastQuery === null || !key.startsWith(this.lastQuery)) {
+      if (words.length === 1) {
+        // 1 語なら語の前方一致を二分探索で引き、残りの部分一致だけを全件走査で探す
+        const prefix = this.prefixIds(words[0]);
+        for (const id of prefix) head.push(id);
+        for (let id = 0; id < hay.length; id++) {
+          if (!prefix.has(id) && hay[id].includes(words[0])) tail.push(id);
+        }
+      } else {
+        for (let id = 0; id < hay.length; id++) this.classify(id, words, head, tail);
+      }
+    } else {
+      for (const id of this.lastHits) this.classify(id, words, head, tail);
+    }
+    head.sort((a, b) => a - b);
+    tail.sort((a, b) => a - b);
+    this.lastQuery = key;
+    this.lastHits = head.concat(tail);
+    return this.lastHits;
+  }
+
+  classify(id, words, head, tail) {
+    const h = this.index.hay[id];
+    let atStart = true;
+    for (const w of words) {
+      if (!h.includes(w)) return;
+      if (atStart && !h.includes('\u0001' + w)) atStart = false;
+    }
+    (atStart ? head : tail).push(id);
+  }
+
+  // 語 q で始まる語を持つラベル番号の集合
+  prefixIds(q) {
+    const {tokens, starts, ids} = this.index;
+    let lo = 0, hi = tokens.length;
+    while (lo < hi) { const mid = (lo + hi) >> 1; if (tokens[mid] < q) lo = mid + 1; else hi = mid; }
+    const out = new Set();
+    for (let k = lo; k < tokens.length && tokens[k].startsWith(q); k++) {
+      for (let p = starts[k]; p < starts[k + 1]; p++) out.add(ids[p]);
+    }
+    return out;
+  }
+}
+
+// 展開済みのデータセットと索引を IndexedDB に保存し、再読み込み時は再検証（ETag）だけで復元する。
+// meta ストアに {key, etag, size, usedAt}、datasets ストアに {data, index} を置き、
+// 件数・容量の上限を超えたら最後に使ってから時間の経ったものから削除する
+const DATASET_DB = 'investviz';
+const DATASET_DB_VERSION = 1;
+const MAX_CACHED_DATASETS = 8;
+const MAX_CACHED_BYTES = 64 * 1024 * 1024;
+
+function idbRequest(req) {
+  return new Promise((resolve, reject) => { req.onsuccess = () => resolve(req.result); req.onerror = () => reject(req.error); });
+}
+
+function idbDone(tx) {
+  return new Promise((resolve, reject) => { tx.oncomplete = () => resolve(); tx.onerror = tx.onabort = () => reject(tx.error); });
+}
+
+class DatasetCache {
+  constructor() {
+    this.db = null;
+  }
+
+  // IndexedDB が使えない環境（プライベートモードなど）では null（キャッシュ無しで動く）
+  open() {
+    if (!this.db) {
+      this.db = new Promise(resolve => {
+        if (typeof indexedDB === 'undefined') { resolve(null); return; }
+        const req = indexedDB.open(DATASET_DB, DATASET_DB_VERSION);
+        req.onupgradeneeded = () => {
+          req.result.createObjectStore('meta', {keyPath: 'key'});
+          req.result.createObjectStore('datasets');
+        };
+        req.onsuccess = () => resolve(req.result);
+        req.onerror = req.onblocked = () => resolve(null);
+      });
+    }
+    return this.db;
+  }
+
+  async meta(key) {
+    const db = await this.open();
+    if (!db) return null;
+    return idbRequest(db.transaction('meta').objectStore('meta').get(key)).catch(() => null);
+  }
+
+  async get(key) {
+    const db = await this.open();
+    if (!db) return null;
+    const tx = db.transaction(['meta', 'datasets'], 'readwrite');
+    const [meta, record] = await Promise.all([
+      idbRequest(tx.objectStore('meta').get(key)),
+      idbRequest(tx.objectStore('datasets').get(key)),
+    ]);
+    if (!meta || !record) return null;
+    meta.usedAt = Date.now();
+    tx.objectStore('meta').put(meta);
+    await idbDone(tx);
+    return record;
+  }
+
+  async put(key, etag, size, record) {
+    const db = await this.open();
+    if (!db) return;
+    const tx = db.transaction(['meta', 'datasets'], 'readwrite');
+    tx.objectStore('datasets').put(record, key);
+    tx.objectStore('meta').put({key, etag, size, usedAt: Date.now()});
+    await idbDone(tx);
+    await this.evict();
+  }
+
+  async evict() {
+    const db = await this.open();
+    const tx = db.transaction(['meta', 'datasets'], 'readwrite');
+    const metas = await idbRequest(tx.objectStore('meta').getAll());
+    metas.sort((a, b) => b.usedAt - a.usedAt);
+    let count = 0, bytes = 0;
+    for (const m of metas) {
+      count++;
+      bytes += m.size || 0;
+      if (count > MAX_CACHED_DATASETS || (count > 1 && bytes > MAX_CACHED_BYTES)) {
+        tx.objectStore('meta').delete(m.key);
+        tx.objectStore('datasets').delete(m.key);
+      }
+    }
+    await idbDone(tx);
+  }
+}
+
+// 遅延読み込みモード（サーバのカタログ + /api/series）で、系列の値を必要になった分だけ取りに行く。
+// 取得した系列は件数上限付きの LRU に置き、同じ系列を取得中のリクエストは 1 本にまとめる。
+// 上限は上位系列の数より小さくしない（重ね描画・ヒートマップで全系列を使い回せるように）
+const MAX_LOADED_SERIES = 256;
+
+class SeriesLoader {
+  constructor(url, maxBatch, capacity) {
+    this.url = url;  // /api/series?sid=&width= の絶対 URL（keys はここに足す）
+    this.maxBatch = maxBatch || 64;
+    this.capacity = Math.max(MAX_LOADED_SERIES, capacity || 0);
+    this.loaded = new Map();    // キー → 系列（挿入順 = 使った順）
+    this.inflight = new Map();  // キー → 取得中のバッチ（Promise<Map>）
+  }
+
+  // keys の系列を返す（Map キー → 系列）。手元に無いものだけをバッチに分けて取得する
+  async ensure(keys, ctl) {
+    const got = new Map(), waits = [], missing = [];
+    keys = Array.from(new Set(keys));
+    for (const k of keys) {
+      const s = this.loaded.get(k);
+      if (s) { this.loaded.delete(k); this.loaded.set(k, s); got.set(k, s); }
+      else if (this.inflight.has(k)) waits.push(this.inflight.get(k));
+      else missing.push(k);
+    }
+    for (let b = 0; b < missing.length; b += this.maxBatch) {
+      const batch = missing.slice(b, b + this.maxBatch);
+      const p = this.fetchBatch(batch);
+      const settle = () => batch.forEach(k => { if (this.inflight.get(k) === p) this.inflight.delete(k); });
+      p.then(settle, settle);
+      batch.forEach(k => this.inflight.set(k, p));
+      waits.push(p);
+    }
+    for (const m of await Promise.all(waits)) {
+      for (const k of keys) if (!got.has(k) && m.has(k)) got.set(k, m.get(k));
+    }
+    if (ctl) ctl.check();
+    return got;
+  }
+
+  async fetchBatch(keys) {
+    const res = await fetch(this.url + '&keys=' + encodeURIComponent(keys.join(',')));
+    if (!res.ok) throw new Error(`series fetch failed (${res.status})`);
+    const body = await res.json();
+    const out = new Map();
+    for (const s of body.series || []) {
+      out.set(s.key, s);
+      this.loaded.set(s.key, s);
+    }
+    while (this.loaded.size > this.capacity) this.loaded.delete(this.loaded.keys().next().value);
+    return out;
+  }
+}
+
+class DataStore {
+  constructor() {
+    this.data = null;
+    this.index = null;
+    this.loader = null;  // 遅延読み込みモードの系列取得（全系列を持つサマリでは null）
+    this.fullLoader = null;  // 同・間引かない系列の取得（ヒートマップ・箱ひげ図の行列用）
+    this.derivedLoaders = new Map();  // 同・前年差などをサーバで計算した系列の取得（derive → SeriesLoader）
+    this.pinned = new Map();  // 計算中のビューが使う系列（遅延読み込みモード）
+    this.version = 0;
+    this.cache = new DatasetCache();
+  }
+
+  // サマリ（コンパクト形式・従来形式のどちらでも）を読み込み、カタログを返す。
+  // persist {key, etag, size} を渡すと展開結果と索引を IndexedDB に保存する（完了は待たない）。
+  // サーバのカタログ（lazy 付き）なら系列の値は持たず、source.series_url から必要な分だけ取る
+  async load(summary, persist, source, ctl) {
+    await this.setData(decodeSummary(summary), null, source, ctl);
+    if (persist && persist.etag) {
+      this.cache.put(persist.key, persist.etag, persist.size, {data: this.data, index: this.index}).catch(() => {});
+    }
+    return this.catalog();
+  }
+
+  // 索引の計算（await を挟む）を先に済ませ、差し替えは同期的に行う
+  // （計算中に届いたビューの要求は前のデータセットで答え、キャンセルされたら前のまま残す）
+  async setData(data, index, source, ctl) {
+    if (!data.lazy && !index) index = await buildSeriesIndex(data, ctl);
+    this.data = data;
+    this.pinned = new Map();
+    if (data.lazy) {
+      // カタログの系列の見出しを各 series 配列に戻す。索引（上位系列の行列）はヒートマップ・箱ひげ図を開いたときに作る
+      const stubs = data.lazy.series || {};
+      if (stubs.series) data.series = stubs.series;
+      for (const block of ['regions', 'countries']) if (stubs[block] && data[block]) data[block].series = stubs[block];
+      this.index = null;
+      const n = (data.series || []).length;
+      this.loader = new SeriesLoader(source && source.series_url, data.lazy.max_batch, n);
+      this.fullLoader = new SeriesLoader(source && (source.full_url || source.series_url), data.lazy.max_batch, n);
+      this.derivedLoaders = new Map();
+    } else {
+      this.index = index;
+      this.loader = null;
+      this.fullLoader = null;
+    }
+    this.version++;
+  }
+
+  // 保存済みデータセットの ETag（無ければ null）
+  async cachedTag(key) {
+    const meta = await this.cache.meta(key);
+    return meta ? meta.etag : null;
+  }
+
+  // 保存済みのデータセットと索引をそのまま使う（無ければ null）
+  async restore(key, source) {
+    const record = await this.cache.get(key).catch(() => null);
+    if (!record) return null;
+    await this.setData(record.data, record.index, source);
+    return this.catalog();
+  }
+
+  // 系列・地域ラベルの検索索引（データセットが変わったときだけ作り直す）
+  labelSearch() {
+    if (!this.search || this.search.version !== this.version) {
+      const d = this.data || {};
+      this.search = {
+        version: this.version,
+        series: buildLabelSearch((d.series || []).map((s, i) => s.label || `series_${i}`)),
+        regions: buildLabelSearch((d.regions && d.regions.available) || []),
+      };
+    }
+    return {series: this.search.series, regions: this.search.regions};
+  }
+
+  // メインスレッドがコントロールの構築に使う軽量な情報（ラベルと年の軸のみ）
+  catalog() {
+    const d = this.data || {};
+    return {
+      version: this.version,
+      title: d.title || 'MVP Summary',
+      years: (d.years || []).map(String),
+      series: (d.series || []).map((s, i) => s.label || `series_${i}`),
+      regions: (d.regions && d.regions.available) || [],
+      countries: (d.countries && d.countries.available) || [],
+      composition_year: (d.composition && d.composition.year) || '',
+      sources: d.sources || [],
+      search: this.labelSearch(),
+      // 遅延読み込みモードではカタログの系列ごとのスパークライン（ピッカーに表示）
+      sparks: d.lazy ? (d.series || []).map(s => s.spark || null) : null,
+    };
+  }
+
+  async view(req, ctl) {
+    ctl = ctl || new ComputeControl();
+    ctl.check();
+    if (!this.data) throw new Error('no dataset loaded');
+    if (this.loader) this.pinned = await this.prepare(req, ctl);
+    let result;
+    switch (req.view) {
+      case 'timeseries':
+      case 'yoy_diff': result = await this.seriesView(req, ctl); break;
+      case 'composition': result = this.compositionView(); break;
+      case 'heatmap': result = this.heatmapView(); break;
+      case 'boxplot': result = this.boxplotView(); break;
+      case 'country_pie':
+      case 'country_bar': result = this.countryView(req); break;
+      case 'multi_panel': result = await this.multiPanelView(req, ctl); break;
+      default: throw new Error('unknown view: ' + req.view);
+    }
+    return {result, transfer: buffersOf(result)};
+  }
+
+  // 遅延読み込みモード：ビューが使う系列を取得し、索引が要るビューなら索引を作る
+  async prepare(req, ctl) {
+    const d = this.data;
+    const top = (d.series || []).map((_, i) => 'series:' + i);
+    const keys = [];
+    if (req.view === 'heatmap' || req.view === 'boxplot') {
+      // 行列は年ごとの値を引くので、描画幅に間引いた系列（間引いた年が 0 になる）ではなく全解像度の系列から作る
+      if (!this.index) {
+        const version = this.version;
+        const got = await this.fullLoader.ensure(top, ctl);
+        const index = await buildSeriesIndex({years: d.years, series: top.map(k => got.get(k) || {x: [], y: []})}, ctl);
+        if (version === this.version) this.index = index;
+      }
+    } else if (req.view === 'timeseries' || req.view === 'yoy_diff' || req.view === 'multi_panel') {
+      // 選んだ系列は前年差・傾向線・前年の値をサーバで間引く前に計算したもの（"<derive>|<キー>" で置く）、
+      // 重ね描画の系列は値だけを取る
+      const r = req.view !== 'multi_panel' ? this.regionPosition(req.region) : -1;
+      const key = r >= 0 ? 'regions:' + r : (req.measure || 0) < top.length ? top[req.measure || 0] : null;
+      if (req.overlay && req.view !== 'multi_panel') keys.push(...top);
+      const derives = !key ? [] : req.view === 'multi_panel' ? ['level', 'yoy'] : [req.view === 'yoy_diff' ? 'yoy' : 'level'];
+      const [got, ...derived] = await Promise.all([
+        keys.length ? this.loader.ensure(keys, ctl) : new Map(),
+        ...derives.map(kind => this.derivedLoader(kind).ensure([key], ctl)),
+      ]);
+      derives.forEach((kind, j) => { if (derived[j].has(key)) got.set(kind + '|' + key, derived[j].get(key)); });
+      return got;
+    }
+    return new Map();
+  }
+
+  derivedLoader(kind) {
+    let loader = this.derivedLoaders.get(kind);
+    if (!loader) {
+      loader = new SeriesLoader(this.loader.url + '&derive=' + kind, this.loader.maxBatch, 0);
+      this.derivedLoaders.set(kind, loader);
+    }
+    return loader;
+  }
+
+  regionPosition(region) {
+    const regions = this.data.regions;
+    if (!region || !regions || !regions.series) return -1;
+    return regions.series.findIndex(s => s.label === region);
+  }
+
+  // 系列（block: series / regions / countries）。遅延読み込みモードでは prepare で取得したもの
+  // （derive を渡すとサーバで前年差などを計算した方）
+  seriesAt(block, i, derive) {
+    const list = block === 'series' ? this.data.series : (this.data[block] || {}).series;
+    if (!list || !list[i]) return null;
+    return this.loader ? this.pinned.get((derive ? derive + '|' : '') + `${block}:${i}`) || null : list[i];
+  }
+
+  selectedSeries(req, derive) {
+    if (req.region && this.data.regions && this.data.regions.series) {
+      return this.seriesAt('regions', this.regionPosition(req.region), derive) || {x: [], y: [], label: req.region};
+    }
+    return this.seriesAt('series', req.measure || 0, derive) || {x: [], y: [], label: 'series'};
+  }
+
+  // 時系列・前年比差分（重ね描画時は上位系列すべて）
+  async seriesView(req, ctl) {
+    ctl = ctl || new ComputeControl();
+    const yoy = req.view === 'yoy_diff';
+    const s = this.selectedSeries(req, yoy ? 'yoy' : 'level');
+    // サーバで間引く前に計算済みの系列（遅延読み込みモード）は差分・傾向線・前年の値をそのまま使う
+    const derived = s.derive === (yoy ? 'yoy' : 'level');
+    // 遅延読み込みモードの索引は行列ビュー用（全解像度）なので、間引いた系列の x・位置とは揃わない
+    const byIndex = this.index && !this.loader && !(req.region && this.data.regions && this.data.regions.series);
+    let ys = byIndex && this.index.ys[req.measure || 0] ? this.index.ys[req.measure || 0].slice() : f64(s.y);
+    if (yoy && !derived) ys = yoyDiff(ys);
+    const out = {
+      label: s.label, x: (s.x || []).map(String), y: ys, pos: seriesPositions(s, ys.length),
+      prev: previousValues(ys, derived ? s.y_prev : null), y_min: null, y_max: null, trend: null, overlay: null,
+    };
+    let lo = Infinity, hi = -Infinity;
+    const extend = a => { for (let i = 0; i < a.length; i++) { if (a[i] < lo) lo = a[i]; if (a[i] > hi) hi = a[i]; } };
+    extend(ys);
+    if (req.overlay) {
+      const all = this.data.series || [];
+      out.overlay = [];
+      for (let i = 0; i < all.length; i++) {
+        const o = all[i], t = this.seriesAt('series', i) || o;
+        const y = this.index && !this.loader ? this.index.ys[i].slice() : f64(t.y);
+        extend(y);
+        out.overlay.push({label: o.label, y, pos: seriesPositions(t, y.length)});
+        await ctl.tick(i + 1, all.length);
+      }
+    } else {
+      // 間引き済み系列は区間の最小・最大（エンベロープ）も軸範囲に含める
+      if ((!yoy || derived) && s.y_min && s.y_max) {
+        out.y_min = f64(s.y_min); out.y_max = f64(s.y_max);
+        extend(out.y_min); extend(out.y_max);
+      }
+      if (req.trend && ys.length >= 3) out.trend = derived && s.trend ? f64(s.trend) : movingAverage3(ys);
+    }
+    if (!isFinite(lo)) { lo = 0; hi = 0; }
+    out.lo = lo; out.hi = hi;
+    return out;
+  }
+
+  compositionView() {
+    const comp = this.data.composition || {labels: [], share: []};
+    return {year: comp.year || '', labels: comp.labels || [], share: f64(comp.share)};
+  }
+
+  // 系列×年の行列（行優先）。索引の行列をそのまま複製して渡す（結果は Worker から移譲されるため）
+  heatmapView() {
+    const idx = this.index;
+    return {rows: idx.labels, cols: idx.years, values: idx.matrix.slice(), vmin: idx.vmin, vmax: idx.vmax};
+  }
+
+  // 年ごとの系列分布の五数要約 [min, q1, median, q3, max]（行優先・年×5、索引で計算済み）
+  boxplotView() {
+    const idx = this.index;
+    return {years: idx.years, stats: idx.stats.slice(), has: idx.has.slice(), lo: idx.lo, hi: idx.hi};
+  }
+
+  // 指定年の国別ランキング（正の値のみ・値の降順）。
+  // サマリの rankings_by_year（アップロード時に事前計算）を引き、無い旧サマリでは系列から集計する
+  countryRanking(year) {
+    const countries = this.data.countries;
+    if (!countries) return {labels: [], values: [], total: 0};
+    const table = countries.rankings_by_year && countries.rankings_by_year[String(year)];
+    if (table) {
+      let k = 0;
+      while (k < table.countries.length && table.values[k] > 0) k++;
+      return {labels: table.countries.slice(0, k), values: table.values.slice(0, k), total: table.total};
+    }
+    const items = [];
+    let total = 0;
+    for (const s of (countries.series || [])) {
+      if (!s.x || !s.y) continue;
+      const idx = s.x.indexOf(String(year));
+      const val = idx >= 0 ? Number(s.y[idx] || 0) : 0;
+      if (val > 0) { items.push([s.label, val]); total += val; }
+    }
+    items.sort((a, b) => b[1] - a[1]);
+    return {labels: items.map(d => d[0]), values: items.map(d => d[1]), total};
+  }
+
+  latestYear() {
+    const years = this.data.years || [];
+    return years.length ? String(years[years.length - 1]) : '';
+  }
+
+  // 国別ビュー：年・並び順・表示数・「その他」を適用した表示用データ
+  countryView(req) {
+    const year = req.year || this.latestYear() || '2025';
+    const available = !!(this.data.countries && this.data.countries.series && this.data.countries.series.length);
+    const r = this.countryRanking(year);
+    let order = r.labels.map((_, i) => i);
+    if (req.view === 'country_bar') {
+      if (req.sort_by === 'value_asc') order.reverse();
+      else if (req.sort_by === 'name') order.sort((a, b) => r.labels[a].localeCompare(r.labels[b]));
+      else if (req.sort_by === 'name_desc') order.sort((a, b) => r.labels[b].localeCompare(r.labels[a]));
+    }
+    const topN = req.top_n || 10;
+    order = order.slice(0, topN);
+    const labels = order.map(i => r.labels[i]);
+    const values = order.map(i => r.values[i]);
+    // 「その他」を集約（円グラフ用、合計は全体の total のまま）
+    if (req.view === 'country_pie' && req.others && r.labels.length > topN) {
+      const othersValue = r.total - values.reduce((a, v) => a + v, 0);
+      if (othersValue > 0) { labels.push('その他'); values.push(othersValue); }
+    }
+    return {available, year, top_n: topN, labels, values: f64(values), total: r.total};
+  }
+
+  async multiPanelView(req, ctl) {
+    const base = {measure: req.measure || 0, region: ''};
+    return {
+      timeseries: await this.seriesView(Object.assign({view: 'timeseries'}, base), ctl),
+      yoy_diff: await this.seriesView(Object.assign({view: 'yoy_diff'}, base), ctl),
+      ranking: this.countryView({view: 'country_bar', year: this.latestYear(), top_n: 5}),
+      composition: this.compositionView(),
+    };
+  }
+}
+
+// Worker とメインスレッド（Worker が使えない場合）で共通のメッセージ処理
+async function handleDataMessage(store, msg, ctl) {
+  switch (msg.type) {
+    case 'load': {
+      const summary = msg.buffer ? JSON.parse(new TextDecoder().decode(msg.buffer)) : msg.summary;
+      const persist = msg.cache && Object.assign({size: msg.buffer ? msg.buffer.byteLength : 0}, msg.cache);
+      return {result: await store.load(summary, persist, msg.source, ctl), transfer: []};
+    }
+    case 'cached': return {result: await store.cachedTag(msg.key), transfer: []};
+    case 'restore': return {result: await store.restore(msg.key, msg.source), transfer: []};
+    case 'view': return store.view(msg.req, ctl);
+    default: throw new Error('unknown message: ' + msg.type);
+  }
+}
+
+// Worker として起動された場合のメッセージループ
+//   main → worker: {type:'load', id, buffer|summary, cache, source} / {type:'cached', id, key} /
+//                  {type:'restore', id, key, source} /
+//                  {type:'view', id, req} / {type:'cancel', id}
+//   worker → main: {type:'ready'}（起動完了）/ {type:'progress', id, done, total} / {type:'result', id, result} /
+//                  {type:'cancelled', id} / {type:'error', id, message}
+if (typeof WorkerGlobalScope !== 'undefined' && self instanceof WorkerGlobalScope) {
+  const store = new DataStore();
+  const running = new Set();
+  const cancelled = new Set();
+  self.onmessage = async (ev) => {
+    const msg = ev.data;
+    if (msg.type === 'cancel') { if (running.has(msg.id)) cancelled.add(msg.id); return; }
+    running.add(msg.id);
+    const ctl = new ComputeControl(
+      () => cancelled.has(msg.id),
+      (done, total) => self.postMessage({type: 'progress', id: msg.id, done, total}),
+    );
+    try {
+      const out = await handleDataMessage(store, msg, ctl);
+      if (cancelled.delete(msg.id)) { self.postMessage({type: 'cancelled', id: msg.id}); return; }
+      self.postMessage({type: 'result', id: msg.id, result: out.result}, out.transfer);
+    } catch (e) {
+      cancelled.delete(msg.id);
+      if (e && e.cancelled) self.postMessage({type: 'cancelled', id: msg.id});
+      else self.postMessage({type: 'error', id: msg.id, message: String((e && e.message) || e)});
+    } finally {
+      running.delete(msg.id);
+    }
+  };
+  self.postMessage({type: 'ready'});
+}
+"""
+
+# メインスレッド側のクライアント。データ層スクリプトのソースから Worker を起動し、
+# 起動できなければ同じ DataStore をメインスレッドで使う。
+DATA_CLIENT_JS = r"""
+class DataClient {
+  constructor(sourceId) {
+    this.seq = 0;
+    this.pending = new Map();
+    this.queue = [];      // Worker の起動完了（ready）までに送るメッセージ
+    this.ready = false;
+    this.current = null;  // 実行中のビューリクエスト（新しいリクエストで置き換える）
+    this.onprogress = null;
+    this.worker = null;
+    this.local = null;
+    try {
+      const src = document.getElementById(sourceId).textContent;
+      const url = URL.createObjectURL(new Blob([src], {type: 'text/javascript'}));
+      this.worker = new Worker(url);
+      this.worker.onmessage = ev => this.onMessage(ev.data);
+      this.worker.onerror = () => { if (!this.ready) this.fallback(); };
+    } catch (e) {
+      this.fallback();
+    }
+  }
+
+  // Worker が使えない（CSP や file:// の制限など）場合はメインスレッドで計算する。
+  // 起動前に溜めたメッセージはまだ移譲していないので、そのままローカルで処理できる
+  fallback() {
+    if (this.worker) { this.worker.terminate(); this.worker = null; }
+    this.local = new DataStore();
+    this.localCancelled = new Set();
+    const queued = this.queue;
+    this.queue = [];
+    for (const {msg} of queued) {
+      const p = this.pending.get(msg.id);
+      this.pending.delete(msg.id);
+      this.callLocal(msg).then(p.resolve, p.reject);
+    }
+  }
+
+  onMessage(msg) {
+    if (msg.type === 'ready') {
+      this.ready = true;
+      for (const {msg: m, transfer} of this.queue) this.worker.postMessage(m, transfer);
+      this.queue = [];
+      return;
+    }
+    const p = this.pending.get(msg.id);
+    if (!p) return;
+    if (msg.type === 'progress') { if (this.onprogress) this.onprogress(msg.done, msg.total); return; }
+    this.pending.delete(msg.id);
+    if (msg.type === 'result') p.resolve(msg.result);
+    else if (msg.type === 'cancelled') p.reject(new InvestvizCancelled());
+    else p.reject(new Error(msg.message));
+  }
+
+  call(msg, transfer) {
+    const id = ++this.seq;
+    msg.id = id;
+    if (!this.worker) return {id, promise: this.callLocal(msg)};
+    const promise = new Promise((resolve, reject) => this.pending.set(id, {resolve, reject}));
+    if (this.ready) this.worker.postMessage(msg, transfer || []);
+    else this.queue.push({msg, transfer: transfer || []});
+    return {id, promise};
+  }
+
+  async callLocal(msg) {
+    const ctl = new ComputeControl(() => this.localCancelled.has(msg.id), this.onprogress);
+    try {
+      return (await handleDataMessage(this.local, msg, ctl)).result;
+    } finally {
+      this.localCancelled.delete(msg.id);
+    }
+  }
+
+  cancel(id) {
+    if (!this.worker) { this.localCancelled.add(id); return; }
+    const i = this.queue.findIndex(q => q.msg.id === id);
+    if (i >= 0) {
+      // 未送信ならキューから外すだけ
+      this.queue.splice(i, 1);
+      const p = this.pending.get(id);
+      this.pending.delete(id);
+      if (p) p.reject(new InvestvizCancelled());
+      return;
+    }
+    this.worker.postMessage({type: 'cancel', id});
+  }
+
+  // payload: {buffer: ArrayBuffer}（JSON のバイト列、Worker に移譲する）または {summary: object}。
+  // cache: {key, etag} を付けると展開結果を IndexedDB に保存する。
+  // source: {series_url, full_url}（カタログを読み込むとき、系列の値を取りに行く /api/series の絶対 URL。
+  //   series_url は描画幅に間引く、full_url は間引かない）
+  load(payload) {
+    if (this.current) { this.cancel(this.current); this.current = null; }
+    const msg = Object.assign({type: 'load'}, payload);
+    return this.call(msg, payload.buffer ? [payload.buffer] : []).promise;
+  }
+
+  // 保存済みデータセットの ETag（無ければ null）
+  cachedTag(key) {
+    return this.call({type: 'cached', key}).promise;
+  }
+
+  // 保存済みデータセットを読み込んでカタログを返す（無ければ null）
+  restore(key, source) {
+    if (this.current) { this.cancel(this.current); this.current = null; }
+    return this.call({type: 'restore', key, source}).promise;
+  }
+
+  // ビューの描画用データを要求する（前のリクエストが未完了ならキャンセルする）
+  request(req) {
+    if (this.current) this.cancel(this.current);
+    const {id, promise} = this.call({type: 'view', req});
+    this.current = id;
+    return promise.finally(() => { if (this.current === id) this.current = null; });
+  }
+}
+"""
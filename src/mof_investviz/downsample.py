@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import copy
+from typing import Dict, List, Sequence, Tuple
+
+
+# 1 点あたりの最小ピクセル幅（target width からの点数上限 = width / これ）
+PIXELS_PER_POINT = 2
+# これより短い系列は間引かない
+MIN_POINTS = 3
+# y と同じ長さで、間引くときに y と同じ点を選ぶ配列（catalog.derive_series が付ける）
+ALIGNED_KEYS = ("trend", "y_prev")
+
+
+def target_points(width: int) -> int:
+    """描画幅（px）から系列あたりの点数上限を決める"""
+    return max(MIN_POINTS, int(width) // PIXELS_PER_POINT)
+
+
+def _bucket_bounds(n: int, threshold: int) -> List[Tuple[int, int]]:
+    """先頭・末尾を除いた n-2 点を threshold-2 個のバケットに分割する [start, end)"""
+    every = (n - 2) / (threshold - 2)
+    bounds = []
+    for b in range(threshold - 2):
+        start = int(b * every) + 1
+        end = min(int((b + 1) * every) + 1, n - 1)
+        bounds.append((start, max(end, start + 1)))
+    return bounds
+
+
+def lttb_indices(ys: Sequence[float], threshold: int, xs: Sequence[float] = ()) -> List[int]:
+    """Largest-Triangle-Three-Buckets で残す点のインデックスを返す
+
+    xs を省略すると等間隔（インデックス）とみなす。先頭と末尾の点は必ず残す。
+    """
+    n = len(ys)
+    if threshold >= n or threshold < MIN_POINTS:
+        return list(range(n))
+    x = (lambda i: float(xs[i])) if xs else float
+    bounds = _bucket_bounds(n, threshold)
+    picked = [0]
+    a = 0
+    for b, (start, end) in enumerate(bounds):
+        # 次のバケットの平均点（最後のバケットの次は末尾の点）
+        if b + 1 < len(bounds):
+            ns, ne = bounds[b + 1]
+        else:
+            ns, ne = n - 1, n
+        avg_x = sum(x(i) for i in range(ns, ne)) / (ne - ns)
+        avg_y = sum(ys[i] for i in range(ns, ne)) / (ne - ns)
+        ax, ay = x(a), ys[a]
+        best, best_area = start, -1.0
+        for i in range(start, end):
+            area = abs((ax - avg_x) * (ys[i] - ay) - (ax - x(i)) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = i, area
+        picked.append(best)
+        a = best
+    picked.append(n - 1)
+    return picked
+
+
+def minmax_envelope(ys: Sequence[float], indices: Sequence[int]) -> Tuple[List[float], List[float]]:
+    """間引き後の各点が代表する区間（前後の採用点の中間まで）の最小・最大値"""
+    lo: List[float] = []
+    hi: List[float] = []
+    k = len(indices)
+    for j, idx in enumerate(indices):
+        start = 0 if j == 0 else (indices[j - 1] + idx) // 2 + 1
+        end = len(ys) if j == k - 1 else (idx + indices[j + 1]) // 2 + 1
+        window = ys[start:end] if end > start else [ys[idx]]
+        lo.append(min(window))
+        hi.append(max(window))
+    return lo, hi
+
+
+def downsample_series(series: Dict[str, object], width: int) -> Dict[str, object]:
+    """{"label","x","y"} 形式の系列を描画幅に合わせて間引く
+
+    間引いた場合は元のインデックス `i`、総点数 `n`、区間の最小・最大 `y_min`/`y_max` を付ける。
+    ALIGNED_KEYS の配列があれば y と同じ点を選ぶ。
+    """
+    ys = [float(v or 0.0) for v in series.get("y", [])]
+    threshold = target_points(width)
+    if len(ys) <= threshold:
+        return series
+    idx = lttb_indices(ys, threshold)
+    lo, hi = minmax_envelope(ys, idx)
+    xs = series.get("x", [])
+    out = dict(series)
+    out.update({
+        "x": [xs[i] for i in idx],
+        "y": [ys[i] for i in idx],
+        "i": idx,
+        "n": len(ys),
+        "y_min": lo,
+        "y_max": hi,
+    })
+    for key in ALIGNED_KEYS:
+        values = series.get(key)
+        if isinstance(values, list) and len(values) == len(ys):
+            out[key] = [values[i] for i in idx]
+    return out
+
+
+def downsample_summary(summary: Dict[str, object], width: int) -> Dict[str, object]:
+    """時系列表示に使う系列（series / regions.series）を間引いたコピーを返す
+
+    countries.series は国別ビューが任意の年を引くため全解像度のまま残す。
+    """
+    out = copy.copy(summary)
+    if isinstance(out.get("series"), list):
+        out["series"] = [downsample_series(s, width) for s in out["series"]]
+    regions = out.get("regions")
+    if isinstance(regions, dict) and isinstance(regions.get("series"), list):
+        regions = dict(regions)
+        regions["series"] = [downsample_series(s, width) for s in regions["series"]]
+        out["regions"] = regions
+    out["downsampled"] = {"width": int(width), "max_points": target_points(width)}
+    return out
+
+
+def summary_is_downsampled(summary: Dict[str, object]) -> bool:
+    """downsample_summary の結果に実際に間引かれた系列があるか"""
+    blocks = [summary.get("series")]
+    regions = summary.get("regions")
+    if isinstance(regions, dict):
+        blocks.append(regions.get("series"))
+    return any("i" in s for block in blocks if isinstance(block, list) for s in block)
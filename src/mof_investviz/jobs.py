@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import threading
+import time
+import multiprocessing
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+from .sessions import UPLOADS_DIR, UploadFile, create_session, session_links, warm_worker
+
+
+class JobCancelled(Exception):
+    """キャンセル要求により処理を中断した"""
+
+
+class JobQueueFull(Exception):
+    """待ち行列が上限に達している"""
+
+
+@dataclass
+class Job:
+    id: str
+    filename: str
+    state: str = "queued"  # queued / running / done / error / cancelled
+    stage: str = "queued"
+    percent: float = 0.0
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    session_id: Optional[str] = None
+    cached: bool = False
+    error: Optional[str] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _stage_started: float = field(default=0.0, repr=False)
+
+    def set_stage(self, stage: str, percent: float) -> None:
+        """進捗を更新する（前ステージの所要時間を timings に記録）"""
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.id)
+        if stage == self.stage:
+            self.percent = percent
+            return
+        now = time.time()
+        if self.stage != "queued":
+            self.timings[self.stage] = round(now - self._stage_started, 4)
+        self.stage = stage
+        self.percent = percent
+        self._stage_started = now
+
+    def finish(self, state: str) -> None:
+        now = time.time()
+        if self.state == "running" and self.stage not in self.timings:
+            self.timings[self.stage] = round(now - self._stage_started, 4)
+        self.state = state
+        self.finished = now
+        if state == "done":
+            self.stage = "done"
+            self.percent = 100.0
+
+    @property
+    def is_finished(self) -> bool:
+        return self.state in ("done", "error", "cancelled")
+
+    def to_dict(self) -> Dict[str, object]:
+        d: Dict[str, object] = {
+            "job_id": self.id,
+            "filename": self.filename,
+            "state": self.state,
+            "stage": self.stage,
+            "percent": round(self.percent, 1),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed": round((self.finished or time.time()) - (self.started or self.created), 4),
+            "timings": dict(self.timings),
+        }
+        if self.state == "done" and self.session_id:
+            d.update({
+                "session_id": self.session_id,
+                "cached": self.cached,
+                "links": session_links(self.session_id),
+                "summary_url": f"/uploads/{self.session_id}/summary.json",
+            })
+        if self.error:
+            d["error"] = self.error
+        return d
+
+
+def _ping() -> None:
+    pass
+
+
+def start_process_pool(processes: int) -> ProcessPoolExecutor:
+    """正規化用のプロセスプールを起動し、全ワーカーを事前に立ち上げておく
+
+    スレッドを抱えたサーバからの fork を避けるため spawn で起動する。
+    """
+    pool = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=warm_worker,
+    )
+    for f in [pool.submit(_ping) for _ in range(processes)]:
+        f.result()
+    return pool
+
+
+class JobManager:
+    """アップロード正規化ジョブの有界ワーカープール
+
+    同時実行数は workers、待ち行列は max_pending で制限する。
+    完了したジョブは retention 秒だけ状態を保持する。
+    process_pool を渡すと CPU 処理はそちらで実行し、ワーカースレッドは待機のみ行う。
+    sqlite=True ならセッションごとに normalized.sqlite も作る。
+    secret_path はセッション ID の秘密鍵（省略時は uploads_dir から決める、sessions.default_secret_path）。
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_pending: int = 16,
+        retention: float = 600.0,
+        uploads_dir: str = UPLOADS_DIR,
+        process_pool: Optional[Executor] = None,
+        sqlite: bool = False,
+        secret_path: Optional[str] = None,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.retention = retention
+        self.uploads_dir = uploads_dir
+        self.process_pool = process_pool
+        self.sqlite = sqlite
+        self.secret_path = secret_path
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="normalize")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if not j.is_finished)
+
+    def submit_upload(self, files: Sequence[UploadFile]) -> Job:
+        """files は expand_upload 済みの (ファイル名, 内容) の一覧"""
+        job = Job(id=uuid.uuid4().hex, filename=", ".join(name for name, _ in files))
+        with self._lock:
+            self._prune_locked()
+            active = sum(1 for j in self._jobs.values() if not j.is_finished)
+            if active >= self.workers + self.max_pending:
+                raise JobQueueFull(f"{active} jobs in progress")
+            self._jobs[job.id] = job
+        self._executor.submit(self._run_upload, job, list(files))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """キャンセルを要求する（実行中のジョブは次のステージ境界で停止）"""
+        job = self.get(job_id)
+        if job is None or job.is_finished:
+            return job
+        job.cancel_event.set()
+        if job.state == "queued":
+            job.finish("cancelled")
+        return job
+
+    def all_jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self) -> None:
+        for job in self.all_jobs():
+            job.cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+
+    def create_session(self, files: Sequence[UploadFile]):
+        """同期アップロード用：呼び出しスレッドで待ち、CPU 処理はプロセスプールに任せる"""
+        return create_session(
+            files, self.uploads_dir, executor=self.process_pool, sqlite=self.sqlite, secret_path=self.secret_path,
+        )
+
+    def _prune_locked(self) -> None:
+        cutoff = time.time() - self.retention
+        stale = [jid for jid, j in self._jobs.items() if j.is_finished and (j.finished or 0) < cutoff]
+        for jid in stale:
+            del self._jobs[jid]
+
+    def _run_upload(self, job: Job, files: List[UploadFile]) -> None:
+        if job.cancel_event.is_set():
+            return
+        job.state = "running"
+        job.started = time.time()
+        try:
+            sid, _, cached = create_session(
+                files, self.uploads_dir,
+                progress=job.set_stage, executor=self.process_pool, sqlite=self.sqlite,
+                secret_path=self.secret_path,
+            )
+            job.session_id = sid
+            job.cached = cached
+            job.finish("done")
+        except JobCancelled:
+            job.finish("cancelled")
+        except Exception as e:
+            job.error = str(e)
+            job.finish("error")
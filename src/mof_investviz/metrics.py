@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+
+# Prometheus テキスト形式（version 0.0.4）の最小実装。依存ライブラリなしで /metrics を出す。
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = tuple(float(2 ** k) for k in range(10, 31, 2))  # 1 KiB 〜 1 GiB
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+
+
+class Gauge(_Metric):
+    """値をその場で読むゲージ（fn は {ラベル値タプル: 値} または単一の値を返す）"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        fn: Callable[[], object],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        value = self.fn()
+        if value is None:
+            return
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(float(v))}"
+        else:
+            yield f"{self.name} {_format_value(float(value))}"  # type: ignore[arg-type]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル値 → [バケット別件数..., +Inf 件数, 合計]
+        self._data: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            d = self._data.get(key)
+            if d is None:
+                d = self._data[key] = [0.0] * (len(self.buckets) + 2)
+            d[i] += 1
+            d[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted((k, list(d)) for k, d in self._data.items())
+        for key, d in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), d[:-1]):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(d[-1])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(cumulative)}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._scrapes = 0
+        self._current = threading.local()  # render 中のスレッドのスクレイプ番号
+
+    def register(self, metric: _Metric) -> _Metric:
+        """同名のメトリクスは置き換える（サーバ再構成時にゲージの参照先を差し替えるため）"""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))  # type: ignore[return-value]
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help: str, fn: Callable[[], object], labelnames: Sequence[str] = (), kind: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, help, fn, labelnames, kind))  # type: ignore[return-value]
+
+    def per_scrape(self, fn: Callable[[], object]) -> Callable[[], object]:
+        """render 1 回につき fn を 1 回だけ呼ぶ関数を返す（複数のゲージが同じ集計から値を読むとき用）"""
+        lock = threading.Lock()
+        memo: Dict[int, object] = {}
+
+        def get() -> object:
+            scrape = getattr(self._current, "scrape", None)
+            if scrape is None:
+                return fn()
+            with lock:
+                if scrape not in memo:
+                    memo.clear()
+                    memo[scrape] = fn()
+                return memo[scrape]
+        return get
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            self._scrapes += 1
+            self._current.scrape = self._scrapes
+        lines: List[str] = []
+        try:
+            for m in metrics:
+                try:
+                    lines.extend(m.render())
+                except Exception:
+                    # 読み取り失敗したゲージは出力から外す（/metrics 全体は返す）
+                    continue
+        finally:
+            self._current.scrape = None
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "investviz_http_requests_total", "HTTP requests by route, method and status code.", ("route", "method", "status"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "investviz_http_request_duration_seconds", "HTTP request latency by route.", ("route",))
+STAGE_SECONDS = REGISTRY.histogram(
+    "investviz_normalize_stage_duration_seconds", "Duration of each upload processing stage.", ("stage",), STAGE_BUCKETS)
+UPLOAD_BYTES = REGISTRY.histogram(
+    "investviz_upload_size_bytes", "Size of uploaded files.", (), SIZE_BUCKETS)
+UPLOAD_CACHE = REGISTRY.counter(
+    "investviz_upload_cache_total", "Upload session cache lookups (hit = already materialized).", ("result",))
+
+# ダッシュボード（ブラウザ）の計測ビーコン（POST /api/perf）。
+# ラベルは下の一覧にある値だけを受け付ける（任意の文字列で時系列が増えないように）
+CLIENT_METRICS = ("draw", "worker", "render", "frame", "load", "export")
+CLIENT_KINDS = (
+    "timeseries", "yoy_diff", "composition", "heatmap", "boxplot", "country_pie", "country_bar", "multi_panel",
+    "catalog", "full", "cached", "image", "-",
+)
+MAX_BEACON_SAMPLES = 500
+# 受け付ける計測値の上限（ミリ秒）。これを超える値や負の値は捨てる
+MAX_CLIENT_MS = 600000.0
+CLIENT_SECONDS = REGISTRY.histogram(
+    "investviz_client_duration_seconds",
+    "Dashboard timings from sampled browser beacons (draw, worker round trip, render, frame, load, export).",
+    ("metric", "kind"))
+CLIENT_DATASET_BYTES = REGISTRY.histogram(
+    "investviz_client_dataset_size_bytes", "Summary payload size loaded by the dashboard.", ("kind",), SIZE_BUCKETS)
+CLIENT_BEACONS = REGISTRY.counter(
+    "investviz_client_beacons_total", "Performance beacons received from dashboards.", ("result",))
+CLIENT_SAMPLES = REGISTRY.counter(
+    "investviz_client_samples_total", "Beacon samples accepted or rejected (unknown label or bad value).", ("result",))
+
+# ルート別集計のキー。ここに無い /api/* は "api"、それ以外は静的ファイル扱い
+API_ROUTES = (
+    "/api/upload", "/api/export", "/api/query", "/api/summary", "/api/series", "/api/perf",
+    "/api/jobs", "/api/sessions", "/metrics",
+)
+
+
+def route_of(path: str) -> str:
+    path = path.split("?", 1)[0]
+    for route in API_ROUTES:
+        if path == route or path.startswith(route + "/"):
+            return route
+    if path.startswith("/api/"):
+        return "api"
+    if path.startswith("/uploads/"):
+        return "uploads"
+    return "static"
+
+
+def observe_request(path: str, method: str, status: int, seconds: float) -> None:
+    route = route_of(path)
+    HTTP_REQUESTS.inc(route=route, method=method, status=str(status))
+    HTTP_LATENCY.observe(seconds, route=route)
+
+
+def observe_stage_timings(timings: Dict[str, float]) -> None:
+    for stage, seconds in timings.items():
+        if stage:
+            STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def observe_upload(size: int, cached: bool) -> None:
+    UPLOAD_BYTES.observe(float(size))
+    UPLOAD_CACHE.inc(result="hit" if cached else "miss")
+
+
+def _number(value: object) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def observe_client_beacon(payload: object) -> int:
+    """ビーコン {"samples": [{"metric", "kind", "ms", "bytes"?}, ...]} を集計し、採用したサンプル数を返す
+
+    一覧に無いラベルや範囲外の値のサンプルは捨てる。samples が無い・リストでなければ ValueError。
+    """
+    samples = payload.get("samples") if isinstance(payload, dict) else None
+    if not isinstance(samples, list):
+        CLIENT_BEACONS.inc(result="invalid")
+        raise ValueError("samples must be a list")
+    accepted = 0
+    for s in samples[:MAX_BEACON_SAMPLES]:
+        if not isinstance(s, dict):
+            continue
+        metric, kind, ms = s.get("metric"), s.get("kind", "-"), s.get("ms")
+        if metric not in CLIENT_METRICS or kind not in CLIENT_KINDS:
+            continue
+        if not _number(ms) or not 0 <= ms <= MAX_CLIENT_MS:  # type: ignore[operator]
+            continue
+        CLIENT_SECONDS.observe(float(ms) / 1000.0, metric=metric, kind=kind)  # type: ignore[arg-type]
+        size = s.get("bytes")
+        if metric == "load" and _number(size) and size >= 0:  # type: ignore[operator]
+            CLIENT_DATASET_BYTES.observe(float(size), kind=kind)  # type: ignore[arg-type]
+        accepted += 1
+    CLIENT_SAMPLES.inc(accepted, result="accepted")
+    CLIENT_SAMPLES.inc(len(samples) - accepted, result="rejected")
+    CLIENT_BEACONS.inc(result="ok")
+    return accepted
+
+
+def render() -> bytes:
+    return REGISTRY.render().encode("utf-8")
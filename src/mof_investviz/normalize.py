@@ -1,17 +1,22 @@
 from __future__ import annotations
 
+import hashlib
 import os
 import re
+import time
 import unicodedata
 import yaml
 from dataclasses import dataclass
 from collections import defaultdict
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from .io import read_csv_matrix
 
 
+# Bump when the normalized output changes; part of the upload cache key
+NORMALIZER_VERSION = "0.2.1"
+
 # Schema columns (normalized tidy format)
 SCHEMA_HEADERS = [
     "year",
@@ -27,6 +32,7 @@ SCHEMA_HEADERS = [
     "qa_flag",
     "flag_outlier",
     "flag_break",
+    "source",
 ]
 
 
@@ -148,7 +154,10 @@ def parse_year_from_header(name: str) -> Optional[int]:
 
 # -------------------- Region dictionary and extraction --------------------
 
+REGION_DICT_PATH = Path(__file__).parent.parent.parent / "data" / "dictionaries" / "regions.yml"
+
 _REGION_DICT_CACHE: Optional[List[Dict[str, object]]] = None
+_REGION_DICT_VERSION: Optional[str] = None
 
 
 def load_region_dictionary() -> List[Dict[str, object]]:
@@ -158,7 +167,7 @@ def load_region_dictionary() -> List[Dict[str, object]]:
         return _REGION_DICT_CACHE
     
     # プロジェクトルートからの相対パス
-    dict_path = Path(__file__).parent.parent.parent / "data" / "dictionaries" / "regions.yml"
+    dict_path = REGION_DICT_PATH
     
     if not dict_path.exists():
         # 辞書が見つからない場合は空リストを返す
@@ -172,6 +181,18 @@ def load_region_dictionary() -> List[Dict[str, object]]:
     return _REGION_DICT_CACHE
 
 
+def region_dictionary_version() -> str:
+    """地域辞書の内容ハッシュを返す（キャッシュキー用、辞書が無い場合は空文字）"""
+    global _REGION_DICT_VERSION
+    if _REGION_DICT_VERSION is not None:
+        return _REGION_DICT_VERSION
+    if not REGION_DICT_PATH.exists():
+        _REGION_DICT_VERSION = ""
+        return _REGION_DICT_VERSION
+    _REGION_DICT_VERSION = hashlib.sha1(REGION_DICT_PATH.read_bytes()).hexdigest()[:12]
+    return _REGION_DICT_VERSION
+
+
 def extract_region_from_text(text: str) -> Optional[str]:
     """テキストから地域名を抽出し、正規化された地域名を返す
     
@@ -484,6 +505,10 @@ def matrix_to_dict_rows(matrix: Sequence[Sequence[str]], headers: Sequence[str],
 
 # -------------------- Normalization --------------------
 
+# normalize_rows が進捗を通知する間隔（秒）
+PROGRESS_INTERVAL = 0.2
+
+
 def normalize_rows(
     rows: Sequence[Dict[str, str]],
     headers: Sequence[str],
@@ -491,15 +516,21 @@ def normalize_rows(
     side: str = "unknown",
     metric: str = "unknown",
     scale_factor: float = 1.0,
+    progress: Optional[Callable[[float], None]] = None,
 ) -> Tuple[List[Dict[str, object]], Dict[str, object]]:
+    """progress を渡すと PROGRESS_INTERVAL 秒ごとに処理済みの割合（0〜1）で呼ぶ（例外を送出すると中断）"""
     numeric_cols = identify_numeric_columns(rows, headers)
     year_col = identify_year_column(rows, headers)
+    next_report = 0.0
 
     norm: List[Dict[str, object]] = []
 
     if year_col:
         # Typical case: each row has a year column; numeric columns are measures
-        for r in rows:
+        for idx, r in enumerate(rows):
+            if progress is not None and time.perf_counter() >= next_report:
+                progress(idx / len(rows))
+                next_report = time.perf_counter() + PROGRESS_INTERVAL
             year_val = None
             try:
                 year_val = int(str(r.get(year_col, "").strip()) or 0) or None
@@ -550,6 +581,9 @@ def normalize_rows(
             id_candidates = id_candidates[:3]  # keep it compact
 
             for idx, r in enumerate(rows):
+                if progress is not None and time.perf_counter() >= next_report:
+                    progress(idx / len(rows))
+                    next_report = time.perf_counter() + PROGRESS_INTERVAL
                 label_parts = [str(r.get(h, "")).strip() for h in id_candidates if str(r.get(h, "")).strip()]
                 measure_label = " / ".join(label_parts) if label_parts else f"row_{idx}"
                 # ラベルから地域を抽出
@@ -611,6 +645,114 @@ def add_outlier_flags(norm_rows: List[Dict[str, object]]) -> None:
                 norm_rows[idx]["qa_flag"] = (prev + ";" if prev else "") + "outlier"
 
 
+# 国別ランキング表で全年合計（年欠損の行を含む）を表すキー
+RANKINGS_ALL_YEARS = "all"
+
+
+def rank_countries(values: Dict[str, float]) -> Dict[str, object]:
+    """国→値 を値の降順に並べたランキング（順位は配列の位置 + 1）
+
+    share は正の値の合計（total）に対する比、cumulative は上位からの累積値。
+    上位 N 件以外の「その他」は cumulative[-1] - cumulative[N-1] で求まる。
+    by_name は国名順に並べたときの配列位置。
+    """
+    items = sorted(values.items(), key=lambda kv: (-kv[1], kv[0]))
+    countries = [c for c, _ in items]
+    vals = [v for _, v in items]
+    total = sum(v for v in vals if v > 0)
+    cumulative: List[float] = []
+    acc = 0.0
+    for v in vals:
+        acc += v
+        cumulative.append(acc)
+    return {
+        "total": total,
+        "countries": countries,
+        "values": vals,
+        "share": [v / total if total else 0.0 for v in vals],
+        "cumulative": cumulative,
+        "by_name": sorted(range(len(countries)), key=lambda i: countries[i]),
+    }
+
+
+RANKING_SORTS = ("value", "value_asc", "name", "name_desc")
+
+
+def slice_country_ranking(
+    ranking: Dict[str, object],
+    top_n: Optional[int] = None,
+    sort_by: str = "value",
+    others: bool = False,
+) -> List[Dict[str, object]]:
+    """rank_countries の結果を並べ替えて先頭 top_n 件を返す（rank は値の順位）
+
+    others=True なら値の降順で上位 top_n 件に入らなかった国の合計を「その他」として末尾に付ける。
+    """
+    countries: List[str] = ranking["countries"]  # type: ignore[assignment]
+    values: List[float] = ranking["values"]  # type: ignore[assignment]
+    share: List[float] = ranking["share"]  # type: ignore[assignment]
+    n = len(countries)
+    if sort_by == "value_asc":
+        order: Sequence[int] = range(n - 1, -1, -1)
+    elif sort_by == "name":
+        order = ranking["by_name"]  # type: ignore[assignment]
+    elif sort_by == "name_desc":
+        order = list(reversed(ranking["by_name"]))  # type: ignore[arg-type]
+    else:
+        order = range(n)
+    if top_n is not None:
+        order = order[:max(0, top_n)]
+    rows: List[Dict[str, object]] = [
+        {"country": countries[i], "value_100m_yen": values[i], "share": share[i], "rank": i + 1}
+        for i in order
+    ]
+    if others and top_n is not None and 0 < top_n < n:
+        cumulative: List[float] = ranking["cumulative"]  # type: ignore[assignment]
+        rest = cumulative[-1] - cumulative[top_n - 1]
+        total = float(ranking["total"] or 0.0)  # type: ignore[arg-type]
+        rows.append({"country": "その他", "value_100m_yen": rest, "share": rest / total if total else 0.0, "rank": ""})
+    return rows
+
+
+def country_rankings_from_agg(country_agg: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, object]]:
+    """国→年→値 の集計から、年ごと（と全年合計）のランキング表を作る"""
+    per_year: Dict[str, Dict[str, float]] = defaultdict(dict)
+    all_years: Dict[str, float] = defaultdict(float)
+    for country, by_year in country_agg.items():
+        for yk, v in by_year.items():
+            all_years[country] += v
+            if yk:
+                per_year[yk][country] = v
+    table = {yk: rank_countries(per_year[yk]) for yk in sorted(per_year)}
+    table[RANKINGS_ALL_YEARS] = rank_countries(all_years)
+    return table
+
+
+def build_country_rankings(norm_rows: Iterable[Dict[str, object]]) -> Dict[str, Dict[str, object]]:
+    """正規化行（level == country のみ）から年別の国別ランキング表を作る
+
+    normalized.csv を DictReader で読んだ文字列の行もそのまま渡せる。
+    """
+    country_agg: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    # 地域名 → canonical（国でなければ None）。辞書引きは地域ごとに 1 回だけ行う
+    country_of: Dict[str, Optional[str]] = {}
+    for r in norm_rows:
+        region = r.get("segment_region")
+        if not region:
+            continue
+        region = str(region)
+        if region not in country_of:
+            canonical = get_region_canonical(region)
+            country_of[region] = canonical if get_region_level(canonical) == "country" else None
+        canonical = country_of[region]
+        if canonical is None:
+            continue
+        y = r.get("year")
+        yk = str(y) if y not in (None, "") else ""
+        country_agg[canonical][yk] += float(r.get("value_100m_yen") or 0.0)
+    return country_rankings_from_agg(country_agg)
+
+
 def build_summary_multi_measure(norm_rows: List[Dict[str, object]], top_n: int = 5) -> Dict[str, object]:
     agg: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
     years_set: set[str] = set()
@@ -621,9 +763,12 @@ def build_summary_multi_measure(norm_rows: List[Dict[str, object]], top_n: int =
     region_agg: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
     # 国別・年別の集計（level=='country'のみ）
     country_agg: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    # 入力ファイル別の行数（バッチアップロードで複数ファイルを束ねた場合の内訳）
+    source_rows: Dict[str, int] = defaultdict(int)
     
     for r in norm_rows:
         m = str(r.get("measure"))
+        source_rows[str(r.get("source") or "")] += 1
         y = r.get("year")
         yk = str(y) if y is not None else ""
         v = float(r.get("value_100m_yen") or 0.0)
@@ -706,6 +851,8 @@ def build_summary_multi_measure(norm_rows: List[Dict[str, object]], top_n: int =
         "views": ["timeseries", "yoy_diff", "composition"],
         "composition": {"year": latest, "labels": comp_labels, "share": comp_share},
     }
+    if any(source_rows):
+        result["sources"] = [{"name": name, "rows": n} for name, n in sorted(source_rows.items()) if name]
     
     # 地域データがある場合のみ追加（全地域・グループ・国を含む）
     if regions_list:
@@ -726,6 +873,7 @@ def build_summary_multi_measure(norm_rows: List[Dict[str, object]], top_n: int =
             "available": countries_list,
             "series": country_series,
             "rankings": country_rankings,
+            "rankings_by_year": country_rankings_from_agg(country_agg),
             "composition": {
                 "year": latest,
                 "labels": countries_list,
@@ -737,6 +885,29 @@ def build_summary_multi_measure(norm_rows: List[Dict[str, object]], top_n: int =
     return result
 
 
+def build_pivot_year_measure(norm_rows: Iterable[Dict[str, object]]) -> Tuple[List[str], List[Dict[str, object]]]:
+    """年×系列のピボット（値は合計）を構築し (headers, rows) を返す"""
+    pivot_map: Dict[int, Dict[str, float]] = {}
+    measures = set()
+    for r in norm_rows:
+        y = r.get("year")
+        if y is None:
+            continue
+        m = str(r.get("measure"))
+        v = float(r.get("value_100m_yen") or 0.0)
+        measures.add(m)
+        d = pivot_map.setdefault(int(y), {})
+        d[m] = d.get(m, 0.0) + v
+    measures_sorted = sorted(measures)
+    pivot_headers = ["year"] + measures_sorted
+    pivot_rows: List[Dict[str, object]] = []
+    for y in sorted(pivot_map.keys()):
+        row: Dict[str, object] = {"year": y}
+        row.update({m: pivot_map[y].get(m, 0.0) for m in measures_sorted})
+        pivot_rows.append(row)
+    return pivot_headers, pivot_rows
+
+
 @dataclass
 class NormalizeResult:
     rows: List[Dict[str, object]]
@@ -744,8 +915,23 @@ class NormalizeResult:
     stats: Dict[str, object]
     meta: Dict[str, object]
 
+    def log_entry(self, path: Optional[str] = None) -> Dict[str, object]:
+        """parse_log.json の inputs 要素を返す"""
+        return {
+            "path": path or self.meta.get("path"),
+            "encoding": self.meta.get("encoding"),
+            "delimiter": self.meta.get("delimiter"),
+            "header_rows": self.meta.get("header_rows"),
+            "headers": self.headers,
+            "unit_detected": self.meta.get("unit_detected"),
+            "scale_factor": self.meta.get("scale_factor"),
+            "side": self.meta.get("side"),
+            "metric": self.meta.get("metric"),
+            "stats": self.stats,
+        }
 
-def normalize_file(path: str) -> NormalizeResult:
+
+def normalize_file(path: str, progress: Optional[Callable[[float], None]] = None) -> NormalizeResult:
     matrix, meta = read_csv_matrix(path)
     hrows = detect_header_rows(matrix)
     headers = build_headers(matrix, hrows)
@@ -754,8 +940,11 @@ def normalize_file(path: str) -> NormalizeResult:
     side = detect_side(texts)
     metric = detect_metric(texts)
     rows_raw = matrix_to_dict_rows(matrix, headers, start_row=hrows)
-    norm_rows, stats = normalize_rows(rows_raw, headers, side=side, metric=metric, scale_factor=scale)
+    norm_rows, stats = normalize_rows(rows_raw, headers, side=side, metric=metric, scale_factor=scale, progress=progress)
     add_outlier_flags(norm_rows)
+    source = os.path.basename(path)
+    for r in norm_rows:
+        r["source"] = source
     meta.update({
         "header_rows": hrows,
         "unit_detected": unit_pat,
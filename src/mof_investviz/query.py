@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import csv
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .downsample import lttb_indices, minmax_envelope, target_points
+from .normalize import get_region_level
+
+
+# 値で絞り込み・グループ化できる次元（year は数値、それ以外は辞書符号化）
+CATEGORICAL_DIMENSIONS = ("side", "metric", "measure", "region", "level", "source")
+DIMENSIONS = ("year",) + CATEGORICAL_DIMENSIONS
+AGGREGATES = ("sum", "mean", "min", "max", "count")
+
+# 年が欠損している行の year 値
+NO_YEAR = 0
+
+
+class QueryError(ValueError):
+    """クエリ指定が不正"""
+
+
+@dataclass
+class QuerySpec:
+    filters: Dict[str, Set[str]] = field(default_factory=dict)
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    group_by: List[str] = field(default_factory=list)
+    agg: str = "sum"
+    sort: Optional[str] = None  # "value" / "-value" / 次元名（先頭 - で降順）
+    limit: Optional[int] = None
+    width: Optional[int] = None  # 描画幅（px）。year でグループ化した系列を LTTB で間引く
+
+    @classmethod
+    def from_params(cls, params: Dict[str, List[str]]) -> "QuerySpec":
+        """クエリ文字列（parse_qs の結果）から組み立てる
+
+        フィルタ値は同じキーを繰り返して複数指定する（measure=a&measure=b）。
+        group_by はカンマ区切りも可。
+        """
+        spec = cls()
+        for dim in CATEGORICAL_DIMENSIONS:
+            values = [v for v in params.get(dim, []) if v != ""]
+            if values:
+                spec.filters[dim] = set(values)
+        try:
+            if params.get("year_from", [""])[0]:
+                spec.year_from = int(params["year_from"][0])
+            if params.get("year_to", [""])[0]:
+                spec.year_to = int(params["year_to"][0])
+            if params.get("limit", [""])[0]:
+                spec.limit = max(0, int(params["limit"][0]))
+            if params.get("width", [""])[0] and params.get("full", [""])[0] not in ("1", "true"):
+                spec.width = max(1, int(params["width"][0]))
+        except ValueError as e:
+            raise QueryError(f"invalid number: {e}") from None
+        for raw in params.get("group_by", []):
+            for dim in raw.split(","):
+                dim = dim.strip()
+                if not dim:
+                    continue
+                if dim not in DIMENSIONS:
+                    raise QueryError(f"unknown group_by dimension: {dim}")
+                if dim not in spec.group_by:
+                    spec.group_by.append(dim)
+        spec.agg = params.get("agg", ["sum"])[0] or "sum"
+        if spec.agg not in AGGREGATES:
+            raise QueryError(f"unknown aggregate: {spec.agg}")
+        sort = params.get("sort", [""])[0]
+        if sort:
+            if sort.lstrip("-") not in ("value",) + tuple(spec.group_by):
+                raise QueryError(f"cannot sort by: {sort}")
+            spec.sort = sort
+        return spec
+
+
+class SessionDataset:
+    """正規化データの列指向インメモリ表現（次元ごとの転置インデックス付き）"""
+
+    def __init__(self, rows: Iterable[Dict[str, str]]) -> None:
+        self.years = array("i")
+        self.values = array("d")
+        self.codes: Dict[str, array] = {d: array("i") for d in CATEGORICAL_DIMENSIONS}
+        self.labels: Dict[str, List[str]] = {d: [] for d in CATEGORICAL_DIMENSIONS}
+        lookup: Dict[str, Dict[str, int]] = {d: {} for d in CATEGORICAL_DIMENSIONS}
+        level_of_region: Dict[str, str] = {}
+
+        def encode(dim: str, label: str) -> int:
+            table = lookup[dim]
+            code = table.get(label)
+            if code is None:
+                code = len(self.labels[dim])
+                table[label] = code
+                self.labels[dim].append(label)
+            return code
+
+        for r in rows:
+            try:
+                year = int(r.get("year") or NO_YEAR)
+            except ValueError:
+                year = NO_YEAR
+            try:
+                value = float(r.get("value_100m_yen") or 0.0)
+            except ValueError:
+                continue
+            region = r.get("segment_region") or ""
+            if region not in level_of_region:
+                level_of_region[region] = (get_region_level(region) or "") if region else ""
+            self.years.append(year)
+            self.values.append(value)
+            self.codes["side"].append(encode("side", r.get("side") or ""))
+            self.codes["metric"].append(encode("metric", r.get("metric") or ""))
+            self.codes["measure"].append(encode("measure", r.get("measure") or ""))
+            self.codes["region"].append(encode("region", region))
+            self.codes["level"].append(encode("level", level_of_region[region]))
+            self.codes["source"].append(encode("source", r.get("source") or ""))
+
+        # 転置インデックス: 次元 → 値コード → 行番号
+        self.index: Dict[str, Dict[int, array]] = {}
+        for dim in CATEGORICAL_DIMENSIONS:
+            postings: Dict[int, array] = {}
+            for i, code in enumerate(self.codes[dim]):
+                p = postings.get(code)
+                if p is None:
+                    p = postings[code] = array("I")
+                p.append(i)
+            self.index[dim] = postings
+        self.year_index: Dict[int, array] = {}
+        for i, y in enumerate(self.years):
+            p = self.year_index.get(y)
+            if p is None:
+                p = self.year_index[y] = array("I")
+            p.append(i)
+        self._lookup = lookup
+
+    @classmethod
+    def from_csv(cls, path: str) -> "SessionDataset":
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            return cls(csv.DictReader(f))
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def catalog(self) -> Dict[str, object]:
+        """利用可能な次元の値一覧"""
+        years = sorted(y for y in self.year_index if y != NO_YEAR)
+        return {
+            "rows": len(self),
+            "years": years,
+            **{dim: sorted(l for l in self.labels[dim] if l) for dim in CATEGORICAL_DIMENSIONS},
+        }
+
+    def select(self, spec: QuerySpec) -> Sequence[int]:
+        """フィルタに一致する行番号（昇順）を返す。最も小さい候補集合から順に絞り込む"""
+        candidates: List[Set[int]] = []
+        for dim, wanted in spec.filters.items():
+            rows: Set[int] = set()
+            for label in wanted:
+                code = self._lookup[dim].get(label)
+                if code is not None:
+                    rows.update(self.index[dim][code])
+            candidates.append(rows)
+        if spec.year_from is not None or spec.year_to is not None:
+            lo = spec.year_from if spec.year_from is not None else -(1 << 30)
+            hi = spec.year_to if spec.year_to is not None else (1 << 30)
+            rows = set()
+            for y, postings in self.year_index.items():
+                if y != NO_YEAR and lo <= y <= hi:
+                    rows.update(postings)
+            candidates.append(rows)
+        if not candidates:
+            return range(len(self))
+        candidates.sort(key=len)
+        result = candidates[0]
+        for other in candidates[1:]:
+            result = result & other
+            if not result:
+                break
+        return sorted(result)
+
+    def query(self, spec: QuerySpec) -> Dict[str, object]:
+        """グループ化・集計した結果を列指向の JSON 互換 dict で返す"""
+        rows = self.select(spec)
+        group_by = spec.group_by
+        # key → [sum, count, min, max]
+        acc: Dict[Tuple, List[float]] = {}
+        values = self.values
+        years = self.years
+        codes = [None if d == "year" else self.codes[d] for d in group_by]
+        for i in rows:
+            key = tuple(years[i] if c is None else c[i] for c in codes)
+            v = values[i]
+            a = acc.get(key)
+            if a is None:
+                acc[key] = [v, 1, v, v]
+            else:
+                a[0] += v
+                a[1] += 1
+                if v < a[2]:
+                    a[2] = v
+                if v > a[3]:
+                    a[3] = v
+
+        def finalize(a: List[float]) -> float:
+            if spec.agg == "sum":
+                return a[0]
+            if spec.agg == "mean":
+                return a[0] / a[1]
+            if spec.agg == "min":
+                return a[2]
+            if spec.agg == "max":
+                return a[3]
+            return a[1]
+
+        def decode(dim: str, code: int) -> object:
+            if dim == "year":
+                return code if code != NO_YEAR else None
+            return self.labels[dim][code] or None
+
+        out = [(tuple(decode(d, k) for d, k in zip(group_by, key)), finalize(a)) for key, a in acc.items()]
+        envelope: Optional[Dict[Tuple, Tuple[float, float]]] = None
+        if spec.width and "year" in group_by:
+            out, envelope = self._downsample(out, group_by.index("year"), spec.width)
+        if spec.sort:
+            desc = spec.sort.startswith("-")
+            name = spec.sort.lstrip("-")
+            if name == "value":
+                out.sort(key=lambda t: t[1], reverse=desc)
+            else:
+                pos = group_by.index(name)
+                out.sort(key=lambda t: (t[0][pos] is None, t[0][pos] if t[0][pos] is not None else 0), reverse=desc)
+        else:
+            out.sort(key=lambda t: tuple((k is None, k if k is not None else 0) for k in t[0]))
+        if spec.limit is not None:
+            out = out[: spec.limit]
+        columns: Dict[str, List[object]] = {d: [k[j] for k, _ in out] for j, d in enumerate(group_by)}
+        columns["value"] = [v for _, v in out]
+        result: Dict[str, object] = {
+            "group_by": group_by,
+            "agg": spec.agg,
+            "matched": len(rows),
+            "groups": len(out),
+            "columns": columns,
+        }
+        if envelope is not None:
+            columns["value_min"] = [envelope[k][0] for k, _ in out]
+            columns["value_max"] = [envelope[k][1] for k, _ in out]
+            result["downsampled"] = {"width": spec.width, "max_points": target_points(spec.width)}
+        return result
+
+    @staticmethod
+    def _downsample(
+        out: List[Tuple[Tuple, float]], year_pos: int, width: int
+    ) -> Tuple[List[Tuple[Tuple, float]], Dict[Tuple, Tuple[float, float]]]:
+        """year 以外の次元ごとの系列を LTTB で間引き、採用点ごとの最小・最大を返す"""
+        threshold = target_points(width)
+        by_series: Dict[Tuple, List[Tuple[Tuple, float]]] = {}
+        for key, v in out:
+            by_series.setdefault(key[:year_pos] + key[year_pos + 1:], []).append((key, v))
+        kept: List[Tuple[Tuple, float]] = []
+        envelope: Dict[Tuple, Tuple[float, float]] = {}
+        for group in by_series.values():
+            # 年が欠損している集計値は系列の外として間引かずに残す
+            points = sorted((t for t in group if t[0][year_pos] is not None), key=lambda t: t[0][year_pos])
+            for t in group:
+                if t[0][year_pos] is None:
+                    kept.append(t)
+                    envelope[t[0]] = (t[1], t[1])
+            ys = [v for _, v in points]
+            if len(points) <= threshold:
+                idx = list(range(len(points)))
+                lo, hi = ys, ys
+            else:
+                xs = [float(k[year_pos]) for k, _ in points]
+                idx = lttb_indices(ys, threshold, xs)
+                lo, hi = minmax_envelope(ys, idx)
+            for j, i in enumerate(idx):
+                kept.append(points[i])
+                envelope[points[i][0]] = (lo[j], hi[j])
+        return kept, envelope
+
+
+class DatasetCache:
+    """normalized.csv ごとの SessionDataset を保持する LRU（ファイル更新で無効化）"""
+
+    def __init__(self, max_entries: int = 8) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[int, SessionDataset]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> SessionDataset:
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == mtime:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+        ds = SessionDataset.from_csv(path)
+        with self._lock:
+            self.misses += 1
+            self._entries[path] = (mtime, ds)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return ds
+
+
+DATASETS = DatasetCache()
@@ -4,7 +4,7 @@ import os
 from typing import Dict
 
 
-SCHEMA_VERSION = "0.1.0"
+SCHEMA_VERSION = "0.2.0"
 
 
 def schema_path_default() -> str:
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import queue
+import socket
+import socketserver
+import threading
+from typing import List, Optional, Tuple
+
+
+SERVER_MODES = ("pool", "threading")
+
+
+class ThreadingHTTPServer(socketserver.ThreadingTCPServer):
+    """接続ごとにスレッドを生成する従来のサーバ"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class PooledHTTPServer(socketserver.TCPServer):
+    """固定サイズのワーカープールで接続を処理するサーバ
+
+    accept した接続は上限付きキューに積み、workers 本のスレッドが順に処理する。
+    キューが満杯のときは 503 + Retry-After を返してすぐに切断する（バックプレッシャ）。
+    持続接続は次のリクエストを待つ間もワーカーを占有するので、ソケットに idle_timeout 秒の
+    タイムアウトを付けて無通信の接続を切る（ハンドラが timeout を持つ場合はそちらが優先）。
+    """
+
+    allow_reuse_address = True
+    request_queue_size = 128  # listen backlog
+
+    def __init__(
+        self,
+        server_address: Tuple[str, int],
+        handler_class,
+        *,
+        workers: int = 32,
+        queue_size: int = 128,
+        retry_after: int = 2,
+        idle_timeout: Optional[float] = 5.0,
+    ) -> None:
+        super().__init__(server_address, handler_class)
+        self.workers = max(1, workers)
+        self.retry_after = retry_after
+        self.idle_timeout = idle_timeout
+        self._pending: "queue.Queue[Optional[Tuple[socket.socket, object]]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+        self.rejected = 0
+        self._threads: List[threading.Thread] = []
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"http-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending.qsize()
+
+    @property
+    def busy_workers(self) -> int:
+        return self._busy
+
+    def process_request(self, request, client_address) -> None:
+        try:
+            self._pending.put_nowait((request, client_address))
+        except queue.Full:
+            self.rejected += 1
+            self._reject(request)
+
+    def _reject(self, request: socket.socket) -> None:
+        body = b"Server is busy, please retry later.\n"
+        head = (
+            "HTTP/1.1 503 Service Unavailable\r\n"
+            f"Retry-After: {self.retry_after}\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("ascii")
+        try:
+            # accept スレッドで送るので待たない（応答は小さく通常は 1 回で送り切れる。送れなければ切断だけする）
+            request.setblocking(False)
+            request.send(head + body)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _worker(self) -> None:
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            request, client_address = item
+            with self._busy_lock:
+                self._busy += 1
+            try:
+                if self.idle_timeout is not None:
+                    request.settimeout(self.idle_timeout)
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._busy_lock:
+                    self._busy -= 1
+
+    def server_close(self) -> None:
+        super().server_close()
+        for _ in self._threads:
+            try:
+                self._pending.put_nowait(None)
+            except queue.Full:
+                break
+
+
+def make_server(
+    server_address: Tuple[str, int],
+    handler_class,
+    *,
+    mode: str = "pool",
+    workers: int = 32,
+    queue_size: int = 128,
+    idle_timeout: Optional[float] = 5.0,
+) -> socketserver.TCPServer:
+    if mode == "threading":
+        return ThreadingHTTPServer(server_address, handler_class)
+    if mode == "pool":
+        return PooledHTTPServer(
+            server_address, handler_class, workers=workers, queue_size=queue_size, idle_timeout=idle_timeout,
+        )
+    raise ValueError(f"unknown server mode: {mode} (expected one of {SERVER_MODES})")
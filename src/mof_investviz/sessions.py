@@ -0,0 +1,872 @@
+from __future__ import annotations
+
+import csv
+import hashlib
+import hmac
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import queue
+import re
+import secrets
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from . import metrics
+from .io import write_csv
+from .normalize import (
+    NORMALIZER_VERSION,
+    SCHEMA_HEADERS,
+    build_country_rankings,
+    build_pivot_year_measure,
+    build_summary_multi_measure,
+    load_region_dictionary,
+    normalize_file,
+    region_dictionary_version,
+)
+from .schema import SCHEMA_VERSION, schema_meta
+from .sqlstore import DB_FILE, country_rankings_from_db, write_sqlite
+from .static import write_gzip_sidecar
+from .summary_codec import write_summary
+from .zonemap import sort_rows, write_csv_with_zonemap
+
+
+UPLOADS_DIR = "uploads"
+
+# progress(stage, percent) — 例外を送出すると処理を中断できる（キャンセル用）
+ProgressFn = Callable[[str, float], None]
+
+# アップロード 1 ファイル分（ファイル名, 内容）
+UploadFile = Tuple[str, bytes]
+
+# バッチアップロード（複数ファイル / zip）の上限。zip は展開後のサイズで数える
+MAX_BATCH_FILES = 64
+MAX_BATCH_BYTES = 512 * 1024 ** 2
+
+SUMMARY_FILE = "summary.json"
+NORMALIZED_FILE = "normalized.csv"
+PARSE_LOG_FILE = "parse_log.json"
+PIVOT_FILE = "pivot_year_measure.csv"
+RANKINGS_FILE = "country_rankings.json"
+
+# セッションディレクトリ内の管理用マーカー
+ACCESS_MARKER = ".last_access"
+PIN_MARKER = ".pinned"
+# セッション ID を作るための秘密鍵のファイル名（初回アップロード時に生成）。
+# uploads/ は配信するビルドディレクトリの中にあるので、鍵はビルドディレクトリの外
+# （既定は default_secret_path）に置く。LEGACY_SECRET_FILE は uploads/ 直下に置いていた旧版の鍵
+SECRET_SUFFIX = ".session-secret"
+LEGACY_SECRET_FILE = ".session-secret"
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def is_session_id(sid: str) -> bool:
+    return bool(sid) and _SESSION_ID.match(sid) is not None
+
+
+def touch_session(sid: str, uploads_dir: str = UPLOADS_DIR) -> None:
+    """最終アクセス時刻を更新する（マーカーファイルの mtime で記録）"""
+    path = os.path.join(uploads_dir, sid, ACCESS_MARKER)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        try:
+            open(path, "ab").close()
+        except OSError:
+            pass
+    except OSError:
+        pass
+
+
+def upload_cache_key(files: Sequence[UploadFile]) -> str:
+    """アップロード内容のキャッシュキーを返す
+
+    ファイル名は side/metric/単位の推定に使われるため内容と合わせてハッシュする。
+    複数ファイルは名前順に並べてからハッシュするので、送信順が違っても同じキーになる。
+    正規化ロジック・スキーマ・地域辞書のいずれかが変わるとキーも変わる。
+    """
+    h = hashlib.sha256()
+    for part in (NORMALIZER_VERSION, SCHEMA_VERSION, region_dictionary_version()):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    for name, data in sorted(files, key=lambda f: f[0]):
+        h.update(os.path.basename(name).encode("utf-8"))
+        h.update(b"\0%d\0" % len(data))
+        h.update(data)
+    return h.hexdigest()[:32]
+
+
+_secrets: Dict[str, bytes] = {}
+_secrets_lock = threading.Lock()
+
+
+def default_secret_path(uploads_dir: str = UPLOADS_DIR) -> str:
+    """uploads_dir を含むディレクトリ（配信するビルドディレクトリ）の隣に置く秘密鍵のパス
+
+    build/uploads なら build と同じ階層の .build.session-secret（ビルドディレクトリの外なので配信されない）。
+    """
+    parent = os.path.dirname(os.path.abspath(uploads_dir))
+    return os.path.join(os.path.dirname(parent), f".{os.path.basename(parent)}{SECRET_SUFFIX}")
+
+
+def _session_secret(path: str) -> bytes:
+    """path の秘密鍵を返す（無ければ作る）。再起動後も同じ内容は同じセッションになるようファイルに置く"""
+    path = os.path.abspath(path)
+    with _secrets_lock:
+        key = _secrets.get(path)
+        if key is not None:
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(path, "rb") as f:
+                key = f.read()
+        else:
+            key = secrets.token_bytes(32)
+            with os.fdopen(fd, "wb") as f:
+                f.write(key)
+        if len(key) < 16:
+            raise RuntimeError(f"session secret is too short: {path}")
+        _secrets[path] = key
+        return key
+
+
+def remove_legacy_secret(uploads_dir: str = UPLOADS_DIR) -> bool:
+    """旧版が uploads/ 直下に置いた秘密鍵を消す（配信されていたので使わない）。消したら True"""
+    try:
+        os.remove(os.path.join(uploads_dir, LEGACY_SECRET_FILE))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def upload_session_id(files: Sequence[UploadFile], uploads_dir: str = UPLOADS_DIR,
+                      secret_path: Optional[str] = None) -> str:
+    """アップロード内容からセッション ID を作る
+
+    同じ内容は同じセッション（作成済みの成果物を再利用）になるよう upload_cache_key から作るが、
+    内容のハッシュをそのまま ID にすると内容を知っていれば URL を推測できるため、
+    サーバの秘密鍵（secret_path、省略時は default_secret_path）で HMAC を取る。
+    """
+    key = upload_cache_key(files).encode("ascii")
+    secret = _session_secret(secret_path or default_secret_path(uploads_dir))
+    return hmac.new(secret, key, hashlib.sha256).hexdigest()[:32]
+
+
+def _unique_name(name: str, seen: Set[str]) -> str:
+    stem, ext = os.path.splitext(name)
+    k = 2
+    while name in seen:
+        name = f"{stem}-{k}{ext}"
+        k += 1
+    seen.add(name)
+    return name
+
+
+def expand_upload(files: Sequence[UploadFile]) -> List[UploadFile]:
+    """zip を展開して CSV の一覧にし、重複するファイル名には連番を付ける
+
+    Raises:
+        ValueError: 不正な zip / CSV を含まない / 件数・合計サイズの上限超過
+    """
+    out: List[UploadFile] = []
+    total = 0
+
+    def add(name: str, data: bytes) -> None:
+        nonlocal total
+        total += len(data)
+        if len(out) >= MAX_BATCH_FILES:
+            raise ValueError(f"too many files in upload (max {MAX_BATCH_FILES})")
+        if total > MAX_BATCH_BYTES:
+            raise ValueError(f"upload too large (max {MAX_BATCH_BYTES} bytes after extraction)")
+        out.append((name, data))
+
+    for name, data in files:
+        name = os.path.basename(name.replace("\\", "/")) or "uploaded.csv"
+        if not name.lower().endswith(".zip"):
+            add(name, data)
+            continue
+        try:
+            with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                for info in zf.infolist():
+                    member = info.filename
+                    if info.is_dir() or member.startswith("__MACOSX/") or not member.lower().endswith(".csv"):
+                        continue
+                    # 展開前に申告サイズで上限を確認する（zip bomb 対策）
+                    if total + info.file_size > MAX_BATCH_BYTES:
+                        raise ValueError(f"upload too large (max {MAX_BATCH_BYTES} bytes after extraction)")
+                    add(os.path.basename(member), zf.read(info))
+        except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError) as e:
+            raise ValueError(f"{name}: cannot read zip archive ({e})") from None
+    if not out:
+        raise ValueError("no CSV files in upload")
+    seen: Set[str] = set()
+    return [(_unique_name(name, seen), data) for name, data in out]
+
+
+def session_links(sid: str) -> Dict[str, str]:
+    return {
+        "normalized_csv": f"/uploads/{sid}/{NORMALIZED_FILE}",
+        "parse_log": f"/uploads/{sid}/{PARSE_LOG_FILE}",
+        "pivot_csv": f"/uploads/{sid}/{PIVOT_FILE}",
+    }
+
+
+def _noop_progress(stage: str, percent: float) -> None:
+    pass
+
+
+def write_session_outputs(
+    rows: List[Dict[str, object]],
+    out_dir: str,
+    inputs: List[Dict[str, object]],
+    *,
+    progress: Optional[ProgressFn] = None,
+    sqlite: bool = False,
+) -> Dict[str, object]:
+    """正規化済みの行からセッション成果物（正規化CSV/ピボット/サマリ/ログ）を書き出す
+
+    正規化CSVは (segment_region, year) 順に並べ、ゾーンマップ索引を横に書き出す。
+    sqlite=True なら正規化行を索引付きの SQLite（normalized.sqlite）にも書き出す。
+
+    Returns:
+        summary（build_summary_multi_measure の結果）
+    """
+    progress = progress or _noop_progress
+    progress("write_normalized", 55.0)
+    sort_rows(rows)
+    write_csv_with_zonemap(os.path.join(out_dir, NORMALIZED_FILE), rows, SCHEMA_HEADERS)
+    if sqlite:
+        progress("write_sqlite", 60.0)
+        write_sqlite(os.path.join(out_dir, DB_FILE), rows)
+    progress("pivot", 65.0)
+    pivot_headers, pivot_rows = build_pivot_year_measure(rows)
+    write_csv(os.path.join(out_dir, PIVOT_FILE), pivot_rows, pivot_headers)
+    progress("summary", 75.0)
+    summary = build_summary_multi_measure(rows)
+    progress("write_summary", 90.0)
+    write_summary(os.path.join(out_dir, SUMMARY_FILE), summary)
+    write_gzip_sidecar(os.path.join(out_dir, SUMMARY_FILE))
+    write_country_rankings(out_dir, summary)
+    parse_log = {"pipeline": "upload", "inputs": inputs, **schema_meta()}
+    with open(os.path.join(out_dir, PARSE_LOG_FILE), "w", encoding="utf-8") as f:
+        json.dump(parse_log, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def write_session_artifacts(
+    in_path: str,
+    out_dir: str,
+    *,
+    source_path: Optional[str] = None,
+    progress: Optional[ProgressFn] = None,
+    sqlite: bool = False,
+) -> Dict[str, object]:
+    """1ファイルを正規化し、セッション成果物を書き出す
+
+    Returns:
+        summary（build_summary_multi_measure の結果）
+    """
+    progress = progress or _noop_progress
+    progress("normalize", 10.0)
+    res = normalize_file(in_path, progress=lambda done: progress("normalize", 10.0 + 45.0 * done))
+    return write_session_outputs(res.rows, out_dir, [res.log_entry(source_path)], progress=progress, sqlite=sqlite)
+
+
+class StageTimer:
+    """progress コールバックとして渡し、ステージ別の所要時間を記録する"""
+
+    def __init__(self, forward: Optional[ProgressFn] = None) -> None:
+        self.timings: Dict[str, float] = {}
+        self.forward = forward
+        self._stage: Optional[str] = None
+        self._started = time.perf_counter()
+
+    def __call__(self, stage: str, percent: float) -> None:
+        if stage != self._stage:
+            now = time.perf_counter()
+            if self._stage is not None:
+                self.timings[self._stage] = round(now - self._started, 4)
+            self._stage, self._started = stage, now
+        if self.forward is not None:
+            self.forward(stage, percent)
+
+    def stop(self) -> Dict[str, float]:
+        if self._stage is not None:
+            self.timings[self._stage] = round(time.perf_counter() - self._started, 4)
+            self._stage = None
+        return self.timings
+
+
+def write_country_rankings(out_dir: str, summary: Dict[str, object]) -> str:
+    """サマリの年別国別ランキング表をエクスポート用に書き出す"""
+    countries = summary.get("countries")
+    table = countries.get("rankings_by_year", {}) if isinstance(countries, dict) else {}
+    path = os.path.join(out_dir, RANKINGS_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(table, f, ensure_ascii=False, separators=(",", ":"))
+    return path
+
+
+def load_country_rankings(norm_path: str) -> Dict[str, Dict[str, object]]:
+    """normalized.csv と同じディレクトリのランキング表を読む
+
+    無いか normalized.csv より古い場合（旧バージョンの成果物）はその場で作って保存する。
+    """
+    path = os.path.join(os.path.dirname(norm_path), RANKINGS_FILE)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(norm_path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+    db_path = os.path.join(os.path.dirname(norm_path), DB_FILE)
+    if os.path.isfile(db_path):
+        # 地域×年の合計は SQLite 側で集計する
+        table = country_rankings_from_db(db_path)
+    else:
+        with open(norm_path, "r", encoding="utf-8", newline="") as f:
+            table = build_country_rankings(csv.DictReader(f))
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(table, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return table
+
+
+def ensure_session_sqlite(norm_path: str) -> Optional[str]:
+    """normalized.csv に対応する SQLite が無ければ CSV から作る（SQLite 無しで作られた既存セッション用）"""
+    db_path = os.path.join(os.path.dirname(norm_path), DB_FILE)
+    if os.path.isfile(db_path):
+        return db_path
+    try:
+        with open(norm_path, "r", encoding="utf-8", newline="") as f:
+            return write_sqlite(db_path, csv.DictReader(f))
+    except OSError:
+        return None
+
+
+class WorkerCancelled(Exception):
+    """親プロセスでキャンセルされたため、ワーカー側の処理を打ち切った"""
+
+
+class RemoteProgress:
+    """プロセスプールのワーカーに渡す progress（picklable）
+
+    ステージと進捗を親プロセスのキューに送り（queue が None なら送らない）、
+    親でキャンセルされていれば WorkerCancelled を送出して処理を打ち切る。
+    """
+
+    def __init__(self, cancel, queue=None) -> None:
+        self.cancel = cancel
+        self.queue = queue
+
+    def __call__(self, stage: str, percent: float) -> None:
+        if self.cancel.is_set():
+            raise WorkerCancelled(stage)
+        if self.queue is not None:
+            self.queue.put((stage, percent))
+
+
+_MANAGER = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def _progress_manager():
+    """進捗キュー・キャンセル用イベントを置く Manager（初回利用時に spawn で起動し、プロセス内で共有）"""
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is None:
+            _MANAGER = multiprocessing.get_context("spawn").Manager()
+        return _MANAGER
+
+
+class ProgressChannel:
+    """ワーカーの RemoteProgress から届いた進捗を親の progress に中継する
+
+    親の progress が例外（キャンセル）を送出したら cancel を立て、ワーカーも次の進捗通知で止まる。
+    """
+
+    def __init__(self) -> None:
+        manager = _progress_manager()
+        self.queue = manager.Queue()
+        self.cancel = manager.Event()
+        self.last: Optional[Tuple[str, float]] = None
+
+    def remote(self, forward: bool = True) -> RemoteProgress:
+        return RemoteProgress(self.cancel, self.queue if forward else None)
+
+    def relay(self, progress: ProgressFn, stage: str, percent: float) -> None:
+        """届いた進捗を順に渡す。何も届いていなければ直前の（無ければ既定の）進捗でキャンセルを確認する"""
+        relayed = False
+        while True:
+            try:
+                self.last = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            progress(*self.last)
+            relayed = True
+        if not relayed:
+            progress(*(self.last or (stage, percent)))
+
+
+def build_artifacts_task(
+    in_path: str, out_dir: str, source_path: Optional[str] = None, sqlite: bool = False,
+    progress: Optional[ProgressFn] = None,
+) -> Dict[str, float]:
+    """プロセスプール用のエントリポイント
+
+    成果物はワーカー側でディスクに書き出し、プロセス境界を越えるのは
+    ステージ別の所要時間だけにする（行データやサマリ本体は返さない）。
+    進捗は progress（RemoteProgress）で親に送る。
+    """
+    timer = StageTimer(progress)
+    write_session_artifacts(in_path, out_dir, source_path=source_path, progress=timer, sqlite=sqlite)
+    return timer.stop()
+
+
+def normalize_part_task(
+    in_path: str, part_path: str, source_path: Optional[str] = None, progress: Optional[ProgressFn] = None,
+) -> Tuple[Dict[str, object], float]:
+    """バッチアップロードの 1 ファイル分を正規化し、行データを part_path に書き出す
+
+    行データはディスク経由でマージ側に渡し、プロセス境界を越えるのは
+    parse_log の入力エントリと所要時間だけにする。progress は正規化中のキャンセル確認に使う。
+    """
+    started = time.perf_counter()
+    res = normalize_file(in_path, progress=(lambda done: progress("normalize", done)) if progress else None)
+    with open(part_path, "wb") as f:
+        pickle.dump(res.rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return res.log_entry(source_path), round(time.perf_counter() - started, 4)
+
+
+def merge_parts_task(
+    part_paths: List[str], out_dir: str, inputs: List[Dict[str, object]], sqlite: bool = False,
+    progress: Optional[ProgressFn] = None,
+) -> Dict[str, float]:
+    """normalize_part_task の出力を入力順に連結して 1 セッション分の成果物を書き出す"""
+    timer = StageTimer(progress)
+    timer("merge", 55.0)
+    rows: List[Dict[str, object]] = []
+    for path in part_paths:
+        with open(path, "rb") as f:
+            rows.extend(pickle.load(f))
+    write_session_outputs(rows, out_dir, inputs, progress=timer, sqlite=sqlite)
+    return timer.stop()
+
+
+def _wait_all(
+    futures: List[Future], progress: ProgressFn, stage: str, start: float, end: float,
+    channel: Optional[ProgressChannel] = None,
+) -> None:
+    """全 future の完了を待つ（その間にキャンセルを確認する）
+
+    channel があればワーカーから届いたステージ・進捗を中継する（届いていなければ完了数に応じて start→end）。
+    キャンセルされたら channel 経由でワーカーにも伝える。
+    """
+    pending = set(futures)
+    try:
+        while pending:
+            _, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            percent = start + (end - start) * (len(futures) - len(pending)) / len(futures)
+            if channel is not None:
+                channel.relay(progress, stage, percent)
+            else:
+                progress(stage, percent)
+    except BaseException:
+        if channel is not None:
+            channel.cancel.set()
+        raise
+    for f in futures:
+        f.result()
+
+
+def _drain(futures: List[Future]) -> None:
+    """未着手の future を取り消し、実行中のワーカーが一時ディレクトリを使い終えるまで待つ"""
+    for f in futures:
+        if not f.cancel():
+            try:
+                f.result()
+            except Exception:
+                pass
+
+
+def _build_batch(
+    in_paths: List[str],
+    out_dir: str,
+    source_paths: List[str],
+    progress: ProgressFn,
+    executor: Optional[Executor],
+    sqlite: bool = False,
+) -> None:
+    """複数ファイルを（executor があれば並列に）正規化し、1 セッションにマージする"""
+    parts_dir = os.path.join(out_dir, ".parts")
+    os.makedirs(parts_dir)
+    part_paths = [os.path.join(parts_dir, f"{i}.pickle") for i in range(len(in_paths))]
+    n = len(in_paths)
+    if executor is None:
+        inputs = []
+        for i, (in_path, part_path, source_path) in enumerate(zip(in_paths, part_paths, source_paths)):
+            progress("normalize", 10.0 + 45.0 * i / n)
+            entry, seconds = normalize_part_task(in_path, part_path, source_path)
+            metrics.observe_stage_timings({"normalize": seconds})
+            inputs.append(entry)
+        metrics.observe_stage_timings(merge_parts_task(part_paths, out_dir, inputs, sqlite))
+    else:
+        progress("normalize", 10.0)
+        # 正規化中はファイルの完了数で進捗を出し、ワーカーにはキャンセルだけを伝える
+        cancel_only = ProgressChannel()
+        futures = [
+            executor.submit(normalize_part_task, os.path.abspath(p), os.path.abspath(q), s, cancel_only.remote(False))
+            for p, q, s in zip(in_paths, part_paths, source_paths)
+        ]
+        try:
+            _wait_all(futures, progress, "normalize", 10.0, 55.0, cancel_only)
+            results = [f.result() for f in futures]
+            for _, seconds in results:
+                metrics.observe_stage_timings({"normalize": seconds})
+            progress("merge", 55.0)
+            channel = ProgressChannel()
+            futures = [executor.submit(
+                merge_parts_task, [os.path.abspath(q) for q in part_paths], os.path.abspath(out_dir),
+                [entry for entry, _ in results], sqlite, channel.remote(),
+            )]
+            _wait_all(futures, progress, "merge", 55.0, 55.0, channel)
+            metrics.observe_stage_timings(futures[0].result())
+            progress("finalize", 95.0)
+        finally:
+            _drain(futures)
+    shutil.rmtree(parts_dir, ignore_errors=True)
+
+
+def warm_worker() -> None:
+    """プロセスプールの initializer：地域辞書を事前ロードしておく"""
+    load_region_dictionary()
+    region_dictionary_version()
+
+
+def session_summary_path(sid: str, uploads_dir: str = UPLOADS_DIR) -> str:
+    return os.path.join(uploads_dir, sid, SUMMARY_FILE)
+
+
+def read_session_summary(sid: str, uploads_dir: str = UPLOADS_DIR) -> Optional[bytes]:
+    """完成済みセッションの summary.json を生バイトで返す（未作成なら None）"""
+    try:
+        with open(session_summary_path(sid, uploads_dir), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def session_normalized_path(sid: str = "", uploads_dir: str = UPLOADS_DIR) -> Optional[str]:
+    """セッション（未指定ならビルド既定）の normalized.csv のパス。存在しなければ None"""
+    if sid:
+        if not is_session_id(sid):
+            return None
+        path = os.path.join(uploads_dir, sid, NORMALIZED_FILE)
+    else:
+        # セッションIDがない場合は既定パス（後方互換性）
+        path = NORMALIZED_FILE
+        if not os.path.exists(path):
+            path = os.path.join("build", NORMALIZED_FILE)
+    return path if os.path.isfile(path) else None
+
+
+def create_session(
+    files: Sequence[UploadFile],
+    uploads_dir: str = UPLOADS_DIR,
+    *,
+    progress: Optional[ProgressFn] = None,
+    executor: Optional[Executor] = None,
+    sqlite: bool = False,
+    secret_path: Optional[str] = None,
+) -> Tuple[str, bytes, bool]:
+    """アップロード内容からセッションを作成する（同一内容なら既存成果物を再利用）
+
+    files は expand_upload 済みの (ファイル名, 内容) の一覧。複数ファイルは
+    ファイルごとに正規化してから 1 つのセッションにマージする（行の source 列が入力ファイル名）。
+    成果物は一時ディレクトリに書き出してから rename で確定するため、
+    同一内容の同時アップロードでも中途半端なセッションは見えない。
+    executor（プロセスプール）を渡すと正規化・集計をそちらで実行する。
+    sqlite=True なら normalized.sqlite も作る（キャッシュヒット時に無ければ後から作る）。
+    secret_path はセッション ID の秘密鍵（upload_session_id を参照）。
+
+    Returns:
+        (session_id, summary.json のバイト列, キャッシュヒットかどうか)
+    """
+    progress = progress or _noop_progress
+    progress("hash", 0.0)
+    sid = upload_session_id(files, uploads_dir, secret_path)
+    cached = read_session_summary(sid, uploads_dir)
+    metrics.observe_upload(sum(len(data) for _, data in files), cached is not None)
+    if cached is not None:
+        if sqlite:
+            ensure_session_sqlite(os.path.join(uploads_dir, sid, NORMALIZED_FILE))
+        touch_session(sid, uploads_dir)
+        return sid, cached, True
+
+    final_dir = os.path.join(uploads_dir, sid)
+    tmp_dir = os.path.join(uploads_dir, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp_dir)
+    future = None
+    try:
+        in_paths: List[str] = []
+        source_paths: List[str] = []
+        for filename, data in files:
+            name = os.path.basename(filename) or "uploaded.csv"
+            in_path = os.path.join(tmp_dir, name)
+            with open(in_path, "wb") as f:
+                f.write(data)
+            in_paths.append(in_path)
+            source_paths.append(os.path.abspath(os.path.join(final_dir, name)))
+        if len(in_paths) > 1:
+            _build_batch(in_paths, tmp_dir, source_paths, progress, executor, sqlite)
+        elif executor is None:
+            timer = StageTimer(progress)
+            write_session_artifacts(in_paths[0], tmp_dir, source_path=source_paths[0], progress=timer, sqlite=sqlite)
+            metrics.observe_stage_timings(timer.stop())
+        else:
+            progress("normalize", 10.0)
+            # ワーカーのステージ・進捗を中継し、キャンセルはワーカーにも伝えて途中で止める
+            channel = ProgressChannel()
+            future = executor.submit(
+                build_artifacts_task, os.path.abspath(in_paths[0]), os.path.abspath(tmp_dir), source_paths[0], sqlite,
+                channel.remote(),
+            )
+            _wait_all([future], progress, "normalize", 10.0, 10.0, channel)
+            metrics.observe_stage_timings(future.result())
+            progress("finalize", 95.0)
+        try:
+            os.rename(tmp_dir, final_dir)
+        except OSError:
+            # 同一内容の並行アップロードが先に確定した
+            if read_session_summary(sid, uploads_dir) is None:
+                raise
+    finally:
+        if future is not None:
+            _drain([future])
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    summary = read_session_summary(sid, uploads_dir)
+    if summary is None:
+        raise RuntimeError(f"session {sid} was not materialized")
+    touch_session(sid, uploads_dir)
+    return sid, summary, False
+
+
+@dataclass
+class SessionInfo:
+    sid: str
+    size: int
+    files: int
+    last_access: float
+    pinned: bool
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "session_id": self.sid,
+            "size": self.size,
+            "files": self.files,
+            "last_access": self.last_access,
+            "pinned": self.pinned,
+        }
+
+
+class SessionStore:
+    """uploads/ 配下のセッションのライフサイクル管理
+
+    - 最終アクセス時刻を記録し、ttl 秒アクセスの無いセッションを削除
+    - 合計サイズ quota_bytes / セッション数 max_sessions を超えたら古い順（LRU）に削除
+    - ピン留めされたセッションは削除しない
+    - sweep_interval 秒ごとにバックグラウンドで掃除する
+    """
+
+    # 最終アクセスの記録はこの間隔より細かくは更新しない
+    touch_interval = 60.0
+    # 作成途中で放置された一時ディレクトリの猶予
+    tmp_grace = 3600.0
+
+    def __init__(
+        self,
+        root: str = UPLOADS_DIR,
+        *,
+        ttl: Optional[float] = 7 * 86400,
+        quota_bytes: Optional[int] = 2 * 1024 ** 3,
+        max_sessions: Optional[int] = 1000,
+        sweep_interval: float = 600.0,
+    ) -> None:
+        self.root = root
+        self.ttl = ttl
+        self.quota_bytes = quota_bytes
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self.evicted = 0
+        self._touched: Dict[str, float] = {}
+        # セッションのサイズ（ディレクトリの mtime → バイト数・ファイル数）。SQLite・ランキング表を
+        # 後から作る・マーカーを置くなどファイルが増減するとディレクトリの mtime が変わり、測り直す
+        self._sizes: Dict[str, Tuple[int, int, int]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def path(self, sid: str) -> str:
+        return os.path.join(self.root, sid)
+
+    def exists(self, sid: str) -> bool:
+        return is_session_id(sid) and os.path.isdir(self.path(sid))
+
+    def touch(self, sid: str) -> None:
+        if not self.exists(sid):
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._touched.get(sid, 0.0) < self.touch_interval:
+                return
+            self._touched[sid] = now
+        touch_session(sid, self.root)
+
+    def pin(self, sid: str, pinned: bool = True) -> bool:
+        if not self.exists(sid):
+            return False
+        marker = os.path.join(self.path(sid), PIN_MARKER)
+        if pinned:
+            open(marker, "ab").close()
+        elif os.path.exists(marker):
+            os.remove(marker)
+        return True
+
+    def info(self, sid: str) -> Optional[SessionInfo]:
+        d = self.path(sid)
+        try:
+            stamp = os.stat(d).st_mtime_ns
+        except OSError:
+            return None
+        try:
+            last_access = os.path.getmtime(os.path.join(d, ACCESS_MARKER))
+        except OSError:
+            last_access = stamp / 1e9
+        cached = self._sizes.get(sid)
+        size, files = cached[1:] if cached is not None and cached[0] == stamp else self._measure(sid, stamp)
+        return SessionInfo(
+            sid=sid, size=size, files=files, last_access=last_access,
+            pinned=os.path.exists(os.path.join(d, PIN_MARKER)),
+        )
+
+    def _measure(self, sid: str, stamp: int) -> Tuple[int, int]:
+        size = files = 0
+        for dirpath, _, filenames in os.walk(self.path(sid)):
+            for name in filenames:
+                try:
+                    size += os.path.getsize(os.path.join(dirpath, name))
+                    files += 1
+                except OSError:
+                    pass
+        self._sizes[sid] = (stamp, size, files)
+        return size, files
+
+    def list_sessions(self) -> List[SessionInfo]:
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        infos = []
+        for name in names:
+            if is_session_id(name):
+                info = self.info(name)
+                if info is not None:
+                    infos.append(info)
+        return infos
+
+    def usage(self) -> Dict[str, int]:
+        infos = self.list_sessions()
+        return {
+            "sessions": len(infos),
+            "bytes": sum(i.size for i in infos),
+            "files": sum(i.files for i in infos),
+            "pinned": sum(1 for i in infos if i.pinned),
+        }
+
+    def remove(self, sid: str) -> None:
+        shutil.rmtree(self.path(sid), ignore_errors=True)
+        with self._lock:
+            self._touched.pop(sid, None)
+        self._sizes.pop(sid, None)
+        self.evicted += 1
+
+    def sweep(self, now: Optional[float] = None) -> List[str]:
+        """TTL 超過 → 容量/件数超過（LRU）の順に削除し、削除したセッションIDを返す"""
+        now = now or time.time()
+        removed: List[str] = []
+        self._sweep_tmp(now)
+        infos = sorted(self.list_sessions(), key=lambda i: i.last_access)
+        live: List[SessionInfo] = []
+        for info in infos:
+            if not info.pinned and self.ttl is not None and now - info.last_access > self.ttl:
+                self.remove(info.sid)
+                removed.append(info.sid)
+            else:
+                live.append(info)
+        total = sum(i.size for i in live)
+        count = len(live)
+        for info in live:
+            over_quota = self.quota_bytes is not None and total > self.quota_bytes
+            over_count = self.max_sessions is not None and count > self.max_sessions
+            if not (over_quota or over_count):
+                break
+            if info.pinned:
+                continue
+            self.remove(info.sid)
+            removed.append(info.sid)
+            total -= info.size
+            count -= 1
+        return removed
+
+    def _sweep_tmp(self, now: float) -> None:
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.startswith(".tmp-"):
+                continue
+            p = os.path.join(self.root, name)
+            try:
+                if now - os.path.getmtime(p) > self.tmp_grace:
+                    shutil.rmtree(p, ignore_errors=True)
+            except OSError:
+                pass
+
+    def start_sweeper(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_sweeper, name="session-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run_sweeper(self) -> None:
+        while True:
+            try:
+                removed = self.sweep()
+                if removed:
+                    print(f"session sweeper: removed {len(removed)} session(s)")
+            except Exception as e:
+                print(f"session sweeper error: {e}")
+            if self._stop.wait(self.sweep_interval):
+                return
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import base64
+import datetime
+import gzip
+import json
+import os
+from typing import Dict, Optional
+
+from . import __version__
+from .summary_codec import dumps_summary
+
+
+# 共有用の単一 HTML（オフラインで開けるダッシュボード）
+#
+# ダッシュボードの HTML に次の 2 つの script を足したもの:
+#   <script type="application/json" id="investviz-share">
+#     {"format": "investviz-share", "version": 1, "encoding": "gzip+base64",
+#      "state": {表示状態}, "meta": {"generated", "generator", "summary_bytes", "payload_bytes"}}
+#   meta には元データの場所（セッション ID・ローカルのパス）を入れない（HTML は外部に渡すもの）
+#   <script type="application/octet-stream" id="investviz-share-data">（サマリのコンパクト形式を gzip して base64 化したもの）
+# ダッシュボードは DecompressionStream で展開してデータ層に読み込み、state の表示を復元する。
+# サーバ・API は使わない（CSV エクスポートとアップロードは無効、画像エクスポートは使える）
+SHARE_FORMAT = "investviz-share"
+SHARE_FORMAT_VERSION = 1
+
+SHARE_VIEWS = (
+    "timeseries", "yoy_diff", "composition", "heatmap", "boxplot", "country_pie", "country_bar", "multi_panel",
+)
+SHARE_SORTS = ("value", "value_asc", "name", "name_desc")
+SHARE_SCALES = ("linear", "log")
+# 表示数スライダー（topN）の範囲
+TOP_N_RANGE = (5, 30)
+
+_ANCHOR = '<script id="investviz-data-layer">'
+
+
+def share_state(raw: object) -> Dict[str, object]:
+    """表示状態から共有 HTML に埋め込む項目だけを取り出す（不正な値の項目は捨てる）
+
+    {"view", "measure"（系列番号）, "region"（地域名）, "year", "top_n", "sort_by", "others",
+     "scale", "trend", "overlay"}。dict でなければ ValueError。
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("state must be an object")
+    state: Dict[str, object] = {}
+    if raw.get("view") in SHARE_VIEWS:
+        state["view"] = raw["view"]
+    measure = raw.get("measure")
+    if isinstance(measure, int) and not isinstance(measure, bool) and measure >= 0:
+        state["measure"] = measure
+    for key in ("region", "year"):
+        value = raw.get(key)
+        if isinstance(value, (str, int)) and not isinstance(value, bool) and str(value):
+            state[key] = str(value)
+    top_n = raw.get("top_n")
+    if isinstance(top_n, int) and not isinstance(top_n, bool):
+        state["top_n"] = min(max(top_n, TOP_N_RANGE[0]), TOP_N_RANGE[1])
+    if raw.get("sort_by") in SHARE_SORTS:
+        state["sort_by"] = raw["sort_by"]
+    if raw.get("scale") in SHARE_SCALES:
+        state["scale"] = raw["scale"]
+    for key in ("others", "trend", "overlay"):
+        if isinstance(raw.get(key), bool):
+            state[key] = raw[key]
+    return state
+
+
+def share_payload(summary: Dict[str, object], encoding: str = "auto") -> str:
+    """サマリのコンパクト形式を gzip して base64 化した文字列（同じサマリなら同じ結果になる）"""
+    return compress_payload(dumps_summary(summary, encoding=encoding))
+
+
+def compress_payload(raw: bytes) -> str:
+    return base64.b64encode(gzip.compress(raw, compresslevel=9, mtime=0)).decode("ascii")
+
+
+def _script_json(value: object) -> str:
+    # script 要素の中に置くので "</" を閉じタグと解釈されないようにする
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+
+
+def share_html(payload: str, state: Optional[Dict[str, object]] = None, *,
+               summary_bytes: Optional[int] = None) -> bytes:
+    """share_payload の結果と表示状態をダッシュボードの HTML に埋め込む"""
+    from .ui import INDEX_HTML
+
+    header = {
+        "format": SHARE_FORMAT,
+        "version": SHARE_FORMAT_VERSION,
+        "encoding": "gzip+base64",
+        "state": share_state(state or {}),
+        "meta": {
+            "generated": datetime.datetime.now().isoformat(timespec="seconds"),
+            "generator": f"mof_investviz {__version__}",
+            "summary_bytes": summary_bytes,
+            "payload_bytes": len(payload) * 3 // 4,
+        },
+    }
+    embed = (
+        f'<script type="application/json" id="investviz-share">{_script_json(header)}</script>\n'
+        f'  <script type="application/octet-stream" id="investviz-share-data">{payload}</script>\n  '
+    )
+    if INDEX_HTML.count(_ANCHOR) != 1:
+        raise RuntimeError("dashboard template has no data layer script")
+    return INDEX_HTML.replace(_ANCHOR, embed + _ANCHOR).encode("utf-8")
+
+
+def build_share_html(summary: Dict[str, object], state: Optional[Dict[str, object]] = None, *,
+                     encoding: str = "auto") -> bytes:
+    raw = dumps_summary(summary, encoding=encoding)
+    return share_html(compress_payload(raw), state, summary_bytes=len(raw))
+
+
+def write_share_html(path: str, summary: Dict[str, object], state: Optional[Dict[str, object]] = None, *,
+                     encoding: str = "auto") -> str:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(build_share_html(summary, state, encoding=encoding))
+    return path
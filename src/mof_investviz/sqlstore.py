@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import uuid
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .normalize import SCHEMA_HEADERS, build_country_rankings
+
+
+# normalized.csv と同じディレクトリに置く SQLite 版（任意の保存形式）
+DB_FILE = "normalized.sqlite"
+TABLE = "observations"
+
+# 数値として比較・集計する列。それ以外は CSV と同じ文字列のまま保持する
+_COLUMN_TYPES = {
+    "year": "INTEGER",
+    "fiscal_year": "INTEGER",
+    "value_100m_yen": "REAL",
+}
+INDEXES = {
+    "idx_obs_year": ("year",),
+    "idx_obs_region": ("segment_region",),
+    "idx_obs_measure": ("measure",),
+    "idx_obs_side_metric": ("side", "metric"),
+}
+# executemany 1 回あたりの行数（全体は 1 トランザクション）
+BATCH_ROWS = 20000
+
+
+def db_path_for(norm_path: str) -> str:
+    """normalized.csv に対応する SQLite ファイルのパス"""
+    return os.path.join(os.path.dirname(norm_path), DB_FILE)
+
+
+def _cell(v: object) -> object:
+    # csv.DictWriter と同じ文字列化（None/空 → NULL、bool → "True"/"False"）
+    if v is None or v == "":
+        return None
+    if isinstance(v, bool):
+        return str(v)
+    return v
+
+
+def _batches(rows: Iterable[Dict[str, object]], headers: Sequence[str]) -> Iterator[List[Tuple[object, ...]]]:
+    batch: List[Tuple[object, ...]] = []
+    for r in rows:
+        batch.append(tuple(_cell(r.get(h)) for h in headers))
+        if len(batch) >= BATCH_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_sqlite(path: str, rows: Iterable[Dict[str, object]], headers: Sequence[str] = SCHEMA_HEADERS) -> str:
+    """正規化行を SQLite（WAL）に書き出す
+
+    一時ファイルに一括ロード（executemany・単一トランザクション）してから索引を張り、
+    rename で確定する。行の順序は rowid として normalized.csv と同じに保つ。
+    """
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    columns = ", ".join(f'"{h}" {_COLUMN_TYPES.get(h, "TEXT")}' for h in headers)
+    placeholders = ", ".join("?" for _ in headers)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        with conn:
+            conn.execute(f"CREATE TABLE {TABLE} ({columns})")
+            for batch in _batches(rows, headers):
+                conn.executemany(f"INSERT INTO {TABLE} VALUES ({placeholders})", batch)
+            for name, cols in INDEXES.items():
+                if all(c in headers for c in cols):
+                    conn.execute(f"CREATE INDEX {name} ON {TABLE} ({', '.join(cols)})")
+        conn.execute("ANALYZE")
+        # WAL を本体に書き戻してから確定する（-wal/-shm を残さない）
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    os.replace(tmp, path)
+    return path
+
+
+def connect_readonly(path: str) -> sqlite3.Connection:
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+
+def select_rows(
+    path: str,
+    *,
+    region: str = "",
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+) -> Tuple[List[str], List[Dict[str, str]]]:
+    """/api/export の地域・年範囲フィルタを SQL で評価し、CSV と同じ文字列の行を返す
+
+    年が空の行は CSV 走査と同じく 0 年として比較する。
+    year の比較は idx_obs_year を使えるように列をそのまま比べ、範囲が 0 を含むときだけ
+    年が空の行を OR で足す。
+    """
+    where: List[str] = []
+    args: List[object] = []
+    if region:
+        where.append("segment_region = ?")
+        args.append(region)
+    years: List[str] = []
+    if year_from is not None:
+        years.append("year >= ?")
+        args.append(year_from)
+    if year_to is not None:
+        years.append("year <= ?")
+        args.append(year_to)
+    if years:
+        cond = " AND ".join(years)
+        if (year_from is None or year_from <= 0) and (year_to is None or year_to >= 0):
+            cond = f"({cond}) OR year IS NULL"
+        where.append(f"({cond})")
+    sql = f"SELECT * FROM {TABLE}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY rowid"
+    conn = connect_readonly(path)
+    try:
+        cur = conn.execute(sql, args)
+        headers = [d[0] for d in cur.description]
+        rows = [
+            {h: "" if v is None else str(v) for h, v in zip(headers, row)}
+            for row in cur
+        ]
+    finally:
+        conn.close()
+    return headers, rows
+
+
+def country_rankings_from_db(path: str) -> Dict[str, Dict[str, object]]:
+    """地域×年の合計を SQL で集計してから年別国別ランキング表を作る"""
+    conn = connect_readonly(path)
+    try:
+        cur = conn.execute(
+            f"SELECT segment_region, year, SUM(value_100m_yen) FROM {TABLE}"
+            " WHERE segment_region IS NOT NULL GROUP BY segment_region, year"
+        )
+        agg = [
+            {"segment_region": region, "year": year, "value_100m_yen": total}
+            for region, year, total in cur
+        ]
+    finally:
+        conn.close()
+    return build_country_rankings(agg)
@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import email.utils
+import gzip
+import hashlib
+import http.server
+import io
+import os
+import shutil
+import uuid
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+
+# これ以上のサイズのファイルは os.sendfile（socket.sendfile）で送る
+SENDFILE_THRESHOLD = 64 * 1024
+
+# 1 リクエストで受け付ける Range の区間数（超える場合は Range を無視して全体を返す）
+MAX_RANGES = 32
+
+# (先頭, 末尾) のバイト位置（両端を含む）
+ByteRange = Tuple[int, int]
+
+
+class StaticAsset:
+    """メモリ上に保持して配信する静的アセット（内容ハッシュ ETag と gzip 版を事前計算）"""
+
+    def __init__(self, body: bytes, content_type: str) -> None:
+        self.body = body
+        self.content_type = content_type
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        self.gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+        self.gzip_etag = f'"{digest}-gz"'
+
+    @classmethod
+    def from_text(cls, text: str, content_type: str = "text/html; charset=utf-8") -> "StaticAsset":
+        return cls(text.encode("utf-8"), content_type)
+
+
+def file_etag(st: os.stat_result) -> str:
+    """mtime とサイズから強い ETag を作る"""
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match の値が etag と一致するか（弱い比較）"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == bare:
+            return True
+    return False
+
+
+def accepts_gzip(header: Optional[str]) -> bool:
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if token.strip().lower() not in ("gzip", "*"):
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[List[ByteRange]]:
+    """Range ヘッダ（bytes 単位）を解釈し、重なり・隣接を併合した区間の一覧を返す
+
+    Returns:
+        None: Range なし・構文が不正・区間数の上限超過（全体を 200 で返す）
+        []: 満たせる区間が無い（416）
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges: List[ByteRange] = []
+    specs = [part.strip() for part in spec.split(",") if part.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    for part in specs:
+        first, sep, last = part.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+            return None
+        if first == "":
+            # 末尾 N バイト（bytes=-N）
+            if last == "":
+                return None
+            n = int(last)
+            if n > 0 and size > 0:
+                ranges.append((max(0, size - n), size - 1))
+            continue
+        start = int(first)
+        end = size - 1 if last == "" else int(last)
+        if last != "" and end < start:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    ranges.sort()
+    merged: List[ByteRange] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def write_gzip_sidecar(path: str) -> str:
+    """path の gzip 版（path + '.gz'）を書き出す（配信時に Content-Encoding: gzip で返す）"""
+    gz_path = path + ".gz"
+    with open(path, "rb") as src, gzip.open(gz_path, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst)
+    return gz_path
+
+
+def is_hidden_path(url_path: str) -> bool:
+    """URL パスにドットで始まる要素（.session-secret・.git など）が含まれるか"""
+    return any(part.startswith(".") for part in unquote(url_path).replace("\\", "/").split("/"))
+
+
+class CachingFileHandler(http.server.SimpleHTTPRequestHandler):
+    """ETag/Cache-Control による再検証と sendfile に対応した静的ファイルハンドラ
+
+    - memory_assets に登録したパスはメモリから配信（gzip 版を事前計算済み）
+    - ファイルは mtime+サイズの ETag と Last-Modified で 304 を返す
+    - `<file>.gz` が新しければ gzip 版をそのまま返す
+    - 内容アドレスのセッション成果物（/uploads/）は immutable としてキャッシュさせる
+    - ファイルは Range（単一・複数区間、If-Range）に対応し、区間も sendfile で送る
+    """
+
+    memory_assets: Dict[str, StaticAsset] = {}
+    immutable_prefixes = ("/uploads/",)
+    # send_head が決めた送信区間と multipart/byteranges の区切り（copyfile が参照する）
+    _ranges: Optional[List[ByteRange]] = None
+    _boundary: Optional[str] = None
+    _part_headers: List[bytes] = []
+
+    def list_directory(self, path):
+        """ディレクトリ一覧は出さない（uploads/ のセッション ID が列挙できてしまう）"""
+        self.send_error(404, "File not found")
+        return None
+
+    def cache_control(self, url_path: str) -> str:
+        if url_path.startswith(self.immutable_prefixes):
+            return "private, max-age=31536000, immutable"
+        return "no-cache"
+
+    def send_head(self):
+        self._ranges = None
+        self._boundary = None
+        url_path = urlsplit(self.path).path
+        asset = self.memory_assets.get(url_path)
+        if asset is not None:
+            return self.send_memory_asset(asset)
+        if is_hidden_path(url_path):
+            # ドットで始まる要素（鍵ファイルなど）は配信しない
+            self.send_error(404, "File not found")
+            return None
+        path = self.translate_path(self.path)
+        if path.endswith("/") or not os.path.isfile(path):
+            # ディレクトリ/存在しないファイルは既定の処理（リダイレクト・index.html・404）
+            return super().send_head()
+
+        encoding = None
+        serve_path = path
+        gz_path = path + ".gz"
+        has_gz = os.path.isfile(gz_path) and os.path.getmtime(gz_path) >= os.path.getmtime(path)
+        if has_gz and accepts_gzip(self.headers.get("Accept-Encoding")):
+            serve_path, encoding = gz_path, "gzip"
+        try:
+            f = open(serve_path, "rb")
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+        try:
+            st = os.fstat(f.fileno())
+            etag = file_etag(st)
+            cache_control = self.cache_control(url_path)
+            if self.not_modified(etag, st.st_mtime):
+                f.close()
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", cache_control)
+                if has_gz:
+                    self.send_header("Vary", "Accept-Encoding")
+                self.end_headers()
+                return None
+            ctype = self.guess_type(path)
+            ranges = None
+            if self.if_range_matches(etag, st.st_mtime):
+                ranges = parse_range(self.headers.get("Range"), st.st_size)
+            if ranges is not None and not ranges:
+                f.close()
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{st.st_size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            if ranges:
+                self.send_response(206)
+                length = self.prepare_ranges(ranges, ctype, st.st_size)
+                if len(ranges) == 1:
+                    start, end = ranges[0]
+                    self.send_header("Content-Type", ctype)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{st.st_size}")
+                else:
+                    self.send_header("Content-Type", f"multipart/byteranges; boundary={self._boundary}")
+                self.send_header("Content-Length", str(length))
+            else:
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(st.st_size))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Last-Modified", self.date_time_string(st.st_mtime))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            if has_gz:
+                self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return f
+        except Exception:
+            f.close()
+            raise
+
+    def if_range_matches(self, etag: str, mtime: float) -> bool:
+        """If-Range が無いか現在の表現と一致すれば True（不一致なら Range を無視して全体を返す）
+
+        ETag は強い比較、日付は Last-Modified と秒単位で完全一致したときのみ有効。
+        """
+        value = (self.headers.get("If-Range") or "").strip()
+        if not value:
+            return True
+        if value.startswith('"') or value.startswith("W/"):
+            return value == etag
+        try:
+            return int(email.utils.parsedate_to_datetime(value).timestamp()) == int(mtime)
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+
+    def prepare_ranges(self, ranges: List[ByteRange], ctype: str, size: int) -> int:
+        """送信区間を記録し、レスポンス本文の長さを返す（複数区間は multipart/byteranges）"""
+        self._ranges = ranges
+        if len(ranges) == 1:
+            return ranges[0][1] - ranges[0][0] + 1
+        self._boundary = uuid.uuid4().hex
+        self._part_headers = [
+            (f"\r\n--{self._boundary}\r\nContent-Type: {ctype}\r\n"
+             f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode("latin-1")
+            for start, end in ranges
+        ]
+        closing = f"\r\n--{self._boundary}--\r\n".encode("latin-1")
+        self._part_headers.append(closing)
+        return sum(len(h) for h in self._part_headers) + sum(end - start + 1 for start, end in ranges)
+
+    def send_memory_asset(self, asset: StaticAsset):
+        use_gzip = accepts_gzip(self.headers.get("Accept-Encoding"))
+        body, etag = (asset.gzip_body, asset.gzip_etag) if use_gzip else (asset.body, asset.etag)
+        if etag_matches(self.headers.get("If-None-Match"), etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return None
+        self.send_response(200)
+        self.send_header("Content-Type", asset.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def not_modified(self, etag: str, mtime: float) -> bool:
+        """条件付きリクエストを評価する（If-None-Match を If-Modified-Since より優先）"""
+        inm = self.headers.get("If-None-Match")
+        if inm is not None:
+            return etag_matches(inm, etag)
+        ims = self.headers.get("If-Modified-Since")
+        if ims:
+            try:
+                since = email.utils.parsedate_to_datetime(ims).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    def copyfile(self, source, outputfile):
+        """大きな実ファイルはカーネル内コピー（sendfile）で送る（Range 指定時は区間ごと）"""
+        if self._ranges:
+            ranges, self._ranges = self._ranges, None
+            if len(ranges) == 1:
+                self.send_file_range(source, outputfile, *ranges[0])
+                return
+            for header, (start, end) in zip(self._part_headers, ranges):
+                outputfile.write(header)
+                self.send_file_range(source, outputfile, start, end)
+            outputfile.write(self._part_headers[-1])
+            return
+        try:
+            fileno = source.fileno()
+            size = os.fstat(fileno).st_size
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            size = 0
+        if size >= SENDFILE_THRESHOLD and hasattr(os, "sendfile"):
+            outputfile.flush()
+            self.connection.sendfile(source)
+            return
+        super().copyfile(source, outputfile)
+
+    def send_file_range(self, source, outputfile, start: int, end: int) -> None:
+        count = end - start + 1
+        if count >= SENDFILE_THRESHOLD and hasattr(os, "sendfile"):
+            outputfile.flush()
+            self.connection.sendfile(source, start, count)
+            return
+        source.seek(start)
+        while count > 0:
+            chunk = source.read(min(count, 64 * 1024))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            count -= len(chunk)
@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import base64
+import json
+import struct
+from typing import Dict, List, Sequence
+
+from .normalize import rank_countries
+
+
+# summary.json のコンパクト形式（列指向）
+#
+#   {"format": "investviz-summary", "version": 1,
+#    "labels": [...],                 # ラベル辞書（系列名・地域名・構成比ラベル）
+#    "axis": ["2014", ...],           # 全系列で共有する x（= years）
+#    "series": {"labels": [ラベル番号], "values": <値ブロック>},
+#    "composition": {"year", "labels": [ラベル番号], "share": [...]},
+#    "regions":   {"available": [番号], "series": {...}, "composition": {...}},
+#    "countries": {"available": [番号], "series": {...}, "rankings": {"labels", "values"},
+#                  "rankings_by_year": {年: {"countries": [番号], "values": <値ブロック>}}, "composition": {...}}}
+#
+# 値ブロックは行優先（系列 × axis）で、enc に応じて
+#   "delta": 全値が整数のとき。系列ごとに先頭値とその後の差分（整数配列）
+#   "f64" / "f32": little-endian の float64 / float32 を base64 化した文字列
+# downsample_summary で間引いた系列ブロックは values を 系列 × points にし、
+#   "sample": {"n": 元の点数, "points": 間引き後の点数, "i": 元のインデックス（値ブロック）,
+#              "y_min": <値ブロック>, "y_max": <値ブロック>}
+# を足す（x は axis[i]）。同じブロックの系列はすべて同じ点数に間引かれている必要がある。
+# ランキング表の total/share/cumulative/by_name は国と値から復元できるので格納しない。
+# ダッシュボード側の decodeSummary() が従来の形（series[].x/y など）に展開する。
+SUMMARY_FORMAT = "investviz-summary"
+SUMMARY_FORMAT_VERSION = 1
+
+VALUE_ENCODINGS = ("auto", "f64", "f32")
+
+# 整数として差分符号化してよい絶対値の上限（JS の Number で誤差なく扱える範囲）
+_MAX_SAFE_INT = 2 ** 53
+
+
+class _Labels:
+    def __init__(self) -> None:
+        self.items: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    def ref(self, label: object) -> int:
+        key = str(label)
+        i = self._index.get(key)
+        if i is None:
+            i = self._index[key] = len(self.items)
+            self.items.append(key)
+        return i
+
+    def refs(self, labels: Sequence[object]) -> List[int]:
+        return [self.ref(l) for l in labels]
+
+
+def encode_values(rows: Sequence[Sequence[float]], encoding: str = "auto") -> Dict[str, object]:
+    """同じ長さの数値配列の並びを値ブロックに符号化する"""
+    flat = [float(v or 0.0) for row in rows for v in row]
+    if encoding == "auto":
+        if all(v.is_integer() and abs(v) < _MAX_SAFE_INT for v in flat):
+            data: List[int] = []
+            for row in rows:
+                prev = 0
+                for v in row:
+                    iv = int(v or 0)
+                    data.append(iv - prev)
+                    prev = iv
+            return {"enc": "delta", "data": data}
+        encoding = "f64"
+    if encoding not in ("f64", "f32"):
+        raise ValueError(f"unknown value encoding: {encoding}")
+    fmt = "<%d%s" % (len(flat), "d" if encoding == "f64" else "f")
+    return {"enc": encoding, "data": base64.b64encode(struct.pack(fmt, *flat)).decode("ascii")}
+
+
+def decode_values(block: Dict[str, object], n_rows: int, n_cols: int) -> List[List[float]]:
+    enc = block.get("enc")
+    data = block.get("data")
+    if enc == "delta":
+        flat: List[float] = []
+        for r in range(n_rows):
+            acc = 0
+            for d in data[r * n_cols:(r + 1) * n_cols]:  # type: ignore[index]
+                acc += d
+                flat.append(float(acc))
+    elif enc in ("f64", "f32"):
+        raw = base64.b64decode(data)  # type: ignore[arg-type]
+        flat = list(struct.unpack("<%d%s" % (n_rows * n_cols, "d" if enc == "f64" else "f"), raw))
+    else:
+        raise ValueError(f"unknown value encoding: {enc}")
+    return [flat[r * n_cols:(r + 1) * n_cols] for r in range(n_rows)]
+
+
+def _encode_series(series: List[Dict[str, object]], labels: _Labels, encoding: str) -> Dict[str, object]:
+    out: Dict[str, object] = {
+        "labels": labels.refs([s.get("label", "") for s in series]),
+        "values": encode_values([list(s.get("y", [])) for s in series], encoding),
+    }
+    sampled = [s for s in series if "i" in s]
+    if sampled:
+        shapes = {(len(s["i"]), s.get("n")) for s in sampled}  # type: ignore[arg-type]
+        if len(sampled) != len(series) or len(shapes) != 1:
+            raise ValueError("downsampled series must all have the same number of points")
+        points, n = shapes.pop()
+        out["sample"] = {
+            "n": n,
+            "points": points,
+            "i": encode_values([list(s["i"]) for s in series]),  # type: ignore[call-overload]
+            "y_min": encode_values([list(s["y_min"]) for s in series], encoding),  # type: ignore[call-overload]
+            "y_max": encode_values([list(s["y_max"]) for s in series], encoding),  # type: ignore[call-overload]
+        }
+    return out
+
+
+def _decode_series(block: Dict[str, object], labels: List[str], axis: List[str]) -> List[Dict[str, object]]:
+    refs = block.get("labels", [])
+    sample = block.get("sample")
+    if not isinstance(sample, dict):
+        rows = decode_values(block["values"], len(refs), len(axis))  # type: ignore[arg-type]
+        return [{"label": labels[i], "x": axis, "y": y} for i, y in zip(refs, rows)]
+    k = int(sample["points"])
+    rows = decode_values(block["values"], len(refs), k)  # type: ignore[arg-type]
+    idx = decode_values(sample["i"], len(refs), k)
+    lo = decode_values(sample["y_min"], len(refs), k)
+    hi = decode_values(sample["y_max"], len(refs), k)
+    out = []
+    for r, li in enumerate(refs):
+        ii = [int(v) for v in idx[r]]
+        out.append({
+            "label": labels[li], "x": [axis[j] for j in ii], "y": rows[r],
+            "i": ii, "n": sample["n"], "y_min": lo[r], "y_max": hi[r],
+        })
+    return out
+
+
+def _encode_composition(comp: Dict[str, object], labels: _Labels) -> Dict[str, object]:
+    out = dict(comp)
+    out["labels"] = labels.refs(comp.get("labels", []))  # type: ignore[arg-type]
+    return out
+
+
+def _decode_composition(comp: Dict[str, object], labels: List[str]) -> Dict[str, object]:
+    out = dict(comp)
+    out["labels"] = [labels[i] for i in comp.get("labels", [])]  # type: ignore[union-attr]
+    return out
+
+
+def encode_summary(summary: Dict[str, object], encoding: str = "auto") -> Dict[str, object]:
+    """build_summary_multi_measure の結果をコンパクト形式に変換する"""
+    labels = _Labels()
+    axis = [str(y) for y in summary.get("years", [])]  # type: ignore[union-attr]
+    out: Dict[str, object] = {"format": SUMMARY_FORMAT, "version": SUMMARY_FORMAT_VERSION}
+    for key, value in summary.items():
+        if key == "years":
+            continue
+        if key == "series":
+            out["series"] = _encode_series(value, labels, encoding)  # type: ignore[arg-type]
+        elif key == "composition":
+            out["composition"] = _encode_composition(value, labels)  # type: ignore[arg-type]
+        elif key in ("regions", "countries") and isinstance(value, dict):
+            block: Dict[str, object] = {}
+            for k, v in value.items():
+                if k == "available":
+                    block[k] = labels.refs(v)
+                elif k == "series":
+                    block[k] = _encode_series(v, labels, encoding)
+                elif k == "composition":
+                    block[k] = _encode_composition(v, labels)
+                elif k == "rankings":
+                    block[k] = {
+                        "labels": labels.refs([r["country"] for r in v]),
+                        "values": [r["value"] for r in v],
+                    }
+                elif k == "rankings_by_year":
+                    block[k] = {
+                        y: {"countries": labels.refs(r["countries"]), "values": encode_values([r["values"]], encoding)}
+                        for y, r in v.items()
+                    }
+                else:
+                    block[k] = v
+            out[key] = block
+        else:
+            out[key] = value
+    out["axis"] = axis
+    out["labels"] = labels.items
+    return out
+
+
+def is_compact(summary: Dict[str, object]) -> bool:
+    return summary.get("format") == SUMMARY_FORMAT
+
+
+def decode_summary(summary: Dict[str, object]) -> Dict[str, object]:
+    """コンパクト形式を従来の形に戻す（従来形式はそのまま返す）"""
+    if not is_compact(summary):
+        return summary
+    version = summary.get("version")
+    if version != SUMMARY_FORMAT_VERSION:
+        raise ValueError(f"unsupported summary format version: {version}")
+    labels: List[str] = summary.get("labels", [])  # type: ignore[assignment]
+    axis: List[str] = summary.get("axis", [])  # type: ignore[assignment]
+    out: Dict[str, object] = {}
+    for key, value in summary.items():
+        if key in ("format", "version", "labels", "axis"):
+            continue
+        if key == "series":
+            out["years"] = axis
+            out["series"] = _decode_series(value, labels, axis)  # type: ignore[arg-type]
+        elif key == "composition":
+            out["composition"] = _decode_composition(value, labels)  # type: ignore[arg-type]
+        elif key in ("regions", "countries") and isinstance(value, dict):
+            block: Dict[str, object] = {}
+            for k, v in value.items():
+                if k == "available":
+                    block[k] = [labels[i] for i in v]
+                elif k == "series":
+                    block[k] = _decode_series(v, labels, axis)
+                elif k == "composition":
+                    block[k] = _decode_composition(v, labels)
+                elif k == "rankings":
+                    block[k] = [{"country": labels[i], "value": val} for i, val in zip(v["labels"], v["values"])]
+                elif k == "rankings_by_year":
+                    block[k] = {
+                        y: rank_countries(dict(zip(
+                            [labels[i] for i in r["countries"]],
+                            decode_values(r["values"], 1, len(r["countries"]))[0],
+                        )))
+                        for y, r in v.items()
+                    }
+                else:
+                    block[k] = v
+            out[key] = block
+        else:
+            out[key] = value
+    out.setdefault("years", axis)
+    return out
+
+
+def dumps_summary(summary: Dict[str, object], *, pretty: bool = False, encoding: str = "auto") -> bytes:
+    """summary.json のバイト列（既定はコンパクト形式・改行なし、pretty=True で従来形式の整形 JSON）"""
+    if pretty:
+        return json.dumps(summary, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(encode_summary(summary, encoding), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads_summary(raw: bytes) -> Dict[str, object]:
+    return decode_summary(json.loads(raw))
+
+
+def write_summary(path: str, summary: Dict[str, object], *, pretty: bool = False, encoding: str = "auto") -> str:
+    with open(path, "wb") as f:
+        f.write(dumps_summary(summary, pretty=pretty, encoding=encoding))
+    return path
+
+
+# ダッシュボード用のデコーダ（decode_summary と同じ展開を行う）
+SUMMARY_DECODER_JS = r"""
+// summary.json のコンパクト形式を従来の形（series[].x/y など）に展開する
+function decodeSummaryValues(block, rows, cols) {
+  const out = [];
+  if (block.enc === 'delta') {
+    const d = block.data;
+    for (let r = 0; r < rows; r++) {
+      const y = new Array(cols);
+      let acc = 0;
+      for (let c = 0; c < cols; c++) { acc += d[r * cols + c]; y[c] = acc; }
+      out.push(y);
+    }
+    return out;
+  }
+  if (block.enc !== 'f64' && block.enc !== 'f32') throw new Error('unknown value encoding: ' + block.enc);
+  const bin = atob(block.data);
+  const bytes = new Uint8Array(bin.length);
+  for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+  const view = new DataView(bytes.buffer);
+  const size = block.enc === 'f64' ? 8 : 4;
+  for (let r = 0; r < rows; r++) {
+    const y = new Array(cols);
+    for (let c = 0; c < cols; c++) {
+      const off = (r * cols + c) * size;
+      y[c] = size === 8 ? view.getFloat64(off, true) : view.getFloat32(off, true);
+    }
+    out.push(y);
+  }
+  return out;
+}
+
+// rank_countries（normalize.py）と同じ派生値を国と値（降順）から復元する
+function decodeRanking(countries, block) {
+  const values = decodeSummaryValues(block, 1, countries.length)[0];
+  let total = 0, acc = 0;
+  for (const v of values) if (v > 0) total += v;
+  const cumulative = values.map(v => (acc += v));
+  const byName = countries.map((_, i) => i).sort((a, b) => (countries[a] < countries[b] ? -1 : countries[a] > countries[b] ? 1 : 0));
+  return {total, countries, values, share: values.map(v => (total ? v / total : 0)), cumulative, by_name: byName};
+}
+
+function decodeSummary(obj) {
+  if (!obj || obj.format !== 'investviz-summary') return obj;
+  if (obj.version !== 1) throw new Error('unsupported summary format version: ' + obj.version);
+  const labels = obj.labels || [], axis = obj.axis || [];
+  const lab = refs => (refs || []).map(i => labels[i]);
+  const series = b => {
+    const sm = b.sample;
+    if (!sm) {
+      const rows = decodeSummaryValues(b.values, b.labels.length, axis.length);
+      return b.labels.map((li, k) => ({label: labels[li], x: axis, y: rows[k]}));
+    }
+    // 間引いた系列（x は元のインデックスで axis から引く）
+    const m = b.labels.length, cols = sm.points;
+    const rows = decodeSummaryValues(b.values, m, cols), idx = decodeSummaryValues(sm.i, m, cols);
+    const lo = decodeSummaryValues(sm.y_min, m, cols), hi = decodeSummaryValues(sm.y_max, m, cols);
+    return b.labels.map((li, k) => ({
+      label: labels[li], x: idx[k].map(j => axis[j]), y: rows[k], i: idx[k], n: sm.n, y_min: lo[k], y_max: hi[k],
+    }));
+  };
+  const comp = c => Object.assign({}, c, {labels: lab(c.labels)});
+  const out = {};
+  for (const key of Object.keys(obj)) {
+    const v = obj[key];
+    if (key === 'format' || key === 'version' || key === 'labels' || key === 'axis') continue;
+    if (key === 'series') { out.years = axis; out.series = series(v); }
+    else if (key === 'composition') out.composition = comp(v);
+    else if ((key === 'regions' || key === 'countries') && v && typeof v === 'object') {
+      const block = {};
+      for (const k of Object.keys(v)) {
+        if (k === 'available') block[k] = lab(v[k]);
+        else if (k === 'series') block[k] = series(v[k]);
+        else if (k === 'composition') block[k] = comp(v[k]);
+        else if (k === 'rankings') block[k] = v[k].labels.map((li, i) => ({country: labels[li], value: v[k].values[i]}));
+        else if (k === 'rankings_by_year') {
+          block[k] = {};
+          for (const y of Object.keys(v[k])) block[k][y] = decodeRanking(lab(v[k][y].countries), v[k][y].values);
+        }
+        else block[k] = v[k];
+      }
+      out[key] = block;
+    } else out[key] = v;
+  }
+  if (!out.years) out.years = axis;
+  return out;
+}
+"""
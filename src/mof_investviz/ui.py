@@ -1,15 +1,38 @@
 from __future__ import annotations
 
-import http.server
 import os
-import socketserver
+import csv
 import cgi
 import json
-import uuid
+import time
+import hashlib
+from typing import Dict, Optional
+from urllib.parse import urlsplit
 
-from .normalize import normalize_file, build_summary_multi_measure, SCHEMA_HEADERS
-from .io import write_csv
-from .schema import schema_meta
+from . import metrics, sqlstore, zonemap
+from .catalog import SERIES_DERIVES, SUMMARIES, SeriesKeyError, catalog_bytes, parse_series_keys, select_series
+from .share import share_html, share_payload, share_state
+from .datalayer import DATA_CLIENT_JS, DATA_LAYER_JS
+from .downsample import downsample_summary, summary_is_downsampled
+from .jobs import JobManager, JobQueueFull, start_process_pool
+from .normalize import RANKINGS_ALL_YEARS, slice_country_ranking
+from .query import DATASETS, QueryError, QuerySpec
+from .server import make_server
+from .sessions import (
+    SUMMARY_FILE,
+    UPLOADS_DIR,
+    SessionStore,
+    default_secret_path,
+    expand_upload,
+    is_session_id,
+    load_country_rankings,
+    remove_legacy_secret,
+    session_links,
+    session_normalized_path,
+    session_summary_path,
+)
+from .static import CachingFileHandler, StaticAsset, etag_matches, file_etag
+from .summary_codec import SUMMARY_DECODER_JS, dumps_summary, loads_summary
 
 
 INDEX_HTML = """<!doctype html>
@@ -35,22 +58,48 @@ INDEX_HTML = """<!doctype html>
     .control-row.specific { background:rgba(148,163,184,0.05); border:1px solid rgba(148,163,184,0.2); }
     select, button, input[type=checkbox] { background:#0f172a; color:#e5e7eb; border:1px solid #334155; border-radius:6px; padding:6px 8px; }
     #chartPanel { display:none; }
+    #chartStack { position:relative; }
     #chart { width:100%; height:420px; border:1px solid #334155; border-radius:8px; background:#0b1220; }
+    #chartOverlay { position:absolute; left:0; top:0; width:100%; height:420px; border:1px solid transparent; pointer-events:none; }
     .multi-panel-grid { display:grid; grid-template-columns: 1fr 1fr; grid-template-rows: 1fr 1fr; gap:12px; width:100%; height:860px; }
     .panel-item { border:1px solid #334155; border-radius:8px; background:#0b1220; position:relative; }
     .panel-item canvas { width:100%; height:100%; }
     .panel-title { position:absolute; top:8px; left:12px; font-size:13px; font-weight:bold; color:#94a3b8; pointer-events:none; }
     .meta { color: var(--muted); font-size: 12px; margin-top: 8px; }
-    .legend { display:flex; flex-wrap:wrap; gap:12px; margin:8px 0; }
-    .legend .item { display:flex; align-items:center; gap:6px; color: var(--muted); }
+    .legend { margin:8px 0; }
+    .legend .item { display:flex; align-items:center; gap:6px; color: var(--muted); white-space:nowrap; overflow:hidden; text-overflow:ellipsis; }
+    .vlist { position:relative; overflow-y:auto; }
+    .vlist-spacer { width:1px; }
+    .vlist-row { position:absolute; left:0; right:0; top:0; box-sizing:border-box; }
+    .picker-field { display:flex; align-items:center; gap:6px; }
+    .picker { position:relative; display:inline-block; }
+    .picker-input { width:280px; background:#0f172a; color:#e5e7eb; border:1px solid #334155; border-radius:6px; padding:6px 8px; }
+    .picker-list { display:none; position:absolute; z-index:20; top:100%; left:0; width:420px; margin-top:2px; background:#0f172a; border:1px solid #334155; border-radius:6px; }
+    .picker.open .picker-list { display:block; }
+    .picker-list .vlist-row { display:flex; align-items:center; gap:8px; padding:3px 8px; cursor:pointer; font-size:13px; }
+    .picker-label { flex:1; white-space:nowrap; overflow:hidden; text-overflow:ellipsis; }
+    .picker-spark { flex:none; width:48px; height:14px; }
+    .picker-spark polyline { fill:none; stroke:#60a5fa; stroke-width:1.2; }
+    .picker-list .vlist-row.active { background:#1e293b; }
+    .picker-list .vlist-row.selected { color:#60a5fa; }
+    .picker-empty { display:none; padding:6px 8px; color:var(--muted); font-size:13px; }
     .swatch { display:inline-block; width:12px; height:12px; border-radius:2px; }
     .drop { border:1px dashed #334155; border-radius:8px; padding:18px; text-align:center; color:var(--muted); }
+    .perf-overlay { display:none; position:fixed; left:12px; bottom:12px; z-index:900; padding:8px 10px; background:rgba(15,23,42,0.92); border:1px solid #334155; border-radius:6px; font:11px/1.45 ui-monospace, Menlo, Consolas, monospace; color:#cbd5e1; white-space:pre; pointer-events:none; }
     .toast { position:fixed; top:20px; right:20px; background:#0f172a; color:#e5e7eb; padding:12px 20px; border-radius:8px; border:1px solid #334155; box-shadow:0 4px 12px rgba(0,0,0,0.5); z-index:1000; display:none; }
     .toast.show { display:block; animation:slideIn 0.3s ease-out; }
     @keyframes slideIn { from {transform:translateX(400px); opacity:0;} to {transform:translateX(0); opacity:1;} }
   </style>
+  <script id="investviz-data-layer">
+/*__DATA_LAYER__*/
+  </script>
   <script>
-let gData = null;
+/*__DATA_CLIENT__*/
+let gData = null;  // データ層から受け取ったカタログ（ラベルと年の軸）
+let gClient = null;  // データ層（Worker）のクライアント
+let gView = null;  // 描画中のビュー {req, data, seq, perf: 描き終わるまでの計測}
+let gViewSeq = 0;
+let gHover = null;  // ホバー中の点 {s: 系列, i: 点}
 // Okabe-Ito 色弱対応パレット（8色）+ 補完色
 let gColors = [
   '#0173B2',  // blue
@@ -66,7 +115,150 @@ let gColors = [
 ];
 let gOverlay = false;
 let gSessionId = null;  // 現在のセッションID
-let gPinnedPoint = null;  // ピン留めされた点 {x, y, idx}
+let gPinnedPoint = null;  // ピン留めされた点 {s: 系列, i: 点}
+let gUploadJobId = null;  // 実行中の非同期アップロードジョブ
+let gShared = null;  // 共有用 HTML として開いたときの埋め込みヘッダ {state, meta}
+
+// 計測。描画（操作から描き終わるまで）・データ層との往復・レイヤの描画・読み込み・画像エクスポートを
+// performance.mark/measure で計る（開発者ツールのパフォーマンス記録にも investviz:* として出る）。
+// 直近の値はパフォーマンス表示（?perf=1 または Shift+P）に出し、サンプリングに当たったページは /api/perf にまとめて送る
+const PERF_SAMPLE_RATE = 0.1;  // ビーコンを送るページの割合
+const PERF_FLUSH_MS = 30000;  // ビーコンを送る間隔
+const PERF_MAX_QUEUE = 200;  // 送信待ちサンプルの上限（超えた分は捨てる）
+const PERF_FRAME_EVERY = 10;  // frame（1 フレームの描画処理）は件数が多いので 10 回に 1 回だけ送る
+const HAS_USER_TIMING = typeof performance !== 'undefined' && typeof performance.mark === 'function' && typeof performance.measure === 'function';
+const gPerf = {
+  seq: 0,
+  stats: new Map(),  // 'metric:kind' → {metric, kind, last, avg, max, count}
+  queue: [],
+  endpoint: location.protocol.startsWith('http') && Math.random() < PERF_SAMPLE_RATE ? '/api/perf' : null,
+  bytes: 0, dataKind: '',  // 最後に読み込んだサマリの大きさと種類
+  frames: null,  // 表示中だけ測るフレーム間隔 {raf, prev, avg, max, peak, painted}
+};
+
+function perfStart(metric, kind) {
+  const mark = `investviz:${metric}:${kind}:${++gPerf.seq}`;
+  if (HAS_USER_TIMING) performance.mark(mark);
+  return {metric, kind, mark, t0: performance.now()};
+}
+
+function perfEnd(token, bytes) {
+  if (!token) return 0;
+  let ms = performance.now() - token.t0;
+  if (HAS_USER_TIMING) {
+    const name = `investviz:${token.metric}:${token.kind}`;
+    try {
+      const m = performance.measure(name, token.mark);
+      if (m && typeof m.duration === 'number') ms = m.duration;
+    } catch (e) {}
+    // タイムラインのバッファに溜め続けない（記録中の開発者ツールには残る）
+    performance.clearMarks(token.mark);
+    performance.clearMeasures(name);
+  }
+  perfRecord(token.metric, token.kind, ms, bytes);
+  return ms;
+}
+
+// 途中で取り消された計測（キャンセルされた描画など）は記録しない
+function perfCancel(token) {
+  if (token && HAS_USER_TIMING) performance.clearMarks(token.mark);
+}
+
+function perfRecord(metric, kind, ms, bytes) {
+  const key = metric + ':' + kind;
+  let st = gPerf.stats.get(key);
+  if (!st) gPerf.stats.set(key, st = {metric, kind, last: 0, avg: 0, max: 0, count: 0});
+  st.count++;
+  st.last = ms;
+  st.avg += (ms - st.avg) / Math.min(st.count, 20);  // 直近 20 回程度の移動平均
+  if (ms > st.max) st.max = ms;
+  if (!gPerf.endpoint || gPerf.queue.length >= PERF_MAX_QUEUE) return;
+  if (metric === 'frame' && st.count % PERF_FRAME_EVERY) return;
+  const sample = {metric, kind, ms: Math.round(ms * 100) / 100};
+  if (bytes !== undefined) sample.bytes = bytes;
+  gPerf.queue.push(sample);
+}
+
+function perfDataset(bytes, kind) {
+  gPerf.bytes = bytes;
+  gPerf.dataKind = kind;
+}
+
+// 溜まったサンプルを送る（ページを閉じる・隠すときも届くよう sendBeacon を優先）
+function flushPerf() {
+  if (!gPerf.endpoint || !gPerf.queue.length) return;
+  const body = JSON.stringify({samples: gPerf.queue.splice(0)});
+  try {
+    if (navigator.sendBeacon && navigator.sendBeacon(gPerf.endpoint, new Blob([body], {type: 'application/json'}))) return;
+  } catch (e) {}
+  fetch(gPerf.endpoint, {method: 'POST', body, headers: {'Content-Type': 'application/json'}, keepalive: true}).catch(() => {});
+}
+
+// パフォーマンス表示。表示中だけ requestAnimationFrame でフレーム間隔を測り、4 回/秒書き換える
+function togglePerfOverlay(show) {
+  const el = document.getElementById('perfOverlay');
+  if (show === undefined) show = !gPerf.frames;
+  if (show && !gPerf.frames) {
+    el.style.display = 'block';
+    gPerf.frames = {raf: requestAnimationFrame(perfFrameTick), prev: 0, avg: 0, max: 0, peak: 0, painted: 0};
+  } else if (!show && gPerf.frames) {
+    cancelAnimationFrame(gPerf.frames.raf);
+    gPerf.frames = null;
+    el.style.display = 'none';
+  }
+}
+
+function perfFrameTick(now) {
+  const f = gPerf.frames;
+  if (!f) return;
+  if (f.prev) {
+    const dt = now - f.prev;
+    f.avg = f.avg ? f.avg + (dt - f.avg) / 20 : dt;
+    if (dt > f.peak) f.peak = dt;
+  }
+  f.prev = now;
+  if (now - f.painted >= 250) {
+    // 最大値は直近 1 秒ほどの区間で見る
+    f.max = f.peak;
+    if (now - f.painted >= 1000 || !f.painted) f.peak = 0;
+    f.painted = now;
+    paintPerfOverlay();
+  }
+  f.raf = requestAnimationFrame(perfFrameTick);
+}
+
+function fmtPerf(st) {
+  return st ? `${st.last.toFixed(1)}/${st.avg.toFixed(1)}` : '-';
+}
+
+function fmtBytes(n) {
+  if (!n) return '-';
+  return n >= 1048576 ? (n / 1048576).toFixed(1) + ' MB' : (n / 1024).toFixed(1) + ' KB';
+}
+
+function paintPerfOverlay() {
+  const f = gPerf.frames;
+  const work = gPerf.stats.get('frame:-');
+  const lines = [
+    `frame  ${f.avg.toFixed(1)} ms (${f.avg ? Math.round(1000 / f.avg) : 0} fps, max ${f.max.toFixed(1)})  処理 ${fmtPerf(work)} ms`,
+    `data   ${fmtBytes(gPerf.bytes)} ${gPerf.dataKind}`,
+    'ms last/avg       worker    render      draw',
+  ];
+  const views = [];
+  const others = [];
+  for (const st of gPerf.stats.values()) {
+    if (st.metric === 'draw' || st.metric === 'worker' || st.metric === 'render') {
+      if (!views.includes(st.kind)) views.push(st.kind);
+    } else if (st.metric !== 'frame') {
+      others.push(st);
+    }
+  }
+  for (const v of views) {
+    lines.push(v.padEnd(14) + ['worker', 'render', 'draw'].map(m => fmtPerf(gPerf.stats.get(m + ':' + v)).padStart(10)).join(''));
+  }
+  for (const st of others) lines.push(`${st.metric} ${st.kind}`.padEnd(14) + fmtPerf(st).padStart(10));
+  document.getElementById('perfOverlay').textContent = lines.join('\\n');
+}
 
 // 文字列から一貫した色を生成（ハッシュベース）
 function stringToColor(str) {
@@ -77,6 +269,78 @@ function stringToColor(str) {
   return gColors[Math.abs(hash) % gColors.length];
 }
 
+// 配列の最小・最大（スプレッド構文は長い配列でスタックを溢れさせるためループで求める）
+function arrMin(a) { let m = Infinity; for (let i = 0; i < a.length; i++) if (a[i] < m) m = a[i]; return m; }
+function arrMax(a) { let m = -Infinity; for (let i = 0; i < a.length; i++) if (a[i] > m) m = a[i]; return m; }
+
+// 横位置 fx（0〜1）に最も近い点のインデックス
+function nearestPos(pos, fx) {
+  let lo = 0, hi = pos.length - 1;
+  while (hi - lo > 1) { const mid = (lo + hi) >> 1; if (pos[mid] < fx) lo = mid; else hi = mid; }
+  return (Math.abs(pos[hi] - fx) < Math.abs(pos[lo] - fx)) ? hi : lo;
+}
+
+// サマリのカタログ（ラベル・年の軸・系列ごとのスパークライン。系列の値は含まない）の URL。
+// 系列の値は表示するものだけをデータ層が /api/series から取る（seriesSource）
+function catalogUrl(sid) {
+  return `/api/summary?sid=${encodeURIComponent(sid || '')}&catalog=1`;
+}
+
+// series_url: 時系列の描画用（チャート描画幅に LTTB で間引く）、
+// full_url: ヒートマップ・箱ひげ図の行列用（年ごとの値が要るので間引かない）
+function seriesSource(sid) {
+  const canvas = document.getElementById('chart');
+  const width = Math.round(((canvas && canvas.getBoundingClientRect().width) || window.innerWidth) * devicePixelRatio);
+  const base = `/api/series?sid=${encodeURIComponent(sid || '')}`;
+  return {
+    series_url: new URL(`${base}&width=${width}`, location.href).href,
+    full_url: new URL(base, location.href).href,
+  };
+}
+
+// キャンバスの描画バッファを表示サイズ×devicePixelRatio に合わせる（サイズが変わらなければ触らない）
+function fitCanvas(canvas) {
+  const rect = canvas.getBoundingClientRect();
+  const w = Math.round(rect.width * devicePixelRatio), h = Math.round(rect.height * devicePixelRatio);
+  if (canvas.width !== w || canvas.height !== h) { canvas.width = w; canvas.height = h; }
+  return {width: rect.width, height: rect.height};
+}
+
+// 描き終えた結果を使い回すオフスクリーンのレイヤ。key かサイズが変わったときだけ paint で描き直す
+const gLayers = new Map();
+function cachedLayer(name, key, size, margin, paint) {
+  let layer = gLayers.get(name);
+  if (!layer) { layer = {canvas: document.createElement('canvas'), key: null}; gLayers.set(name, layer); }
+  const w = Math.round(size.width * devicePixelRatio), h = Math.round(size.height * devicePixelRatio);
+  if (layer.key === key && layer.canvas.width === w && layer.canvas.height === h) return layer.canvas;
+  layer.canvas.width = w;
+  layer.canvas.height = h;
+  const ctx = layer.canvas.getContext('2d');
+  ctx.setTransform(devicePixelRatio,0,0,devicePixelRatio,0,0);
+  ctx.translate(margin.l, margin.t);
+  paint(ctx, size.width - margin.l - margin.r, size.height - margin.t - margin.b);
+  layer.key = key;
+  return layer.canvas;
+}
+
+// マルチパネルの各キャンバスに最後に描いた key（データとサイズが同じなら描き直さない）
+const gPainted = new WeakMap();
+function paintPanel(id, margin, key, paint) {
+  const canvas = document.getElementById(id);
+  if (!canvas) return;
+  const size = fitCanvas(canvas);
+  const painted = `${key}|${canvas.width}x${canvas.height}`;
+  if (gPainted.get(canvas) === painted) return;
+  gPainted.set(canvas, painted);
+  const ctx = canvas.getContext('2d');
+  ctx.setTransform(devicePixelRatio,0,0,devicePixelRatio,0,0);
+  ctx.clearRect(0,0,size.width,size.height);
+  ctx.save();
+  ctx.translate(margin.l, margin.t);
+  paint(ctx, size.width - margin.l - margin.r, size.height - margin.t - margin.b);
+  ctx.restore();
+}
+
 // TopNスライダの値を更新
 function updateTopNLabel() {
   const val = document.getElementById('topN').value;
@@ -93,53 +357,416 @@ function showToast(message, duration = 3000) {
   }, duration);
 }
 
-async function uploadAndAnalyze(file){
-  const st = document.getElementById('uploadStatus');
-  st.textContent = 'アップロード中...';
-  const fd = new FormData(); fd.append('file', file, file.name || 'uploaded.csv');
-  const res = await fetch('/api/upload', { method:'POST', body: fd });
-  if (!res.ok) { st.textContent = 'アップロードに失敗しました'; return; }
-  const obj = await res.json();
-  gData = obj.summary;
-  // セッションIDを抽出（links.normalized_csv から）
-  if (obj.links && obj.links.normalized_csv) {
-    const match = obj.links.normalized_csv.match(/\/uploads\/([^\/]+)\//);
-    if (match) {
-      gSessionId = match[1];
+const STAGE_LABELS = {
+  queued: '待機中', hash: 'ハッシュ計算', normalize: '正規化', merge: 'ファイル結合', write_normalized: '正規化CSV書き出し',
+  write_sqlite: 'SQLite書き出し', pivot: 'ピボット作成', summary: 'サマリ集計', write_summary: 'サマリ書き出し',
+  finalize: '仕上げ', done: '完了'
+};
+
+// 非同期ジョブの完了をポーリングで待つ（キャンセル時は null）
+async function waitForJob(job, st) {
+  const cancelBtn = document.getElementById('cancelUpload');
+  gUploadJobId = job.job_id;
+  cancelBtn.style.display = '';
+  try {
+    let delay = 200;
+    while (true) {
+      const stage = STAGE_LABELS[job.stage] || job.stage;
+      st.textContent = `解析中... ${stage} ${Math.round(job.percent || 0)}%`;
+      if (job.state === 'done') return job;
+      if (job.state === 'cancelled') { st.textContent = 'アップロードをキャンセルしました'; return null; }
+      if (job.state === 'error') { st.textContent = '解析に失敗しました: ' + (job.error || ''); return null; }
+      await new Promise(r => setTimeout(r, delay));
+      delay = Math.min(1000, delay * 1.5);
+      const res = await fetch('/api/jobs/' + job.job_id, { cache: 'no-store' });
+      if (!res.ok) { st.textContent = 'ジョブ状態の取得に失敗しました'; return null; }
+      job = await res.json();
+    }
+  } finally {
+    gUploadJobId = null;
+    cancelBtn.style.display = 'none';
+  }
+}
+
+async function cancelUpload() {
+  if (!gUploadJobId) return;
+  await fetch('/api/jobs/' + gUploadJobId, { method: 'DELETE' });
+}
+
+// サマリをデータ層に読み込ませ、返ってきたカタログでコントロールを組み立てる
+async function loadDataset(payload) {
+  const bytes = payload.buffer ? payload.buffer.byteLength : undefined;  // buffer は Worker に移すので先に測る
+  const t = perfStart('load', 'full');
+  const catalog = await gClient.load(payload);
+  if (catalog.sparks) t.kind = 'catalog';
+  applyCatalog(catalog);
+  perfEnd(t, bytes);
+  perfDataset(bytes || 0, t.kind);
+}
+
+// 保存済みのデータセット（IndexedDB）から開く。無ければ null
+async function restoreDataset(key, source) {
+  const t = perfStart('load', 'cached');
+  const catalog = await gClient.restore(key, source);
+  if (!catalog) { perfCancel(t); return null; }
+  applyCatalog(catalog);
+  perfEnd(t);
+  perfDataset(0, 'cached');
+  return catalog;
+}
+
+// 最後に開いたセッション（再読み込み時に IndexedDB の保存データから復元する）
+const LAST_SESSION_KEY = 'investviz:last-session';
+function rememberSession(sid) {
+  try { localStorage.setItem(LAST_SESSION_KEY, sid || ''); } catch (e) {}
+}
+function rememberedSession() {
+  try { return localStorage.getItem(LAST_SESSION_KEY) || ''; } catch (e) { return ''; }
+}
+
+// IndexedDB に保存するデータセットのキー（セッション ID、無ければビルドのサマリ）
+function datasetKey(sid) {
+  return sid ? 'session:' + sid : 'build';
+}
+// 静的配信の summary.json（全系列）はカタログと中身が違うので、304 で取り違えないよう別のキーにする
+const STATIC_SUMMARY_KEY = 'build:summary.json';
+
+function setDownloadLinks(links) {
+  document.getElementById('downloadNormalized').href = links.normalized_csv;
+  document.getElementById('downloadNormalized').style.pointerEvents = 'auto';
+  document.getElementById('downloadParseLog').href = links.parse_log;
+  document.getElementById('downloadParseLog').style.pointerEvents = 'auto';
+  if (links.pivot_csv){
+    document.getElementById('downloadPivot').href = links.pivot_csv;
+    document.getElementById('downloadPivot').style.pointerEvents = 'auto';
+  }
+}
+
+// 固定行高の仮想リスト。見えている行（と前後数行）の分だけ行ノードを持ち、スクロール時は
+// 同じノードを位置と内容だけ差し替えて使い回す（行数が何千あっても DOM のノード数は一定）
+const VLIST_OVERSCAN = 4;
+class VirtualList {
+  constructor(el, rowHeight, maxHeight, renderRow) {
+    this.el = el;
+    this.rowHeight = rowHeight;
+    this.maxHeight = maxHeight;
+    this.renderRow = renderRow;
+    this.count = 0;
+    this.rows = [];
+    el.classList.add('vlist');
+    el.style.maxHeight = maxHeight + 'px';
+    this.spacer = document.createElement('div');
+    this.spacer.className = 'vlist-spacer';
+    el.appendChild(this.spacer);
+    const poolSize = Math.ceil(maxHeight / rowHeight) + 2 * VLIST_OVERSCAN;
+    for (let k = 0; k < poolSize; k++) {
+      const row = document.createElement('div');
+      row.className = 'vlist-row';
+      row.style.height = rowHeight + 'px';
+      row.style.display = 'none';
+      row.dataset.index = '-1';
+      el.appendChild(row);
+      this.rows.push(row);
+    }
+    el.addEventListener('scroll', () => this.update(false));
+  }
+
+  setCount(n) {
+    this.count = n;
+    this.spacer.style.height = (n * this.rowHeight) + 'px';
+    this.el.style.height = Math.min(n * this.rowHeight, this.maxHeight) + 'px';
+    this.update(true);
+  }
+
+  // force: 行番号が同じでも内容を描き直す（選択状態や項目が変わったとき）
+  update(force) {
+    const first = Math.max(0, Math.floor(this.el.scrollTop / this.rowHeight) - VLIST_OVERSCAN);
+    this.rows.forEach((row, k) => {
+      const i = first + k;
+      if (i >= this.count) { row.style.display = 'none'; row.dataset.index = '-1'; return; }
+      row.style.display = '';
+      row.style.transform = `translateY(${i * this.rowHeight}px)`;
+      if (force || row.dataset.index !== String(i)) { row.dataset.index = String(i); this.renderRow(row, i); }
+    });
+  }
+
+  scrollToRow(i) {
+    const top = i * this.rowHeight, view = this.el.clientHeight || this.maxHeight;
+    if (top < this.el.scrollTop) this.el.scrollTop = top;
+    else if (top + this.rowHeight > this.el.scrollTop + view) this.el.scrollTop = top + this.rowHeight - view;
+    this.update(true);
+  }
+}
+
+// ピッカーの行に描くスパークライン（SVG の polyline）
+const SVG_NS = 'http://www.w3.org/2000/svg';
+const SPARK_W = 48, SPARK_H = 14;
+function sparkPoints(ys) {
+  const lo = arrMin(ys), hi = arrMax(ys), span = (hi - lo) || 1;
+  return ys.map((v, i) => `${(i / (ys.length - 1) * SPARK_W).toFixed(1)},${(SPARK_H - 1 - (v - lo) / span * (SPARK_H - 2)).toFixed(1)}`).join(' ');
+}
+
+// 検索付きの系列・地域ピッカー（select の代わり）。候補の一覧は仮想リストで描き、
+// 入力のたびにデータ層で作った検索索引（LabelSearch）で日本語・英語のラベルを絞り込む。
+// value は選択中の項目番号（allLabel の項目は ''）
+class SearchPicker {
+  constructor(root, opts) {
+    this.root = root;
+    this.allLabel = opts.allLabel || null;
+    this.onchange = opts.onchange || (() => {});
+    this.labels = [];
+    this.sparks = null;  // 項目ごとのスパークライン（カタログにあれば行の右端に描く）
+    this.search = new LabelSearch(null);
+    this.hits = null;
+    this.active = 0;
+    this.value = this.allLabel ? '' : 0;
+    root.classList.add('picker');
+    this.input = document.createElement('input');
+    this.input.type = 'search';
+    this.input.className = 'picker-input';
+    this.input.placeholder = opts.placeholder || '検索（日本語・英語）';
+    this.input.autocomplete = 'off';
+    const list = document.createElement('div');
+    list.className = 'picker-list';
+    this.empty = document.createElement('div');
+    this.empty.className = 'picker-empty';
+    this.empty.textContent = '該当する項目がありません';
+    const rows = document.createElement('div');
+    list.appendChild(rows);
+    list.appendChild(this.empty);
+    root.appendChild(this.input);
+    root.appendChild(list);
+    this.list = new VirtualList(rows, 24, 288, (row, k) => this.renderRow(row, k));
+    // 一覧のクリックで入力欄のフォーカスを外さない
+    list.addEventListener('mousedown', e => e.preventDefault());
+    list.addEventListener('click', e => {
+      const row = e.target.closest('.vlist-row');
+      if (row && row.dataset.index !== '-1') this.choose(parseInt(row.dataset.index, 10));
+    });
+    this.input.addEventListener('focus', () => this.open());
+    this.input.addEventListener('blur', () => this.close());
+    this.input.addEventListener('input', () => this.filter());
+    this.input.addEventListener('keydown', e => this.onKey(e));
+  }
+
+  // 項目と検索索引を差し替える（データセットの読み込みごと）
+  setItems(labels, searchIndex, sparks) {
+    this.labels = labels;
+    this.sparks = sparks || null;
+    this.search = new LabelSearch(searchIndex);
+    this.value = this.allLabel ? '' : (labels.length ? 0 : '');
+    this.input.value = this.labelOf(this.value);
+    this.close();
+  }
+
+  labelOf(value) {
+    return value === '' ? (this.allLabel || '') : (this.labels[value] || '');
+  }
+
+  // 項目を選んだ状態にする（onchange は呼ばない。範囲外なら何もしない）
+  select(value) {
+    if (value !== '' && !(value >= 0 && value < this.labels.length)) return;
+    if (value === '' && !this.allLabel) return;
+    this.value = value;
+    this.input.value = this.labelOf(value);
+  }
+
+  // 一覧の k 行目の項目（絞り込み中は検索結果、そうでなければ全項目。allLabel は先頭）
+  itemAt(k) {
+    if (this.hits) return this.hits[k];
+    if (this.allLabel) return k === 0 ? '' : k - 1;
+    return k;
+  }
+
+  itemCount() {
+    if (this.hits) return this.hits.length;
+    return this.labels.length + (this.allLabel ? 1 : 0);
+  }
+
+  renderRow(row, k) {
+    const value = this.itemAt(k);
+    const label = this.labelOf(value);
+    if (!row.firstChild) {
+      const text = document.createElement('span');
+      text.className = 'picker-label';
+      const svg = document.createElementNS(SVG_NS, 'svg');
+      svg.setAttribute('class', 'picker-spark');
+      svg.setAttribute('viewBox', `0 0 ${SPARK_W} ${SPARK_H}`);
+      svg.appendChild(document.createElementNS(SVG_NS, 'polyline'));
+      row.appendChild(text);
+      row.appendChild(svg);
     }
+    row.firstChild.textContent = label;
+    row.title = label;
+    const spark = this.sparks && value !== '' ? this.sparks[value] : null;
+    row.lastChild.style.display = spark && spark.length > 1 ? '' : 'none';
+    if (spark && spark.length > 1) row.lastChild.firstChild.setAttribute('points', sparkPoints(spark));
+    row.classList.toggle('active', k === this.active);
+    row.classList.toggle('selected', value === this.value);
+  }
+
+  open() {
+    this.root.classList.add('open');
+    this.input.select();
+    this.hits = null;
+    this.search.find('');
+    this.refresh();
+    // 選択中の項目が見える位置から開く
+    const count = this.itemCount();
+    for (let k = 0; k < count; k++) if (this.itemAt(k) === this.value) { this.active = k; break; }
+    this.list.scrollToRow(this.active);
   }
-  document.getElementById('title').textContent = (gData.title || 'MVP Summary');
-  const ms = document.getElementById('measure');
-  ms.innerHTML='';
-  (gData.series||[]).forEach((s,i)=>{ const o=document.createElement('option'); o.value=i; o.textContent=s.label||`series_${i}`; ms.appendChild(o); });
+
+  close() {
+    this.root.classList.remove('open');
+    this.hits = null;
+    this.input.value = this.labelOf(this.value);
+  }
+
+  filter() {
+    if (!this.root.classList.contains('open')) this.root.classList.add('open');
+    this.hits = this.search.find(this.input.value);
+    this.active = 0;
+    this.list.el.scrollTop = 0;
+    this.refresh();
+  }
+
+  refresh() {
+    const count = this.itemCount();
+    this.empty.style.display = count ? 'none' : 'block';
+    this.list.setCount(count);
+  }
+
+  onKey(e) {
+    const count = this.itemCount();
+    if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+      e.preventDefault();
+      if (!this.root.classList.contains('open')) { this.open(); return; }
+      if (!count) return;
+      this.active = Math.min(count - 1, Math.max(0, this.active + (e.key === 'ArrowDown' ? 1 : -1)));
+      this.list.scrollToRow(this.active);
+    } else if (e.key === 'Enter') {
+      e.preventDefault();
+      if (count) this.choose(this.active);
+    } else if (e.key === 'Escape') {
+      this.input.blur();
+    }
+  }
+
+  choose(k) {
+    const value = this.itemAt(k);
+    const changed = value !== this.value;
+    this.value = value;
+    this.input.blur();
+    this.close();
+    if (changed) this.onchange(value);
+  }
+}
+
+// 凡例（仮想リスト）。items は {label, color, text?}
+let gLegend = null;
+let gLegendItems = [];
+function setLegend(items) {
+  if (!gLegend) {
+    gLegend = new VirtualList(document.getElementById('legend'), 22, 200, (row, i) => {
+      const item = gLegendItems[i];
+      if (!row.firstChild) {
+        row.className = 'vlist-row item';
+        const sw = document.createElement('span');
+        sw.className = 'swatch';
+        row.appendChild(sw);
+        row.appendChild(document.createElement('span'));
+      }
+      row.firstChild.style.background = item.color;
+      row.lastChild.textContent = item.text || item.label;
+      row.title = item.text || item.label;
+    });
+  }
+  gLegendItems = items;
+  gLegend.el.scrollTop = 0;
+  gLegend.setCount(items.length);
+}
+
+// 重ね描画中は全系列の凡例を出す
+function updateSeriesLegend() {
+  setLegend(gOverlay && gData ? gData.series.map((label, i) => ({label, color: gColors[i % gColors.length]})) : []);
+}
+
+let gSeriesPicker = null;  // 系列の選択
+let gRegionPicker = null;  // 地域フィルタ
+
+function applyCatalog(catalog) {
+  gData = catalog;
+  gView = null;
+  gPinnedPoint = null;
+  document.getElementById('title').textContent = gData.title;
+  if (!gSeriesPicker) {
+    gSeriesPicker = new SearchPicker(document.getElementById('measure'), {placeholder: '系列を検索（日本語・英語）', onchange: () => draw()});
+    gRegionPicker = new SearchPicker(document.getElementById('regionFilter'), {placeholder: '地域を検索', allLabel: '全地域', onchange: () => draw()});
+  }
+  gSeriesPicker.setItems(gData.series, gData.search.series, gData.sparks);
+  gRegionPicker.setItems(gData.regions, gData.search.regions);
+  updateSeriesLegend();
   // 地域フィルタの構築
-  const regions = (gData.regions && gData.regions.available) || [];
-  if (regions.length > 0) {
-    const rf = document.getElementById('regionFilter');
-    rf.innerHTML = '<option value="">全地域</option>';
-    regions.forEach(r => { const o = document.createElement('option'); o.value = r; o.textContent = r; rf.appendChild(o); });
+  if (gData.regions.length > 0) {
     document.getElementById('regionFilterLabel').style.display = '';
   } else {
     document.getElementById('regionFilterLabel').style.display = 'none';
   }
   document.getElementById('controls').style.display = 'flex';
   document.getElementById('chartPanel').style.display = 'block';
+}
+
+async function uploadAndAnalyze(files){
+  // 複数ファイル / zip はサーバ側で 1 セッションにまとめて正規化される
+  const st = document.getElementById('uploadStatus');
+  st.textContent = files.length > 1 ? `アップロード中...（${files.length} ファイル）` : 'アップロード中...';
+  const fd = new FormData();
+  for (const file of files) fd.append('file', file, file.name || 'uploaded.csv');
+  const res = await fetch('/api/upload?async=1&summary=catalog', { method:'POST', body: fd });
+  if (res.status === 503) { st.textContent = 'サーバが混雑しています。しばらくしてから再試行してください'; return; }
+  if (!res.ok) {
+    let msg = '';
+    try { msg = (await res.json()).error || ''; } catch (e) {}
+    st.textContent = 'アップロードに失敗しました' + (msg ? '：' + msg : '');
+    return;
+  }
+  const obj = await res.json();
+  let payload = { summary: obj.summary, source: seriesSource(obj.session_id) };
+  if (res.status === 202) {
+    // 非同期モード：ジョブ完了後にサマリを取得（JSON の解析は Worker 側で行う）
+    const job = await waitForJob(obj, st);
+    if (!job) return;
+    const sres = await fetch(catalogUrl(job.session_id), { cache: 'no-store' });
+    if (!sres.ok) { st.textContent = 'サマリの取得に失敗しました'; return; }
+    payload = {
+      buffer: await sres.arrayBuffer(),
+      cache: { key: datasetKey(job.session_id), etag: sres.headers.get('ETag') },
+      source: seriesSource(job.session_id),
+    };
+    Object.assign(obj, { links: job.links, session_id: job.session_id, cached: job.cached });
+  }
+  // セッションID（旧サーバは links.normalized_csv から抽出）
+  if (obj.session_id) {
+    gSessionId = obj.session_id;
+  } else if (obj.links && obj.links.normalized_csv) {
+    const match = obj.links.normalized_csv.match(/[/]uploads[/]([^/]+)[/]/);
+    if (match) {
+      gSessionId = match[1];
+    }
+  }
+  await loadDataset(payload);
+  if (gSessionId) rememberSession(gSessionId);
   // アップローダーは非表示にするが、ボタンで再表示可能
   hideUploadPanel();
-  document.getElementById('downloadNormalized').href = obj.links.normalized_csv;
-  document.getElementById('downloadNormalized').style.pointerEvents = 'auto';
-  document.getElementById('downloadParseLog').href = obj.links.parse_log;
-  document.getElementById('downloadParseLog').style.pointerEvents = 'auto';
-  if (obj.links.pivot_csv){
-    document.getElementById('downloadPivot').href = obj.links.pivot_csv;
-    document.getElementById('downloadPivot').style.pointerEvents = 'auto';
-  }
-  st.textContent = '✓ アップロード完了';
+  setDownloadLinks(obj.links);
+  st.textContent = obj.cached ? '✓ アップロード完了（既存の解析結果を再利用）' : '✓ アップロード完了';
   setTimeout(() => { st.textContent = ''; }, 3000);
   draw();
 }
 
 function showUploadPanel() {
+  if (gShared) return;  // 共有用 HTML はアップロード先のサーバが無い
   document.getElementById('uploader').style.display = 'block';
   document.getElementById('chartPanel').style.display = gData ? 'block' : 'none';
 }
@@ -148,63 +775,37 @@ function hideUploadPanel() {
   document.getElementById('uploader').style.display = 'none';
 }
 
-function onSelectFile(){ const el=document.getElementById('file'); if(el.files && el.files[0]) uploadAndAnalyze(el.files[0]); }
+function onSelectFile(){ const el=document.getElementById('file'); if(el.files && el.files.length) uploadAndAnalyze(Array.from(el.files)); }
 
-// マルチパネル描画関数
-function drawMultiPanel() {
-  const midx = parseInt(document.getElementById('measure').value || '0', 10) || 0;
-  const series = (gData.series || [])[midx] || {x:[], y:[], label:'series'};
-  
+// マルチパネル描画関数（データかサイズが変わったパネルだけを描き直す）
+function drawMultiPanel(data, key) {
   // パネル1: 時系列推移
-  drawPanelChart('chart1', series, 'timeseries');
+  paintPanel('chart1', {l: 50, r: 15, t: 35, b: 50}, key, (ctx, W, H) => drawPanelChart(ctx, W, H, data.timeseries));
   // パネル2: 前年比差分
-  drawPanelChart('chart2', series, 'yoy_diff');
+  paintPanel('chart2', {l: 50, r: 15, t: 35, b: 50}, key, (ctx, W, H) => drawPanelChart(ctx, W, H, data.yoy_diff));
   // パネル3: 国別ランキング (Top 5)
-  drawPanelCountryRanking('chart3');
+  paintPanel('chart3', {l: 80, r: 15, t: 35, b: 40}, key, (ctx, W, H) => drawPanelCountryRanking(ctx, W, H, data.ranking));
   // パネル4: 構成比
-  drawPanelComposition('chart4');
+  paintPanel('chart4', {l: 15, r: 15, t: 35, b: 15}, key, (ctx, W, H) => drawPanelComposition(ctx, W, H, data.composition));
 }
 
 // パネル用チャート描画（時系列/YoY）
-function drawPanelChart(canvasId, series, mode) {
-  const canvas = document.getElementById(canvasId);
-  if (!canvas) return;
-  const ctx = canvas.getContext('2d');
-  const rect = canvas.getBoundingClientRect();
-  canvas.width = rect.width * devicePixelRatio;
-  canvas.height = rect.height * devicePixelRatio;
-  ctx.setTransform(devicePixelRatio,0,0,devicePixelRatio,0,0);
-  ctx.clearRect(0,0,rect.width,rect.height);
+function drawPanelChart(ctx, W, H, sv) {
 
-  const margin = {l: 50, r: 15, t: 35, b: 50};
-  const W = rect.width - margin.l - margin.r;
-  const H = rect.height - margin.t - margin.b;
-  ctx.save();
-  ctx.translate(margin.l, margin.t);
+  const xs = sv.x, ys = sv.y, pos = sv.pos;
+  if (xs.length === 0) { ctx.fillStyle = '#94a3b8'; ctx.fillText('データなし', 10, 20); return; }
 
-  let xs = series.x.slice();
-  let ys = series.y.map(Number);
-  if (mode === 'yoy_diff') {
-    const diff = [];
-    for (let i=0; i<ys.length; i++) diff.push(i ? ys[i]-ys[i-1] : 0);
-    ys = diff;
-  }
-  
-  if (xs.length === 0) { ctx.fillStyle = '#94a3b8'; ctx.fillText('データなし', 10, 20); ctx.restore(); return; }
-  
-  let minY = Math.min(...ys);
-  let maxY = Math.max(...ys);
-  const padY = (maxY - minY) * 0.1 || 1;
-  const y0 = minY - padY;
-  const y1 = maxY + padY;
-  const xScale = i => (i/(xs.length-1)) * W;
+  const padY = (sv.hi - sv.lo) * 0.1 || 1;
+  const y0 = sv.lo - padY;
+  const y1 = sv.hi + padY;
+  const xScale = i => pos[i] * W;
   const yScale = v => H - ((v - y0)/(y1 - y0)) * H;
-  
+
   // Axes
   ctx.strokeStyle = '#334155'; ctx.lineWidth = 1.5;
   ctx.beginPath(); ctx.moveTo(0,H); ctx.lineTo(W,H); ctx.stroke();
   ctx.beginPath(); ctx.moveTo(0,0); ctx.lineTo(0,H); ctx.stroke();
-  
+
   // Ticks
   ctx.fillStyle = '#cbd5e1'; ctx.textAlign = 'right'; ctx.textBaseline = 'middle'; ctx.font = '10px system-ui';
   const ticks = 4;
@@ -214,108 +815,62 @@ function drawPanelChart(canvasId, series, mode) {
     ctx.strokeStyle = '#1e293b'; ctx.lineWidth = 0.5; ctx.beginPath(); ctx.moveTo(0,y); ctx.lineTo(W,y); ctx.stroke();
     ctx.fillText(v.toFixed(0), -5, y);
   }
-  
+
   // X labels (省略版)
   ctx.textAlign = 'center'; ctx.textBaseline = 'top'; ctx.fillStyle = '#cbd5e1'; ctx.font = '9px system-ui';
   const step = Math.ceil(xs.length / 4);
   for (let i=0;i<xs.length;i+=step){ ctx.fillText(String(xs[i]), xScale(i), H+8); }
-  
+
   // Line
   ctx.strokeStyle = gColors[0]; ctx.lineWidth = 2; ctx.beginPath();
   for (let i=0;i<ys.length;i++){ const x = xScale(i), y = yScale(ys[i]); if (i===0) ctx.moveTo(x,y); else ctx.lineTo(x,y);} ctx.stroke();
-  
-  ctx.restore();
+
 }
 
 // パネル用国別ランキング
-function drawPanelCountryRanking(canvasId) {
-  if (!gData || !gData.countries || !gData.countries.series) return;
-  
-  const canvas = document.getElementById(canvasId);
-  if (!canvas) return;
-  const ctx = canvas.getContext('2d');
-  const rect = canvas.getBoundingClientRect();
-  canvas.width = rect.width * devicePixelRatio;
-  canvas.height = rect.height * devicePixelRatio;
-  ctx.setTransform(devicePixelRatio,0,0,devicePixelRatio,0,0);
-  ctx.clearRect(0,0,rect.width,rect.height);
+function drawPanelCountryRanking(ctx, W, H, ranking) {
+  if (!ranking.available) return;
 
-  const margin = {l: 80, r: 15, t: 35, b: 40};
-  const W = rect.width - margin.l - margin.r;
-  const H = rect.height - margin.t - margin.b;
-  ctx.save();
-  ctx.translate(margin.l, margin.t);
+  // 最新年のデータでトップ5（データ層で計算済み）
+  const labels = ranking.labels, values = ranking.values;
+  if (labels.length === 0) { ctx.fillStyle = '#94a3b8'; ctx.fillText('データなし', 10, 20); return; }
 
-  // 最新年のデータでトップ5を取得
-  const latestYear = gData.years ? gData.years[gData.years.length - 1] : null;
-  if (!latestYear) { ctx.fillStyle = '#94a3b8'; ctx.fillText('データなし', 10, 20); ctx.restore(); return; }
-  
-  let countryData = [];
-  gData.countries.series.forEach(s => {
-    const yearIdx = s.x.indexOf(latestYear);
-    if (yearIdx >= 0) {
-      const value = Number(s.y[yearIdx]) || 0;
-      if (value > 0) countryData.push({label: s.label, value});
-    }
-  });
-  
-  countryData.sort((a, b) => b.value - a.value);
-  const top5 = countryData.slice(0, 5);
-  
-  if (top5.length === 0) { ctx.fillStyle = '#94a3b8'; ctx.fillText('データなし', 10, 20); ctx.restore(); return; }
-  
-  const maxVal = Math.max(...top5.map(d => d.value));
-  const barHeight = Math.max(15, Math.floor(H / (top5.length * 1.5)));
+  const maxVal = arrMax(values);
+  const barHeight = Math.max(15, Math.floor(H / (labels.length * 1.5)));
   const gap = Math.max(5, Math.floor(barHeight * 0.3));
-  
+
   // Bars
   ctx.textAlign = 'right'; ctx.textBaseline = 'middle'; ctx.font = '10px system-ui';
-  top5.forEach((d, i) => {
-    const barW = (d.value / maxVal) * W * 0.9;
+  labels.forEach((label, i) => {
+    const barW = (values[i] / maxVal) * W * 0.9;
     const y = i * (barHeight + gap);
-    const color = stringToColor(d.label);
+    const color = stringToColor(label);
     ctx.fillStyle = color;
     ctx.fillRect(0, y, barW, barHeight);
     // Label
     ctx.fillStyle = '#e2e8f0';
-    ctx.fillText(d.label, -5, y + barHeight/2);
+    ctx.fillText(label, -5, y + barHeight/2);
     // Value
     ctx.fillStyle = '#cbd5e1'; ctx.textAlign = 'left';
-    ctx.fillText(d.value.toLocaleString(), barW + 5, y + barHeight/2);
+    ctx.fillText(values[i].toLocaleString(), barW + 5, y + barHeight/2);
     ctx.textAlign = 'right';
   });
-  
-  ctx.restore();
+
 }
 
 // パネル用構成比
-function drawPanelComposition(canvasId) {
-  const comp = gData.composition || {labels:[], share:[]};
-  const labels = comp.labels || [];
-  const share = (comp.share || []).map(Number);
-  
-  const canvas = document.getElementById(canvasId);
-  if (!canvas) return;
-  const ctx = canvas.getContext('2d');
-  const rect = canvas.getBoundingClientRect();
-  canvas.width = rect.width * devicePixelRatio;
-  canvas.height = rect.height * devicePixelRatio;
-  ctx.setTransform(devicePixelRatio,0,0,devicePixelRatio,0,0);
-  ctx.clearRect(0,0,rect.width,rect.height);
+function drawPanelComposition(ctx, W, H, comp) {
+  const labels = comp.labels;
+  const share = comp.share;
+
+
+  if (labels.length === 0) { ctx.fillStyle = '#94a3b8'; ctx.fillText('データなし', 10, 20); return; }
 
-  const margin = {l: 15, r: 15, t: 35, b: 15};
-  const W = rect.width - margin.l - margin.r;
-  const H = rect.height - margin.t - margin.b;
-  ctx.save();
-  ctx.translate(margin.l, margin.t);
-  
-  if (labels.length === 0) { ctx.fillStyle = '#94a3b8'; ctx.fillText('データなし', 10, 20); ctx.restore(); return; }
-  
   // Bar chart (横向き)
   const barW = Math.max(8, Math.min(30, Math.floor(W / (labels.length*1.2))));
   const gap = Math.max(6, Math.floor(barW * 0.2));
-  const maxShare = Math.max(...share);
-  
+  const maxShare = arrMax(share);
+
   ctx.textAlign = 'center'; ctx.textBaseline = 'top'; ctx.font = '9px system-ui';
   for (let i=0; i<labels.length; i++){
     const barH = (share[i] / maxShare) * H * 0.85;
@@ -327,61 +882,201 @@ function drawPanelComposition(canvasId) {
     ctx.fillStyle = '#cbd5e1';
     ctx.fillText(labels[i].substring(0, 5), x + barW/2, H + 5);
   }
-  
-  ctx.restore();
+
 }
 
-function draw(){
-  if (!gData) return;
+// 現在のコントロールの状態からデータ層へのリクエストを組み立てる
+function currentRequest() {
   const view = document.getElementById('view').value;
-  
+  const req = {view, measure: gSeriesPicker && gSeriesPicker.value !== '' ? gSeriesPicker.value : 0};
+  if (view === 'timeseries' || view === 'yoy_diff') {
+    req.region = gRegionPicker && gRegionPicker.value !== '' ? gData.regions[gRegionPicker.value] : '';
+    req.overlay = gOverlay;
+    req.trend = !!(document.getElementById('showTrend') && document.getElementById('showTrend').checked);
+  } else if (view === 'country_pie' || view === 'country_bar') {
+    const yearFilter = document.getElementById('yearFilter');
+    req.year = yearFilter ? yearFilter.value : '';
+    req.top_n = parseInt(document.getElementById('topN') ? document.getElementById('topN').value : '10', 10);
+    req.others = document.getElementById('showOthers') ? document.getElementById('showOthers').checked : false;
+    req.sort_by = document.getElementById('sortBy') ? document.getElementById('sortBy').value : 'value';
+  }
+  return req;
+}
+
+// 描画用データをデータ層（Worker）で計算してから描く。
+// 計算中に次の操作が来たら古いリクエストはキャンセルされ、最新のものだけが描かれる
+async function draw(){
+  if (!gData) return;
+  const req = currentRequest();
+  const total = perfStart('draw', req.view);
+  const worker = perfStart('worker', req.view);
+  let data;
+  try {
+    data = await gClient.request(req);
+  } catch (e) {
+    perfCancel(total);
+    perfCancel(worker);
+    if (e && e.cancelled) return;
+    document.getElementById('status').textContent = '描画データの計算に失敗しました: ' + ((e && e.message) || e);
+    return;
+  }
+  perfEnd(worker);
+  if (gView && gView.perf) perfCancel(gView.perf);  // 描く前に次の結果で置き換わった
+  gView = {req, data, seq: ++gViewSeq, perf: total};
+  gHover = null;
+  render();
+}
+
+// 最後に合成したチャートの座標系とポインタ処理 {margin, W, H, hover, click, press, release, wheel, reset, crosshair}
+let gFrame = null;
+
+// 再描画の要求を 1 フレームにまとめる。
+// base はチャート本体（キャッシュしたレイヤの合成）、最上位のオーバーレイ（ホバー・ピン留め）は毎回描く
+const gRender = {frame: 0, base: false};
+function render() { gRender.base = true; requestFrame(); }
+function renderHover() { requestFrame(); }
+function requestFrame() { if (!gRender.frame) gRender.frame = requestAnimationFrame(flushRender); }
+function flushRender() {
+  gRender.frame = 0;
+  const frame = perfStart('frame', '-');
+  if (gRender.base) {
+    gRender.base = false;
+    const view = gView;
+    const t = view && perfStart('render', view.req.view);
+    renderBase();
+    if (t) {
+      perfEnd(t);
+      // 操作（draw）から最初に描き終わるまで
+      if (view.perf) { perfEnd(view.perf); view.perf = null; }
+    }
+  }
+  renderOverlay();
+  perfEnd(frame);
+}
+
+// 計算済みの gView をレイヤに描いてチャートへ合成する（レイヤはデータ・サイズ・表示設定が変わったときだけ描き直す）
+function renderBase(){
+  if (!gView) return;
+  const view = gView.req.view;
+  const data = gView.data;
+
   // マルチパネルモードの場合
   if (view === 'multi_panel') {
-    drawMultiPanel();
+    gFrame = null;
+    drawMultiPanel(data, gView.seq);
     return;
   }
-  
-  const canvas = document.getElementById('chart');
-  const ctx = canvas.getContext('2d');
-  const rect = canvas.getBoundingClientRect();
-  canvas.width = rect.width * devicePixelRatio;
-  canvas.height = rect.height * devicePixelRatio;
-  ctx.setTransform(devicePixelRatio,0,0,devicePixelRatio,0,0);
-  ctx.clearRect(0,0,rect.width,rect.height);
 
+  const canvas = document.getElementById('chart');
+  const size = fitCanvas(canvas);
   const margin = {l: 60, r: 20, t: 30, b: 65};
-  const W = rect.width - margin.l - margin.r;
-  const H = rect.height - margin.t - margin.b;
-  ctx.save();
-  ctx.translate(margin.l, margin.t);
-  const selectedRegion = document.getElementById('regionFilter') ? document.getElementById('regionFilter').value : '';
-  
-  // 地域フィルタが選択されている場合は地域データを使用
-  let series;
-  if (selectedRegion && gData.regions && gData.regions.series) {
-    const regionSeries = gData.regions.series.find(s => s.label === selectedRegion);
-    series = regionSeries || {x:[], y:[], label:selectedRegion};
+  const frame = {margin, W: size.width - margin.l - margin.r, H: size.height - margin.t - margin.b, hover: null, click: null, crosshair: null};
+  let layers;
+  if (view === 'timeseries' || view === 'yoy_diff') {
+    layers = seriesLayers(data, view, size, frame);
+  } else if (view === 'heatmap') {
+    layers = heatmapLayers(data, size, frame);
   } else {
-    const midx = parseInt(document.getElementById('measure').value || '0', 10) || 0;
-    series = (gData.series || [])[midx] || {x:[], y:[], label:'series'};
+    const showTrend = !!(document.getElementById('showTrend') && document.getElementById('showTrend').checked);
+    const scaleType = document.getElementById('scaleType') ? document.getElementById('scaleType').value : 'linear';
+    const paint = {
+      composition: paintComposition, boxplot: paintBoxplot,
+      country_pie: paintCountryPie, country_bar: paintCountryBar,
+    }[view];
+    layers = [cachedLayer('plot', `${gView.seq}|${scaleType}|${showTrend}`, size, margin, (ctx, W, H) => paint(ctx, W, H, data))];
+    if (view === 'country_pie' && data.labels.length && data.total) frame.hover = countryPieHover(data, frame.W, frame.H);
   }
+  const ctx = canvas.getContext('2d');
+  ctx.setTransform(1,0,0,1,0,0);
+  ctx.clearRect(0,0,canvas.width,canvas.height);
+  for (const layer of layers) ctx.drawImage(layer, 0, 0);
+  gFrame = frame;
+}
 
-  if (view === 'timeseries' || view === 'yoy_diff') {
-    let xs = series.x.slice();
-    let ys = series.y.map(Number);
-    if (view === 'yoy_diff') {
-      const diff = [];
-      for (let i=0; i<ys.length; i++) diff.push(i ? ys[i]-ys[i-1] : 0);
-      ys = diff;
+// 最上位レイヤ（ホバーの十字線・ピン留めした点）だけを描き直す
+function renderOverlay() {
+  const overlay = document.getElementById('chartOverlay');
+  fitCanvas(overlay);
+  const ctx = overlay.getContext('2d');
+  ctx.setTransform(1,0,0,1,0,0);
+  ctx.clearRect(0,0,overlay.width,overlay.height);
+  if (!gFrame || !gFrame.crosshair) return;
+  ctx.setTransform(devicePixelRatio,0,0,devicePixelRatio,0,0);
+  ctx.translate(gFrame.margin.l, gFrame.margin.t);
+  gFrame.crosshair(ctx);
+}
+
+// チャート上のポインタ操作をプロット領域の座標に直して現在のフレームへ渡す
+function chartPointer(ev, kind) {
+  if (!gFrame || !gFrame[kind]) return;
+  const rect = ev.currentTarget.getBoundingClientRect();
+  gFrame[kind]((ev.clientX - rect.left) - gFrame.margin.l, (ev.clientY - rect.top) - gFrame.margin.t, ev);
+}
+
+// 描いた点の一様グリッド索引（プロット座標、セルは POINT_CELL 画素四方）。
+// 系列レイヤを描くときに作り、ホバー・ピン留めの近傍探索は周辺のセルだけを調べる
+const POINT_CELL = 16;
+const POINT_HIT_RADIUS = 24;
+let gPointGrid = null;
+function buildPointGrid(plotted, W, H, yScale) {
+  let n = 0;
+  for (const p of plotted) n += p.y.length;
+  const gx = Math.max(1, Math.ceil(W / POINT_CELL)), gy = Math.max(1, Math.ceil(H / POINT_CELL));
+  const px = new Float32Array(n), py = new Float32Array(n);
+  const line = new Int32Array(n), index = new Int32Array(n), cell = new Int32Array(n);
+  const start = new Int32Array(gx * gy + 1);
+  let k = 0;
+  plotted.forEach((p, s) => {
+    for (let i = 0; i < p.y.length; i++, k++) {
+      const x = p.pos[i] * W, y = yScale(p.y[i]);
+      const cx = Math.min(gx - 1, Math.max(0, Math.floor(x / POINT_CELL)));
+      const cy = Math.min(gy - 1, Math.max(0, Math.floor(y / POINT_CELL)));
+      px[k] = x; py[k] = y; line[k] = s; index[k] = i;
+      cell[k] = cy * gx + cx;
+      start[cell[k] + 1]++;
+    }
+  });
+  // セルごとの件数を累積して、各セルの点を items に連続して並べる
+  for (let c = 0; c < gx * gy; c++) start[c + 1] += start[c];
+  const fill = start.slice(0, gx * gy);
+  const items = new Int32Array(n);
+  for (let j = 0; j < n; j++) items[fill[cell[j]]++] = j;
+  return {gx, gy, px, py, line, index, start, items};
+}
+
+// (mx, my) から radius 画素以内で最も近い点 {s: 系列, i: 点} （無ければ null）
+function nearestPoint(grid, mx, my, radius) {
+  const r = Math.ceil(radius / POINT_CELL);
+  const cx = Math.floor(mx / POINT_CELL), cy = Math.floor(my / POINT_CELL);
+  let best = -1, bestD = radius * radius;
+  for (let y = Math.max(0, cy - r); y <= Math.min(grid.gy - 1, cy + r); y++) {
+    for (let x = Math.max(0, cx - r); x <= Math.min(grid.gx - 1, cx + r); x++) {
+      const c = y * grid.gx + x;
+      for (let p = grid.start[c]; p < grid.start[c + 1]; p++) {
+        const k = grid.items[p];
+        const dx = grid.px[k] - mx, dy = grid.py[k] - my;
+        const d = dx * dx + dy * dy;
+        if (d <= bestD) { bestD = d; best = k; }
+      }
     }
-    if (xs.length === 0) { ctx.fillText('データがありません', 10, 20); ctx.restore(); return; }
-    let minY = Math.min(...ys);
-    let maxY = Math.max(...ys);
-    const padY = (maxY - minY) * 0.1 || 1;
-    const y0 = minY - padY;
-    const y1 = maxY + padY;
-    const xScale = i => (i/(xs.length-1)) * W;
-    const yScale = v => H - ((v - y0)/(y1 - y0)) * H;
+  }
+  return best < 0 ? null : {s: grid.line[best], i: grid.index[best]};
+}
+
+// 時系列・前年比差分：軸と目盛り（範囲とラベルが同じなら使い回す）、系列の 2 レイヤ
+function seriesLayers(data, view, size, frame) {
+  const {margin, W, H} = frame;
+  const xs = data.x, ys = data.y, pos = data.pos;
+  if (xs.length === 0) {
+    return [cachedLayer('plot', `${gView.seq}|empty`, size, margin, ctx => { ctx.fillText('データがありません', 10, 20); })];
+  }
+  const padY = (data.hi - data.lo) * 0.1 || 1;
+  const y0 = data.lo - padY;
+  const y1 = data.hi + padY;
+  const xScale = i => pos[i] * W;
+  const yScale = v => H - ((v - y0)/(y1 - y0)) * H;
+
+  const axes = cachedLayer('axes', `${y0}|${y1}|${xs.join(',')}|${pos.join(',')}`, size, margin, ctx => {
     // Axes + grid
     ctx.strokeStyle = '#334155'; ctx.lineWidth = 1.5;
     ctx.beginPath(); ctx.moveTo(0,H); ctx.lineTo(W,H); ctx.stroke();
@@ -409,483 +1104,482 @@ function draw(){
     // X軸ラベル
     ctx.fillStyle = '#e2e8f0'; ctx.textAlign = 'center'; ctx.font = 'bold 13px system-ui';
     ctx.fillText('年度', W/2, H+35);
-    // Lines
-    function drawLine(lineXs, lineYs, color){
+  });
+
+  // 描く系列（重ね描画なら上位系列すべて）。ホバー・ピン留めの索引もこの点から作る
+  const plotted = data.overlay || [{label: data.label, pos, y: ys}];
+  const lines = cachedLayer('lines', String(gView.seq), size, margin, ctx => {
+    gPointGrid = buildPointGrid(plotted, W, H, yScale);
+    function drawLine(lp, lineYs, color){
       ctx.strokeStyle = color; ctx.lineWidth = 2.5; ctx.beginPath();
-      for (let i=0;i<lineYs.length;i++){ const x = xScale(i), y = yScale(lineYs[i]); if (i===0) ctx.moveTo(x,y); else ctx.lineTo(x,y);} ctx.stroke();
+      for (let i=0;i<lineYs.length;i++){ const x = lp[i] * W, y = yScale(lineYs[i]); if (i===0) ctx.moveTo(x,y); else ctx.lineTo(x,y);} ctx.stroke();
     }
-    function drawTrendLine(ys, color) {
-      // 移動平均（3点）
-      if (ys.length < 3) return;
-      const smoothed = [];
-      for (let i=0; i<ys.length; i++) {
-        if (i === 0) smoothed.push(ys[i]);
-        else if (i === ys.length - 1) smoothed.push(ys[i]);
-        else smoothed.push((ys[i-1] + ys[i] + ys[i+1]) / 3);
-      }
-      ctx.strokeStyle = color; ctx.lineWidth = 2; ctx.setLineDash([5, 5]); ctx.beginPath();
-      for (let i=0;i<smoothed.length;i++){ const x = xScale(i), y = yScale(smoothed[i]); if (i===0) ctx.moveTo(x,y); else ctx.lineTo(x,y);} ctx.stroke();
-      ctx.setLineDash([]);
+    if (data.y_min && data.y_max) {
+      // 間引いた区間の最小〜最大を帯で描く
+      ctx.fillStyle = 'rgba(148,163,184,0.18)'; ctx.beginPath();
+      for (let i=0;i<data.y_max.length;i++){ const x = xScale(i), y = yScale(data.y_max[i]); if (i===0) ctx.moveTo(x,y); else ctx.lineTo(x,y); }
+      for (let i=data.y_min.length-1;i>=0;i--){ ctx.lineTo(xScale(i), yScale(data.y_min[i])); }
+      ctx.closePath(); ctx.fill();
     }
-    if (gOverlay) {
-      (gData.series||[]).forEach((s,i)=>{ drawLine(s.x, s.y.map(Number), gColors[i%gColors.length]); });
+    if (data.overlay) {
+      plotted.forEach((s,i)=>{ drawLine(s.pos, s.y, gColors[i%gColors.length]); });
     } else {
-      drawLine(xs, ys, gColors[0]);
-      // トレンドライン
-      if (document.getElementById('showTrend') && document.getElementById('showTrend').checked) {
-        drawTrendLine(ys, '#f59e0b');
+      drawLine(pos, ys, gColors[0]);
+      // トレンドライン（3点移動平均、データ層で計算済み）
+      if (data.trend) {
+        ctx.strokeStyle = '#f59e0b'; ctx.lineWidth = 2; ctx.setLineDash([5, 5]); ctx.beginPath();
+        for (let i=0;i<data.trend.length;i++){ const x = xScale(i), y = yScale(data.trend[i]); if (i===0) ctx.moveTo(x,y); else ctx.lineTo(x,y);} ctx.stroke();
+        ctx.setLineDash([]);
       }
     }
     // Title
     ctx.fillStyle = '#e5e7eb'; ctx.textAlign = 'left'; ctx.textBaseline = 'alphabetic'; ctx.font = 'bold 14px system-ui';
-    const ttl = gOverlay ? '上位系列（重ね描画）' : (series.label + (view==='yoy_diff'?'（前年比差分）':''));
+    const ttl = data.overlay ? '上位系列（重ね描画）' : (data.label + (view==='yoy_diff'?'（前年比差分）':''));
     ctx.fillText(ttl, 0, -8);
-    // Crosshair & tooltips
-    const tip = document.getElementById('status');
-    let hoverIdx = -1;
-    canvas.onmousemove = (ev)=>{
-      const rect2 = canvas.getBoundingClientRect();
-      const mx = (ev.clientX - rect2.left) - margin.l;
-      const my = (ev.clientY - rect2.top) - margin.t;
-      if (mx<0 || mx>W || my<0 || my>H) { tip.textContent = ''; hoverIdx = -1; draw(); return; }
-      const idx = Math.round((mx/W) * (xs.length-1));
-      hoverIdx = idx;
-      let txt = '';
-      if (gOverlay){
-        const parts = (gData.series||[]).map((s,i)=>`${s.label}: ${Number(s.y[idx]||0).toLocaleString()}`);
-        txt = `${xs[idx]} — ${parts.join(' / ')}`;
-      } else {
-        const val = Number(ys[idx]||0);
-        const prevVal = idx > 0 ? Number(ys[idx-1]||0) : null;
-        let yoyStr = '';
-        if (prevVal !== null && prevVal !== 0) {
-          const yoyPct = ((val - prevVal) / prevVal * 100).toFixed(1);
-          yoyStr = ` (YoY: ${yoyPct > 0 ? '+' : ''}${yoyPct}%)`;
-        }
-        txt = `${xs[idx]} — ${val.toLocaleString()} ${yoyStr} (${series.label})`;
+  });
+
+  // Crosshair & tooltips（オーバーレイだけを描き直す）。
+  // 近傍の点はグリッド索引で探し、近くに点が無ければ主系列の最も近い年に合わせる
+  const tip = document.getElementById('status');
+  const hitTest = (mx, my) => nearestPoint(gPointGrid, mx, my, POINT_HIT_RADIUS) || {s: 0, i: nearestPos(plotted[0].pos, mx/W)};
+  const pointAt = p => (p && p.s < plotted.length && p.i < plotted[p.s].y.length)
+    ? {x: plotted[p.s].pos[p.i] * W, y: yScale(plotted[p.s].y[p.i]), color: gColors[p.s % gColors.length]} : null;
+  frame.hover = (mx, my) => {
+    if (mx<0 || mx>W || my<0 || my>H) {
+      if (gHover) { tip.textContent = ''; gHover = null; renderHover(); }
+      return;
+    }
+    const hit = hitTest(mx, my);
+    if (gHover && gHover.s === hit.s && gHover.i === hit.i) return;
+    gHover = hit;
+    const idx = hit.i;
+    let txt = '';
+    if (data.overlay){
+      const s = data.overlay[hit.s];
+      txt = `${xs[idx]} — ${s.label}: ${Number(s.y[idx]||0).toLocaleString()}`;
+    } else {
+      const val = Number(ys[idx]||0);
+      // 前年の値はデータ層が間引く前の系列から取ったもの（間引いた隣の点ではない）
+      const prevVal = data.prev ? data.prev[idx] : NaN;
+      let yoyStr = '';
+      if (Number.isFinite(prevVal) && prevVal !== 0) {
+        const yoyPct = ((val - prevVal) / prevVal * 100).toFixed(1);
+        yoyStr = ` (YoY: ${yoyPct > 0 ? '+' : ''}${yoyPct}%)`;
       }
-      tip.textContent = txt;
-      // Redraw with crosshair
-      draw();
-    };
-    canvas.onclick = (ev)=>{
-      const rect2 = canvas.getBoundingClientRect();
-      const mx = (ev.clientX - rect2.left) - margin.l;
-      const my = (ev.clientY - rect2.top) - margin.t;
-      if (mx<0 || mx>W || my<0 || my>H) { gPinnedPoint = null; draw(); return; }
-      const idx = Math.round((mx/W) * (xs.length-1));
-      gPinnedPoint = {idx, x: xScale(idx), y: yScale(ys[idx])};
-      draw();
-    };
+      txt = `${xs[idx]} — ${val.toLocaleString()} ${yoyStr} (${data.label})`;
+    }
+    tip.textContent = txt;
+    renderHover();
+  };
+  frame.click = (mx, my) => {
+    if (mx<0 || mx>W || my<0 || my>H) { gPinnedPoint = null; renderHover(); return; }
+    gPinnedPoint = hitTest(mx, my);
+    renderHover();
+  };
+  frame.crosshair = ctx => {
     // Draw crosshair & pinned point
-    if (hoverIdx >= 0 && !gPinnedPoint) {
-      const hx = xScale(hoverIdx);
-      const hy = yScale(ys[hoverIdx]);
+    const hp = gPinnedPoint ? null : pointAt(gHover);
+    if (hp) {
       ctx.strokeStyle = '#94a3b8'; ctx.lineWidth = 1; ctx.setLineDash([4, 4]);
-      ctx.beginPath(); ctx.moveTo(hx, 0); ctx.lineTo(hx, H); ctx.stroke();
-      ctx.beginPath(); ctx.moveTo(0, hy); ctx.lineTo(W, hy); ctx.stroke();
+      ctx.beginPath(); ctx.moveTo(hp.x, 0); ctx.lineTo(hp.x, H); ctx.stroke();
+      ctx.beginPath(); ctx.moveTo(0, hp.y); ctx.lineTo(W, hp.y); ctx.stroke();
       ctx.setLineDash([]);
       // Dot
-      ctx.fillStyle = gColors[0]; ctx.beginPath(); ctx.arc(hx, hy, 5, 0, Math.PI*2); ctx.fill();
+      ctx.fillStyle = hp.color; ctx.beginPath(); ctx.arc(hp.x, hp.y, 5, 0, Math.PI*2); ctx.fill();
     }
-    if (gPinnedPoint) {
+    const pp = pointAt(gPinnedPoint);
+    if (pp) {
       ctx.strokeStyle = '#f59e0b'; ctx.lineWidth = 1.5; ctx.setLineDash([]);
-      ctx.beginPath(); ctx.moveTo(gPinnedPoint.x, 0); ctx.lineTo(gPinnedPoint.x, H); ctx.stroke();
-      ctx.beginPath(); ctx.moveTo(0, gPinnedPoint.y); ctx.lineTo(W, gPinnedPoint.y); ctx.stroke();
-      ctx.fillStyle = '#f59e0b'; ctx.beginPath(); ctx.arc(gPinnedPoint.x, gPinnedPoint.y, 6, 0, Math.PI*2); ctx.fill();
-    }
-  } else if (view === 'composition') {
-    const comp = gData.composition || {labels:[], share:[]};
-    const labels = comp.labels || [];
-    const share = (comp.share || []).map(Number);
-    if (labels.length === 0) { ctx.fillText('構成比データがありません', 10, 20); ctx.restore(); return; }
-    // Bar chart
-    const barW = Math.max(8, Math.min(48, Math.floor(W / (labels.length*1.5))));
-    const gap = Math.max(8, Math.floor(barW * 0.25));
-    ctx.textAlign = 'center'; ctx.textBaseline = 'top';
-    for (let i=0; i<labels.length; i++){
-      const x = i * (barW + gap);
-      const h = Math.round((share[i]) * H);
-      ctx.fillStyle = gColors[i%gColors.length]; ctx.fillRect(x, H - h, barW, h);
-      ctx.fillStyle = '#94a3b8'; ctx.fillText(`${labels[i].slice(0,12)} ${(share[i]*100).toFixed(1)}%`, x + barW/2, H + 8);
-    }
-    ctx.fillStyle = '#e5e7eb'; ctx.textAlign = 'left'; ctx.textBaseline = 'alphabetic'; ctx.font = 'bold 14px system-ui';
-    ctx.fillText('構成比（' + (comp.year || '最新年') + '）', 0, -6);
-  } else if (view === 'heatmap') {
-    // Heatmap: measures (rows) × years (columns)
-    const years = (gData.years||[]).slice();
-    const seriesAll = (gData.series||[]);
-    if (!years.length || !seriesAll.length) { ctx.fillText('ヒートマップ用データが不足しています', 10, 20); ctx.restore(); return; }
-    // Build matrix and min/max for color scaling
-    const M = seriesAll.length, N = years.length;
-    const val = Array.from({length:M},()=>Array(N).fill(0));
-    let vmin = Infinity, vmax = -Infinity;
-    for (let i=0;i<M;i++){
-      const s = seriesAll[i];
-      const yi = {};
-      (s.x||[]).forEach((x,idx)=>{ yi[String(x)] = Number(s.y[idx]||0);});
-      for (let j=0;j<N;j++){
-        const v = Number(yi[String(years[j])] || 0);
-        val[i][j] = v; vmin = Math.min(vmin, v); vmax = Math.max(vmax, v);
-      }
-    }
-    if (!isFinite(vmin) || !isFinite(vmax)) { vmin=0; vmax=1; }
-    // Color scale (simple blue -> red)
-    function color(t){ // t in [0,1]
-      const r = Math.round(255 * t);
-      const b = Math.round(255 * (1 - t));
-      const g = Math.round(64 + 128 * t*(1-t));
-      return `rgb(${r},${g},${b})`;
+      ctx.beginPath(); ctx.moveTo(pp.x, 0); ctx.lineTo(pp.x, H); ctx.stroke();
+      ctx.beginPath(); ctx.moveTo(0, pp.y); ctx.lineTo(W, pp.y); ctx.stroke();
+      ctx.fillStyle = '#f59e0b'; ctx.beginPath(); ctx.arc(pp.x, pp.y, 6, 0, Math.PI*2); ctx.fill();
     }
-    const cw = Math.max(6, Math.min(32, Math.floor(W / Math.max(6,N))));
-    const ch = Math.max(12, Math.min(28, Math.floor(H / Math.max(3,M))));
-    // Axes labels
-    ctx.fillStyle = '#94a3b8'; ctx.textAlign='center'; ctx.textBaseline='top';
-    const xstep = Math.ceil(N/10);
-    for (let j=0;j<N;j+=xstep){ ctx.fillText(String(years[j]), j*cw + cw/2, H+8); }
-    ctx.textAlign='right'; ctx.textBaseline='middle';
-    for (let i=0;i<M;i++){ ctx.fillText(String(seriesAll[i].label||''), -8, i*ch + ch/2); }
-    // Cells
-    for (let i=0;i<M;i++){
-      for (let j=0;j<N;j++){
-        const t = (val[i][j] - vmin) / (vmax - vmin || 1);
-        ctx.fillStyle = color(Math.max(0, Math.min(1,t)));
-        ctx.fillRect(j*cw, i*ch, cw-1, ch-1);
-      }
-    }
-    // Title
-    ctx.fillStyle = '#e5e7eb'; ctx.textAlign='left'; ctx.textBaseline='alphabetic'; ctx.font='bold 14px system-ui';
-    ctx.fillText('ヒートマップ（年×系列）', 0, -8);
-  } else if (view === 'boxplot') {
-    // Boxplot: distribution across series per year
-    const years = (gData.years||[]).slice();
-    const seriesAll = (gData.series||[]);
-    if (!years.length || !seriesAll.length) { ctx.fillText('箱ひげ図用データが不足しています', 10, 20); ctx.restore(); return; }
-    const N = years.length;
-    const xScale = i => (N<=1? W/2 : (i/(N-1))*W);
-    // Collect values per year
-    function stats(vals){
-      const arr = vals.slice().sort((a,b)=>a-b);
-      const n = arr.length; if (!n) return null;
-      function q(p){ const idx=(n-1)*p; const i=Math.floor(idx); const f=idx-i; return f? arr[i]*(1-f)+arr[i+1]*f : arr[i]; }
-      return {min:arr[0], q1:q(0.25), med:q(0.5), q3:q(0.75), max:arr[n-1]};
-    }
-    const perYearStats = [];
-    let gmin = Infinity, gmax = -Infinity;
-    for (let j=0;j<N;j++){
-      const vals = [];
-      for (let i=0;i<seriesAll.length;i++){
-        const s = seriesAll[i];
-        const yi = {};
-        (s.x||[]).forEach((x,idx)=>{ yi[String(x)] = Number(s.y[idx]||0);});
-        const v = Number(yi[String(years[j])] || 0);
-        if (isFinite(v)) vals.push(v);
-      }
-      const st = stats(vals);
-      perYearStats.push(st);
-      if (st){ gmin = Math.min(gmin, st.min); gmax = Math.max(gmax, st.max); }
-    }
-    if (!isFinite(gmin) || !isFinite(gmax)) { gmin=0; gmax=1; }
-    const padY = (gmax-gmin)*0.1 || 1; const y0=gmin-padY, y1=gmax+padY;
-    const yScale = v => H - ((v - y0)/(y1 - y0)) * H;
-    // Grid
-    ctx.strokeStyle = '#1f2937'; ctx.lineWidth=1; ctx.beginPath(); ctx.moveTo(0,H); ctx.lineTo(W,H); ctx.stroke(); ctx.beginPath(); ctx.moveTo(0,0); ctx.lineTo(0,H); ctx.stroke();
-    ctx.fillStyle = '#94a3b8'; ctx.textAlign='center'; ctx.textBaseline='top';
-    const step = Math.ceil(N/8);
-    for (let j=0;j<N;j+=step){ ctx.fillText(String(years[j]), xScale(j), H+10); }
-    // Draw boxes
-    ctx.strokeStyle = '#60a5fa'; ctx.fillStyle = 'rgba(96,165,250,0.25)';
-    const boxW = Math.max(6, Math.min(24, Math.floor(W / Math.max(6,N))));
-    for (let j=0;j<N;j++){
-      const st = perYearStats[j]; if (!st) continue;
-      const x = xScale(j) - boxW/2;
-      const yq1 = yScale(st.q1), yq3 = yScale(st.q3), ymed = yScale(st.med), ymin = yScale(st.min), ymax = yScale(st.max);
-      // Box
-      ctx.fillRect(x, yq3, boxW, yq1 - yq3);
-      ctx.strokeRect(x, yq3, boxW, yq1 - yq3);
-      // Median line
-      ctx.beginPath(); ctx.moveTo(x, ymed); ctx.lineTo(x+boxW, ymed); ctx.stroke();
-      // Whiskers
-      ctx.beginPath(); ctx.moveTo(x+boxW/2, yq3); ctx.lineTo(x+boxW/2, ymax); ctx.stroke();
-      ctx.beginPath(); ctx.moveTo(x+boxW/2, yq1); ctx.lineTo(x+boxW/2, ymin); ctx.stroke();
-    }
-    // Title
-    ctx.fillStyle = '#e5e7eb'; ctx.textAlign='left'; ctx.textBaseline='alphabetic'; ctx.font='bold 14px system-ui';
-    ctx.fillText('箱ひげ図（年次・系列分布）', 0, -8);
-  } else if (view === 'country_pie') {
-    // 円グラフ：国別構成比（最新年または選択年）
-    if (!gData.countries || !gData.countries.series || gData.countries.series.length === 0) {
-      ctx.fillText('国別データがありません', 10, 20); ctx.restore(); return;
-    }
-    const yearFilter = document.getElementById('yearFilter');
-    const selectedYear = yearFilter ? yearFilter.value : '';
-    const targetYear = selectedYear || (gData.years && gData.years[gData.years.length - 1]) || '2025';
-    
-    // 各国の値を収集
-    const countryData = [];
-    let total = 0;
-    for (const countrySeries of gData.countries.series) {
-      if (!countrySeries.x || !countrySeries.y) continue;
-      const idx = countrySeries.x.indexOf(String(targetYear));
-      if (idx >= 0) {
-        const val = Number(countrySeries.y[idx] || 0);
-        if (val > 0) {  // 正の値のみ
-          countryData.push({ label: countrySeries.label, value: val });
-          total += val;
-        }
-      }
-    }
-    
-    if (countryData.length === 0 || total === 0) {
-      ctx.fillText('選択年のデータがありません', 10, 20); ctx.restore(); return;
-    }
-    
-    // 値でソート（降順）
-    countryData.sort((a, b) => b.value - a.value);
-    
-    // トップNを取得
-    const topN = parseInt(document.getElementById('topN') ? document.getElementById('topN').value : '10', 10);
-    const showOthers = document.getElementById('showOthers') ? document.getElementById('showOthers').checked : false;
-    
-    let displayData = countryData.slice(0, topN);
-    
-    // 「その他」を集約（円グラフ用）
-    if (showOthers && countryData.length > topN) {
-      const othersValue = countryData.slice(topN).reduce((sum, item) => sum + item.value, 0);
-      if (othersValue > 0) {
-        displayData.push({ label: 'その他', value: othersValue });
-        total += othersValue;  // 合計に追加
-      }
-    }
-    
-    // 円グラフを描画
-    const centerX = W / 2;
-    const centerY = H / 2;
-    const radius = Math.min(W, H) * 0.35;
-    
-    let startAngle = -Math.PI / 2;  // 12時の位置から開始
-    displayData.forEach((item, i) => {
-      const angle = (item.value / total) * 2 * Math.PI;
-      const endAngle = startAngle + angle;
-      
-      // 扇形を描画（国名ハッシュで一貫した色）
-      ctx.fillStyle = stringToColor(item.label);
-      ctx.beginPath();
-      ctx.moveTo(centerX, centerY);
-      ctx.arc(centerX, centerY, radius, startAngle, endAngle);
-      ctx.closePath();
-      ctx.fill();
-      
-      // ラベル（中央角度に配置）
-      const midAngle = startAngle + angle / 2;
-      const labelX = centerX + Math.cos(midAngle) * radius * 0.7;
-      const labelY = centerY + Math.sin(midAngle) * radius * 0.7;
-      const percentage = ((item.value / total) * 100).toFixed(1);
-      
-      ctx.fillStyle = '#fff';
-      ctx.textAlign = 'center';
-      ctx.textBaseline = 'middle';
-      ctx.font = 'bold 12px system-ui';
-      if (percentage > 5) {  // 5%以上の場合のみラベル表示
-        ctx.fillText(`${percentage}%`, labelX, labelY);
-      }
-      
-      startAngle = endAngle;
-    });
-    
-    // タイトル
-    ctx.fillStyle = '#e5e7eb'; ctx.textAlign = 'left'; ctx.textBaseline = 'alphabetic'; ctx.font = 'bold 14px system-ui';
-    ctx.fillText(`国別構成比（${targetYear}年・トップ${topN}）`, 0, -8);
-    
-    // ホバー時のツールチップ処理
-    const tip = document.getElementById('status');
-    canvas.onmousemove = (ev) => {
-      const rect2 = canvas.getBoundingClientRect();
-      const mx = (ev.clientX - rect2.left) - margin.l;
-      const my = (ev.clientY - rect2.top) - margin.t;
-      
-      // 円の中心からの距離と角度を計算
-      const dx = mx - centerX;
-      const dy = my - centerY;
-      const dist = Math.sqrt(dx * dx + dy * dy);
-      
-      if (dist <= radius) {
-        let angle = Math.atan2(dy, dx) + Math.PI / 2;  // 12時の位置を0とする
-        if (angle < 0) angle += 2 * Math.PI;
-        
-        // どの扇形にホバーしているかを判定
-        let cumAngle = 0;
-        for (let i = 0; i < displayData.length; i++) {
-          const segAngle = (displayData[i].value / total) * 2 * Math.PI;
-          if (angle >= cumAngle && angle < cumAngle + segAngle) {
-            const pct = ((displayData[i].value / total) * 100).toFixed(1);
-            tip.textContent = `${displayData[i].label}: ${displayData[i].value.toLocaleString()} 億円 (${pct}%)`;
-            return;
-          }
-          cumAngle += segAngle;
-        }
-      }
-      tip.textContent = '';
-    };
-    
-    // 凡例を別途表示（国名ハッシュで一貫した色）
-    const legend = document.getElementById('legend');
-    legend.innerHTML = '';
-    legend.style.maxHeight = '200px';
-    legend.style.overflowY = 'auto';
-    displayData.forEach((item, i) => {
-      const d = document.createElement('div');
-      d.className = 'item';
-      d.innerHTML = `<span class="swatch" style="background:${stringToColor(item.label)}"></span>${item.label}: ${item.value.toLocaleString()} (${((item.value / total) * 100).toFixed(1)}%)`;
-      legend.appendChild(d);
-    });
-  } else if (view === 'country_bar') {
-    // 棒グラフ：国別ランキング（任意年のトップN）
-    if (!gData.countries || !gData.countries.series || gData.countries.series.length === 0) {
-      ctx.fillText('国別データがありません', 10, 20); ctx.restore(); return;
+  };
+  return [axes, lines];
+}
+
+function paintComposition(ctx, W, H, data) {
+  const labels = data.labels;
+  const share = data.share;
+  if (labels.length === 0) { ctx.fillText('構成比データがありません', 10, 20); return; }
+  // Bar chart
+  const barW = Math.max(8, Math.min(48, Math.floor(W / (labels.length*1.5))));
+  const gap = Math.max(8, Math.floor(barW * 0.25));
+  ctx.textAlign = 'center'; ctx.textBaseline = 'top';
+  for (let i=0; i<labels.length; i++){
+    const x = i * (barW + gap);
+    const h = Math.round((share[i]) * H);
+    ctx.fillStyle = gColors[i%gColors.length]; ctx.fillRect(x, H - h, barW, h);
+    ctx.fillStyle = '#94a3b8'; ctx.fillText(`${labels[i].slice(0,12)} ${(share[i]*100).toFixed(1)}%`, x + barW/2, H + 8);
+  }
+  ctx.fillStyle = '#e5e7eb'; ctx.textAlign = 'left'; ctx.textBaseline = 'alphabetic'; ctx.font = 'bold 14px system-ui';
+  ctx.fillText('構成比（' + (data.year || '最新年') + '）', 0, -6);
+}
+
+// ヒートマップの値→色の対応表（256 段階、青→赤）。ImageData にそのまま書ける RGBA の 32bit 値
+const HEATMAP_LUT = (() => {
+  const lut = new Uint32Array(256);
+  const bytes = new Uint8Array(lut.buffer);
+  for (let k = 0; k < 256; k++) {
+    const t = k / 255;
+    bytes[k*4] = Math.round(255 * t);
+    bytes[k*4 + 1] = Math.round(64 + 128 * t*(1-t));
+    bytes[k*4 + 2] = Math.round(255 * (1 - t));
+    bytes[k*4 + 3] = 255;
+  }
+  return lut;
+})();
+
+// 1 セル = 1 画素のヒートマップ画像（データが変わったときだけ作り、表示時に拡大して貼る）
+let gHeatmapRaster = {seq: -1, canvas: null};
+function heatmapRaster(data) {
+  if (gHeatmapRaster.seq === gView.seq) return gHeatmapRaster.canvas;
+  const M = data.rows.length, N = data.cols.length;
+  const canvas = document.createElement('canvas');
+  canvas.width = N;
+  canvas.height = M;
+  const ctx = canvas.getContext('2d');
+  const img = ctx.createImageData(N, M);
+  const px = new Uint32Array(img.data.buffer);
+  const values = data.values, vmin = data.vmin;
+  const scale = 255 / (data.vmax - vmin || 1);
+  for (let c = 0; c < values.length; c++) {
+    const k = Math.round((values[c] - vmin) * scale);
+    px[c] = HEATMAP_LUT[k < 0 ? 0 : (k > 255 ? 255 : k)];
+  }
+  ctx.putImageData(img, 0, 0);
+  gHeatmapRaster = {seq: gView.seq, canvas};
+  return canvas;
+}
+
+// ヒートマップの表示範囲（セル単位）。データが変わると全体表示に戻る
+let gHeatmapViewport = null;
+let gHeatmapDrag = null;
+function heatmapViewport(N, M) {
+  if (!gHeatmapViewport || gHeatmapViewport.seq !== gView.seq) gHeatmapViewport = {seq: gView.seq, c0: 0, r0: 0, cols: N, rows: M};
+  return gHeatmapViewport;
+}
+function clampViewport(vp, N, M) {
+  vp.cols = Math.min(N, Math.max(Math.min(N, 4), vp.cols));
+  vp.rows = Math.min(M, Math.max(Math.min(M, 3), vp.rows));
+  vp.c0 = Math.min(Math.max(0, vp.c0), N - vp.cols);
+  vp.r0 = Math.min(Math.max(0, vp.r0), M - vp.rows);
+}
+
+// Heatmap: measures (rows) × years (columns)。行列と最小・最大はデータ層で計算済み。
+// セルは画像を拡大して 1 回で貼り、ラベルは見えている行・列だけを描く（ホイールで拡大、ドラッグで移動、ダブルクリックで全体）
+function heatmapLayers(data, size, frame) {
+  const {margin, W, H} = frame;
+  const years = data.cols, rows = data.rows;
+  if (!years.length || !rows.length) {
+    return [cachedLayer('plot', `${gView.seq}|empty`, size, margin, ctx => { ctx.fillText('ヒートマップ用データが不足しています', 10, 20); })];
+  }
+  const M = rows.length, N = years.length;
+  const vp = heatmapViewport(N, M);
+  const cw = Math.min(32, W / vp.cols), ch = Math.min(28, H / vp.rows);
+  const layer = cachedLayer('plot', `${gView.seq}|${vp.c0}|${vp.r0}|${vp.cols}|${vp.rows}`, size, margin, ctx => {
+    ctx.imageSmoothingEnabled = false;
+    ctx.drawImage(heatmapRaster(data), vp.c0, vp.r0, vp.cols, vp.rows, 0, 0, vp.cols*cw, vp.rows*ch);
+    // Axes labels（見えている列・行のみ。重ならない間隔で間引く）
+    ctx.fillStyle = '#94a3b8'; ctx.textAlign='center'; ctx.textBaseline='top';
+    const xstep = Math.max(Math.ceil(vp.cols/10), Math.ceil(40/cw));
+    for (let j = Math.ceil(vp.c0/xstep)*xstep; j < vp.c0 + vp.cols; j += xstep){
+      const x = (j - vp.c0)*cw + cw/2;
+      if (x >= 0 && x <= vp.cols*cw) ctx.fillText(String(years[j]), x, vp.rows*ch + 8);
     }
-    const yearFilter = document.getElementById('yearFilter');
-    const selectedYear = yearFilter ? yearFilter.value : '';
-    const targetYear = selectedYear || (gData.years && gData.years[gData.years.length - 1]) || '2025';
-    
-    // 各国の値を収集
-    const countryData = [];
-    for (const countrySeries of gData.countries.series) {
-      if (!countrySeries.x || !countrySeries.y) continue;
-      const idx = countrySeries.x.indexOf(String(targetYear));
-      if (idx >= 0) {
-        const val = Number(countrySeries.y[idx] || 0);
-        if (val > 0) {  // 正の値のみ
-          countryData.push({ label: countrySeries.label, value: val });
+    ctx.textAlign='right'; ctx.textBaseline='middle';
+    const ystep = Math.max(1, Math.ceil(12/ch));
+    for (let i = Math.ceil(vp.r0/ystep)*ystep; i < vp.r0 + vp.rows; i += ystep){
+      const y = (i - vp.r0)*ch + ch/2;
+      if (y >= 0 && y <= vp.rows*ch) ctx.fillText(rows[i], -8, y);
+    }
+    // Title
+    ctx.fillStyle = '#e5e7eb'; ctx.textAlign='left'; ctx.textBaseline='alphabetic'; ctx.font='bold 14px system-ui';
+    const zoomed = vp.cols < N || vp.rows < M;
+    ctx.fillText('ヒートマップ（年×系列）' + (zoomed ? '（拡大表示中・ダブルクリックで全体）' : ''), 0, -8);
+  });
+
+  // ポインタ操作：ホバーで値を表示、ドラッグで移動、ホイールで拡大縮小
+  const tip = document.getElementById('status');
+  const inside = (mx, my) => mx >= 0 && my >= 0 && mx < vp.cols*cw && my < vp.rows*ch;
+  frame.press = (mx, my) => { if (inside(mx, my)) gHeatmapDrag = {mx, my, c0: vp.c0, r0: vp.r0}; };
+  frame.release = () => { gHeatmapDrag = null; };
+  frame.hover = (mx, my, ev) => {
+    if (gHeatmapDrag && ev && (ev.buttons & 1)) {
+      vp.c0 = gHeatmapDrag.c0 - (mx - gHeatmapDrag.mx)/cw;
+      vp.r0 = gHeatmapDrag.r0 - (my - gHeatmapDrag.my)/ch;
+      clampViewport(vp, N, M);
+      render();
+      return;
+    }
+    if (!inside(mx, my)) { tip.textContent = ''; return; }
+    const i = Math.floor(vp.r0 + my/ch), j = Math.floor(vp.c0 + mx/cw);
+    tip.textContent = `${rows[i]} / ${years[j]}: ${data.values[i*N + j].toLocaleString()}`;
+  };
+  frame.wheel = (mx, my, ev) => {
+    if (!inside(mx, my)) return;
+    ev.preventDefault();
+    const factor = ev.deltaY > 0 ? 1.25 : 0.8;
+    const fc = vp.c0 + mx/cw, fr = vp.r0 + my/ch;
+    vp.cols *= factor;
+    vp.rows *= factor;
+    clampViewport(vp, N, M);
+    // ポインタ位置のセルが動かないように原点を合わせる
+    vp.c0 = fc - mx / Math.min(32, W / vp.cols);
+    vp.r0 = fr - my / Math.min(28, H / vp.rows);
+    clampViewport(vp, N, M);
+    render();
+  };
+  frame.reset = () => { gHeatmapViewport = null; render(); };
+  return [layer];
+}
+
+function paintBoxplot(ctx, W, H, data) {
+  // Boxplot: distribution across series per year（五数要約はデータ層で計算済み）
+  const years = data.years;
+  if (!years.length || !gData.series.length) { ctx.fillText('箱ひげ図用データが不足しています', 10, 20); return; }
+  const N = years.length;
+  const xScale = i => (N<=1? W/2 : (i/(N-1))*W);
+  const padY = (data.hi-data.lo)*0.1 || 1; const y0=data.lo-padY, y1=data.hi+padY;
+  const yScale = v => H - ((v - y0)/(y1 - y0)) * H;
+  // Grid
+  ctx.strokeStyle = '#1f2937'; ctx.lineWidth=1; ctx.beginPath(); ctx.moveTo(0,H); ctx.lineTo(W,H); ctx.stroke(); ctx.beginPath(); ctx.moveTo(0,0); ctx.lineTo(0,H); ctx.stroke();
+  ctx.fillStyle = '#94a3b8'; ctx.textAlign='center'; ctx.textBaseline='top';
+  const step = Math.ceil(N/8);
+  for (let j=0;j<N;j+=step){ ctx.fillText(String(years[j]), xScale(j), H+10); }
+  // Draw boxes
+  ctx.strokeStyle = '#60a5fa'; ctx.fillStyle = 'rgba(96,165,250,0.25)';
+  const boxW = Math.max(6, Math.min(24, Math.floor(W / Math.max(6,N))));
+  for (let j=0;j<N;j++){
+    if (!data.has[j]) continue;
+    const s = data.stats, o = j*5;
+    const x = xScale(j) - boxW/2;
+    const ymin = yScale(s[o]), yq1 = yScale(s[o+1]), ymed = yScale(s[o+2]), yq3 = yScale(s[o+3]), ymax = yScale(s[o+4]);
+    // Box
+    ctx.fillRect(x, yq3, boxW, yq1 - yq3);
+    ctx.strokeRect(x, yq3, boxW, yq1 - yq3);
+    // Median line
+    ctx.beginPath(); ctx.moveTo(x, ymed); ctx.lineTo(x+boxW, ymed); ctx.stroke();
+    // Whiskers
+    ctx.beginPath(); ctx.moveTo(x+boxW/2, yq3); ctx.lineTo(x+boxW/2, ymax); ctx.stroke();
+    ctx.beginPath(); ctx.moveTo(x+boxW/2, yq1); ctx.lineTo(x+boxW/2, ymin); ctx.stroke();
+  }
+  // Title
+  ctx.fillStyle = '#e5e7eb'; ctx.textAlign='left'; ctx.textBaseline='alphabetic'; ctx.font='bold 14px system-ui';
+  ctx.fillText('箱ひげ図（年次・系列分布）', 0, -8);
+}
+
+function paintCountryPie(ctx, W, H, data) {
+  // 円グラフ：国別構成比（最新年または選択年）
+  if (!data.available) {
+    ctx.fillText('国別データがありません', 10, 20); return;
+  }
+  const targetYear = data.year;
+  const topN = data.top_n;
+  // トップN（「その他」込み）と全体の合計はデータ層で計算済み
+  const labels = data.labels, values = data.values, total = data.total;
+
+  if (labels.length === 0 || total === 0) {
+    ctx.fillText('選択年のデータがありません', 10, 20); return;
+  }
+
+  // 円グラフを描画
+  const centerX = W / 2;
+  const centerY = H / 2;
+  const radius = Math.min(W, H) * 0.35;
+
+  let startAngle = -Math.PI / 2;  // 12時の位置から開始
+  labels.forEach((label, i) => {
+    const angle = (values[i] / total) * 2 * Math.PI;
+    const endAngle = startAngle + angle;
+
+    // 扇形を描画（国名ハッシュで一貫した色）
+    ctx.fillStyle = stringToColor(label);
+    ctx.beginPath();
+    ctx.moveTo(centerX, centerY);
+    ctx.arc(centerX, centerY, radius, startAngle, endAngle);
+    ctx.closePath();
+    ctx.fill();
+
+    // ラベル（中央角度に配置）
+    const midAngle = startAngle + angle / 2;
+    const labelX = centerX + Math.cos(midAngle) * radius * 0.7;
+    const labelY = centerY + Math.sin(midAngle) * radius * 0.7;
+    const percentage = ((values[i] / total) * 100).toFixed(1);
+
+    ctx.fillStyle = '#fff';
+    ctx.textAlign = 'center';
+    ctx.textBaseline = 'middle';
+    ctx.font = 'bold 12px system-ui';
+    if (percentage > 5) {  // 5%以上の場合のみラベル表示
+      ctx.fillText(`${percentage}%`, labelX, labelY);
+    }
+
+    startAngle = endAngle;
+  });
+
+  // タイトル
+  ctx.fillStyle = '#e5e7eb'; ctx.textAlign = 'left'; ctx.textBaseline = 'alphabetic'; ctx.font = 'bold 14px system-ui';
+  ctx.fillText(`国別構成比（${targetYear}年・トップ${topN}）`, 0, -8);
+
+  // 凡例を別途表示（国名ハッシュで一貫した色）
+  setLegend(labels.map((label, i) => ({
+    label,
+    color: stringToColor(label),
+    text: `${label}: ${values[i].toLocaleString()} (${((values[i] / total) * 100).toFixed(1)}%)`,
+  })));
+}
+
+// 国別構成比（円）のホバー：扇形を角度で判定してツールチップを出す
+function countryPieHover(data, W, H) {
+  const tip = document.getElementById('status');
+  const centerX = W / 2;
+  const centerY = H / 2;
+  const radius = Math.min(W, H) * 0.35;
+  const labels = data.labels, values = data.values, total = data.total;
+  return (mx, my) => {
+    // 円の中心からの距離と角度を計算
+    const dx = mx - centerX;
+    const dy = my - centerY;
+    const dist = Math.sqrt(dx * dx + dy * dy);
+
+    if (dist <= radius) {
+      let angle = Math.atan2(dy, dx) + Math.PI / 2;  // 12時の位置を0とする
+      if (angle < 0) angle += 2 * Math.PI;
+
+      // どの扇形にホバーしているかを判定
+      let cumAngle = 0;
+      for (let i = 0; i < labels.length; i++) {
+        const segAngle = (values[i] / total) * 2 * Math.PI;
+        if (angle >= cumAngle && angle < cumAngle + segAngle) {
+          const pct = ((values[i] / total) * 100).toFixed(1);
+          tip.textContent = `${labels[i]}: ${values[i].toLocaleString()} 億円 (${pct}%)`;
+          return;
         }
+        cumAngle += segAngle;
       }
     }
-    
-    if (countryData.length === 0) {
-      ctx.fillText('選択年のデータがありません', 10, 20); ctx.restore(); return;
-    }
-    
-    // ソート処理
-    const sortBy = document.getElementById('sortBy') ? document.getElementById('sortBy').value : 'value';
-    if (sortBy === 'value') {
-      countryData.sort((a, b) => b.value - a.value);  // 値（降順）
-    } else if (sortBy === 'value_asc') {
-      countryData.sort((a, b) => a.value - b.value);  // 値（昇順）
-    } else if (sortBy === 'name') {
-      countryData.sort((a, b) => a.label.localeCompare(b.label));  // 国名（昇順）
-    } else if (sortBy === 'name_desc') {
-      countryData.sort((a, b) => b.label.localeCompare(a.label));  // 国名（降順）
+    tip.textContent = '';
+  };
+}
+
+function paintCountryBar(ctx, W, H, data) {
+  // 棒グラフ：国別ランキング（任意年のトップN）
+  if (!data.available) {
+    ctx.fillText('国別データがありません', 10, 20); return;
+  }
+  const targetYear = data.year;
+  const topN = data.top_n;
+  // 並び替え・トップN はデータ層で適用済み
+  const labels = data.labels, values = data.values;
+
+  if (labels.length === 0) {
+    ctx.fillText('選択年のデータがありません', 10, 20); return;
+  }
+
+  // スケールタイプ（リニア or ログ）
+  const scaleType = document.getElementById('scaleType') ? document.getElementById('scaleType').value : 'linear';
+
+  // Y軸のスケール
+  const maxVal = arrMax(values);
+  const minVal = arrMin(values.filter(v => v > 0));
+
+  let yScale;
+  if (scaleType === 'log') {
+    // ログスケール
+    const logMax = Math.log10(maxVal || 1);
+    const logMin = Math.log10(minVal || 0.1);
+    yScale = v => {
+      if (v <= 0) return H;
+      return H - ((Math.log10(v) - logMin) / (logMax - logMin)) * H * 0.9;
+    };
+  } else {
+    // リニアスケール
+    yScale = v => H - (v / maxVal) * H * 0.9;
+  }
+
+  // 横軸の設定
+  ctx.strokeStyle = '#1f2937'; ctx.lineWidth = 1;
+  ctx.beginPath(); ctx.moveTo(0, H); ctx.lineTo(W, H); ctx.stroke();
+  ctx.beginPath(); ctx.moveTo(0, 0); ctx.lineTo(0, H); ctx.stroke();
+
+  // Y軸の目盛り
+  ctx.fillStyle = '#94a3b8'; ctx.textAlign = 'right'; ctx.textBaseline = 'middle';
+  const ticks = 5;
+  if (scaleType === 'log') {
+    // ログスケールの目盛り
+    const logMax = Math.log10(maxVal || 1);
+    const logMin = Math.log10(minVal || 0.1);
+    for (let i = 0; i <= ticks; i++) {
+      const logVal = logMin + (i / ticks) * (logMax - logMin);
+      const v = Math.pow(10, logVal);
+      const y = yScale(v);
+      ctx.strokeStyle = '#1f2937'; ctx.beginPath(); ctx.moveTo(0, y); ctx.lineTo(W, y); ctx.stroke();
+      ctx.fillText(v < 100 ? v.toFixed(1) : v.toFixed(0), -8, y);
     }
-    
-    // トップNを取得
-    const topN = parseInt(document.getElementById('topN') ? document.getElementById('topN').value : '10', 10);
-    const displayData = countryData.slice(0, topN);
-    
-    // スケールタイプ（リニア or ログ）
-    const scaleType = document.getElementById('scaleType') ? document.getElementById('scaleType').value : 'linear';
-    
-    // Y軸のスケール
-    const maxVal = Math.max(...displayData.map(d => d.value));
-    const minVal = Math.min(...displayData.map(d => d.value).filter(v => v > 0));
-    
-    let yScale;
-    if (scaleType === 'log') {
-      // ログスケール
-      const logMax = Math.log10(maxVal || 1);
-      const logMin = Math.log10(minVal || 0.1);
-      yScale = v => {
-        if (v <= 0) return H;
-        return H - ((Math.log10(v) - logMin) / (logMax - logMin)) * H * 0.9;
-      };
-    } else {
-      // リニアスケール
-      yScale = v => H - (v / maxVal) * H * 0.9;
+  } else {
+    // リニアスケールの目盛り
+    for (let i = 0; i <= ticks; i++) {
+      const v = (i / ticks) * maxVal;
+      const y = yScale(v);
+      ctx.strokeStyle = '#1f2937'; ctx.beginPath(); ctx.moveTo(0, y); ctx.lineTo(W, y); ctx.stroke();
+      ctx.fillText(v.toFixed(0), -8, y);
     }
-    
-    // 横軸の設定
-    ctx.strokeStyle = '#1f2937'; ctx.lineWidth = 1;
-    ctx.beginPath(); ctx.moveTo(0, H); ctx.lineTo(W, H); ctx.stroke();
-    ctx.beginPath(); ctx.moveTo(0, 0); ctx.lineTo(0, H); ctx.stroke();
-    
-    // Y軸の目盛り
-    ctx.fillStyle = '#94a3b8'; ctx.textAlign = 'right'; ctx.textBaseline = 'middle';
-    const ticks = 5;
-    if (scaleType === 'log') {
-      // ログスケールの目盛り
-      const logMax = Math.log10(maxVal || 1);
-      const logMin = Math.log10(minVal || 0.1);
-      for (let i = 0; i <= ticks; i++) {
-        const logVal = logMin + (i / ticks) * (logMax - logMin);
-        const v = Math.pow(10, logVal);
-        const y = yScale(v);
-        ctx.strokeStyle = '#1f2937'; ctx.beginPath(); ctx.moveTo(0, y); ctx.lineTo(W, y); ctx.stroke();
-        ctx.fillText(v < 100 ? v.toFixed(1) : v.toFixed(0), -8, y);
-      }
-    } else {
-      // リニアスケールの目盛り
-      for (let i = 0; i <= ticks; i++) {
-        const v = (i / ticks) * maxVal;
-        const y = yScale(v);
-        ctx.strokeStyle = '#1f2937'; ctx.beginPath(); ctx.moveTo(0, y); ctx.lineTo(W, y); ctx.stroke();
-        ctx.fillText(v.toFixed(0), -8, y);
+  }
+
+  // 棒グラフを描画
+  const barW = Math.max(8, Math.min(48, Math.floor(W / (labels.length * 1.5))));
+  const gap = Math.max(8, Math.floor(barW * 0.25));
+  ctx.textAlign = 'center'; ctx.textBaseline = 'top';
+
+  const barCenters = [];
+  labels.forEach((label, i) => {
+    const x = i * (barW + gap);
+    const h = H - yScale(values[i]);
+    ctx.fillStyle = stringToColor(label);
+    ctx.fillRect(x, H - h, barW, h);
+
+    // 値を棒の上に表示
+    ctx.fillStyle = '#e5e7eb';
+    ctx.font = '10px system-ui';
+    ctx.fillText(values[i].toLocaleString(), x + barW / 2, H - h - 4);
+
+    // 国名を棒の下に表示（回転）
+    ctx.save();
+    ctx.translate(x + barW / 2, H + 8);
+    ctx.rotate(-Math.PI / 4);
+    ctx.fillStyle = '#94a3b8';
+    ctx.textAlign = 'right';
+    ctx.fillText(label.slice(0, 15), 0, 0);
+    ctx.restore();
+
+    // トレンドライン用の座標を保存
+    barCenters.push({x: x + barW / 2, y: H - h});
+  });
+
+  // トレンドライン（移動平均）
+  if (document.getElementById('showTrend') && document.getElementById('showTrend').checked && barCenters.length >= 3) {
+    const smoothed = [];
+    for (let i=0; i<barCenters.length; i++) {
+      if (i === 0) smoothed.push(barCenters[i]);
+      else if (i === barCenters.length - 1) smoothed.push(barCenters[i]);
+      else {
+        const avgY = (barCenters[i-1].y + barCenters[i].y + barCenters[i+1].y) / 3;
+        smoothed.push({x: barCenters[i].x, y: avgY});
       }
     }
-    
-    // 棒グラフを描画
-    const barW = Math.max(8, Math.min(48, Math.floor(W / (displayData.length * 1.5))));
-    const gap = Math.max(8, Math.floor(barW * 0.25));
-    ctx.textAlign = 'center'; ctx.textBaseline = 'top';
-    
-    const barCenters = [];
-    displayData.forEach((item, i) => {
-      const x = i * (barW + gap);
-      const h = H - yScale(item.value);
-      ctx.fillStyle = stringToColor(item.label);
-      ctx.fillRect(x, H - h, barW, h);
-      
-      // 値を棒の上に表示
-      ctx.fillStyle = '#e5e7eb';
-      ctx.font = '10px system-ui';
-      ctx.fillText(item.value.toLocaleString(), x + barW / 2, H - h - 4);
-      
-      // 国名を棒の下に表示（回転）
-      ctx.save();
-      ctx.translate(x + barW / 2, H + 8);
-      ctx.rotate(-Math.PI / 4);
-      ctx.fillStyle = '#94a3b8';
-      ctx.textAlign = 'right';
-      ctx.fillText(item.label.slice(0, 15), 0, 0);
-      ctx.restore();
-      
-      // トレンドライン用の座標を保存
-      barCenters.push({x: x + barW / 2, y: H - h});
+    ctx.strokeStyle = '#f59e0b'; ctx.lineWidth = 2.5; ctx.setLineDash([5, 5]); ctx.beginPath();
+    smoothed.forEach((pt, i) => {
+      if (i === 0) ctx.moveTo(pt.x, pt.y);
+      else ctx.lineTo(pt.x, pt.y);
     });
-    
-    // トレンドライン（移動平均）
-    if (document.getElementById('showTrend') && document.getElementById('showTrend').checked && barCenters.length >= 3) {
-      const smoothed = [];
-      for (let i=0; i<barCenters.length; i++) {
-        if (i === 0) smoothed.push(barCenters[i]);
-        else if (i === barCenters.length - 1) smoothed.push(barCenters[i]);
-        else {
-          const avgY = (barCenters[i-1].y + barCenters[i].y + barCenters[i+1].y) / 3;
-          smoothed.push({x: barCenters[i].x, y: avgY});
-        }
-      }
-      ctx.strokeStyle = '#f59e0b'; ctx.lineWidth = 2.5; ctx.setLineDash([5, 5]); ctx.beginPath();
-      smoothed.forEach((pt, i) => {
-        if (i === 0) ctx.moveTo(pt.x, pt.y);
-        else ctx.lineTo(pt.x, pt.y);
-      });
-      ctx.stroke();
-      ctx.setLineDash([]);
-    }
-    
-    // タイトル
-    ctx.fillStyle = '#e5e7eb'; ctx.textAlign = 'left'; ctx.textBaseline = 'alphabetic'; ctx.font = 'bold 14px system-ui';
-    ctx.fillText(`国別ランキング（${targetYear}年・トップ${topN}）`, 0, -8);
+    ctx.stroke();
+    ctx.setLineDash([]);
   }
-  ctx.restore();
+
+  // タイトル
+  ctx.fillStyle = '#e5e7eb'; ctx.textAlign = 'left'; ctx.textBaseline = 'alphabetic'; ctx.font = 'bold 14px system-ui';
+  ctx.fillText(`国別ランキング（${targetYear}年・トップ${topN}）`, 0, -8);
 }
 
 function onViewChange() {
@@ -895,7 +1589,7 @@ function onViewChange() {
   const specificControls = document.getElementById('specificControls');
   
   // キャンバスとマルチパネルコンテナの表示切り替え
-  document.getElementById('chart').style.display = isMultiPanel ? 'none' : 'block';
+  document.getElementById('chartStack').style.display = isMultiPanel ? 'none' : 'block';
   document.getElementById('multiPanelContainer').style.display = isMultiPanel ? 'block' : 'none';
   
   // すべての固有コントロールを非表示
@@ -941,7 +1635,7 @@ function onViewChange() {
     specificControls.style.display = 'none';
     
     // 地域フィルタは時系列ビューで表示
-    if (gData && gData.regions && gData.regions.available && gData.regions.available.length > 0) {
+    if (gData && gData.regions.length > 0) {
       document.getElementById('regionFilterLabel').style.display = (view === 'timeseries' || view === 'yoy_diff') ? '' : 'none';
     }
   }
@@ -949,34 +1643,130 @@ function onViewChange() {
   draw();
 }
 
+// サマリを取得する。IndexedDB に保存済みなら ETag で再検証し、変わっていなければ（304）
+// 保存済みの展開データと索引をそのまま使う（サーバはファイルを読まずに応答する）
+async function openSummary(url, key, source) {
+  const etag = await gClient.cachedTag(key);
+  const res = await fetch(url, etag ? { headers: { 'If-None-Match': etag }, cache: 'no-store' } : { cache: 'no-store' });
+  if (res.status === 304) {
+    if (await restoreDataset(key, source)) return 'cached';
+    return openSummaryFresh(url, key, source);
+  }
+  if (!res.ok) return null;
+  await loadDataset({ buffer: await res.arrayBuffer(), cache: { key, etag: res.headers.get('ETag') }, source });
+  return 'loaded';
+}
+
+async function openSummaryFresh(url, key, source) {
+  const res = await fetch(url, { cache: 'no-store' });
+  if (!res.ok) return null;
+  await loadDataset({ buffer: await res.arrayBuffer(), cache: { key, etag: res.headers.get('ETag') }, source });
+  return 'loaded';
+}
+
+// 表示状態（共有用 HTML に埋め込む。項目は share.share_state と同じ）
+function viewState() {
+  const checked = id => !!(document.getElementById(id) && document.getElementById(id).checked);
+  const valueOf = id => document.getElementById(id) ? document.getElementById(id).value : '';
+  return {
+    view: valueOf('view'),
+    measure: gSeriesPicker && gSeriesPicker.value !== '' ? gSeriesPicker.value : 0,
+    region: gRegionPicker && gRegionPicker.value !== '' ? gData.regions[gRegionPicker.value] : '',
+    year: valueOf('yearFilter'),
+    top_n: parseInt(valueOf('topN') || '10', 10),
+    sort_by: valueOf('sortBy') || 'value',
+    scale: valueOf('scaleType') || 'linear',
+    others: checked('showOthers'),
+    trend: checked('showTrend'),
+    overlay: gOverlay,
+  };
+}
+
+function applyViewState(state) {
+  const setValue = (id, v) => { if (v !== undefined && v !== null && document.getElementById(id)) document.getElementById(id).value = String(v); };
+  const setChecked = (id, v) => { if (typeof v === 'boolean' && document.getElementById(id)) document.getElementById(id).checked = v; };
+  setValue('view', state.view);
+  if (state.measure !== undefined) gSeriesPicker.select(state.measure);
+  if (state.region) {
+    const i = gData.regions.indexOf(state.region);
+    if (i >= 0) gRegionPicker.select(i);
+  }
+  setValue('topN', state.top_n);
+  updateTopNLabel();
+  setValue('sortBy', state.sort_by);
+  setValue('scaleType', state.scale);
+  setChecked('showOthers', state.others);
+  setChecked('showTrend', state.trend);
+  setChecked('overlay', state.overlay);
+  gOverlay = document.getElementById('overlay').checked;
+  updateSeriesLegend();
+  onViewChange();  // 年の選択肢はここで作られる
+  if (state.year && gData.years.includes(state.year)) {
+    setValue('yearFilter', state.year);
+    draw();
+  }
+}
+
+// 共有用 HTML（export_dashboard.py / エクスポートメニュー）に埋め込まれたデータセットを読み込む。
+// 埋め込みが無ければ null、あれば埋め込みのヘッダ {state, meta}
+async function openSharedDataset() {
+  const header = document.getElementById('investviz-share');
+  if (!header) return null;
+  const info = JSON.parse(header.textContent);
+  if (typeof DecompressionStream === 'undefined') {
+    throw new Error('このブラウザは DecompressionStream に対応していないため、共有データを開けません');
+  }
+  const text = atob(document.getElementById('investviz-share-data').textContent.trim());
+  const bytes = new Uint8Array(text.length);
+  for (let i = 0; i < text.length; i++) bytes[i] = text.charCodeAt(i);
+  const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+  await loadDataset({ buffer: await new Response(stream).arrayBuffer() });
+  return info;
+}
+
+// 共有用 HTML として開く（サーバ無し・読み取り専用）
+async function loadSharedDashboard() {
+  const info = await openSharedDataset();
+  if (!info) return false;
+  gShared = info;
+  gPerf.endpoint = null;
+  hideUploadPanel();
+  // サーバが要る操作（アップロード・CSV エクスポート）は出さない
+  document.getElementById('uploadNewBtn').style.display = 'none';
+  document.getElementById('exportBtn').style.display = 'none';
+  const generated = info.meta && info.meta.generated ? info.meta.generated.replace('T', ' ') : '';
+  document.getElementById('title').textContent = gData.title + '（共有データ・読み取り専用' + (generated ? '、' + generated + ' 時点' : '') + '）';
+  applyViewState(info.state || {});
+  return true;
+}
+
 async function loadExistingSummary() {
   try {
-    const res = await fetch('summary.json');
-    if (!res.ok) return false;
-    const summary = await res.json();
-    
-    gData = summary;
-    document.getElementById('title').textContent = (gData.title || 'MVP Summary');
-    const ms = document.getElementById('measure');
-    ms.innerHTML='';
-    (gData.series||[]).forEach((s,i)=>{ const o=document.createElement('option'); o.value=i; o.textContent=s.label||`series_${i}`; ms.appendChild(o); });
-    
-    // 地域フィルタの構築
-    const regions = (gData.regions && gData.regions.available) || [];
-    if (regions.length > 0) {
-      const rf = document.getElementById('regionFilter');
-      rf.innerHTML = '<option value="">全地域</option>';
-      regions.forEach(r => { const o = document.createElement('option'); o.value = r; o.textContent = r; rf.appendChild(o); });
-      document.getElementById('regionFilterLabel').style.display = '';
-    } else {
-      document.getElementById('regionFilterLabel').style.display = 'none';
+    // 前回のセッションがあればそれを開く（掃除などで消えていればビルドのサマリに戻る）
+    let sid = rememberedSession();
+    let opened = sid ? await openSummary(catalogUrl(sid), datasetKey(sid), seriesSource(sid)) : null;
+    if (!opened) {
+      if (sid) rememberSession('');
+      sid = '';
+      opened = await openSummary(catalogUrl(''), datasetKey(''), seriesSource(''));
+    }
+    // API が無い静的配信（serve_dashboard.py）では summary.json（全系列）をそのまま読む
+    if (!opened) {
+      opened = await openSummary('summary.json', STATIC_SUMMARY_KEY);
+      gPerf.endpoint = null;  // 計測ビーコンの受け口も無い
+    }
+    if (!opened) return false;
+    if (sid) {
+      gSessionId = sid;
+      setDownloadLinks({
+        normalized_csv: `/uploads/${sid}/normalized.csv`,
+        parse_log: `/uploads/${sid}/parse_log.json`,
+        pivot_csv: `/uploads/${sid}/pivot_year_measure.csv`,
+      });
     }
-    
-    document.getElementById('controls').style.display = 'flex';
-    document.getElementById('chartPanel').style.display = 'block';
     hideUploadPanel();
     const st = document.getElementById('uploadStatus');
-    st.textContent = '✓ 既存データを読み込みました';
+    st.textContent = opened === 'cached' ? '✓ 前回のデータを読み込みました（保存済みデータを再利用）' : '✓ 既存データを読み込みました';
     setTimeout(() => { st.textContent = ''; }, 3000);
     draw();
     return true;
@@ -986,10 +1776,22 @@ async function loadExistingSummary() {
 }
 
 window.addEventListener('load', () => {
+  gClient = new DataClient('investviz-data-layer');
+  gClient.onprogress = (done, total) => {
+    document.getElementById('status').textContent = `計算中... ${Math.round(100 * done / Math.max(1, total))}%`;
+  };
+  const chart = document.getElementById('chart');
+  chart.addEventListener('mousemove', ev => chartPointer(ev, 'hover'));
+  chart.addEventListener('click', ev => chartPointer(ev, 'click'));
+  chart.addEventListener('mouseleave', ev => chartPointer(ev, 'hover'));
+  chart.addEventListener('mousedown', ev => chartPointer(ev, 'press'));
+  chart.addEventListener('dblclick', ev => chartPointer(ev, 'reset'));
+  chart.addEventListener('wheel', ev => chartPointer(ev, 'wheel'), {passive: false});
+  window.addEventListener('mouseup', () => { if (gFrame && gFrame.release) gFrame.release(); });
   const dz = document.getElementById('drop');
   dz.addEventListener('dragover', (e)=>{ e.preventDefault(); dz.style.borderColor = '#60a5fa'; });
   dz.addEventListener('dragleave', (e)=>{ dz.style.borderColor = '#334155'; });
-  dz.addEventListener('drop', (e)=>{ e.preventDefault(); dz.style.borderColor = '#334155'; if (e.dataTransfer.files && e.dataTransfer.files[0]) uploadAndAnalyze(e.dataTransfer.files[0]); });
+  dz.addEventListener('drop', (e)=>{ e.preventDefault(); dz.style.borderColor = '#334155'; if (e.dataTransfer.files && e.dataTransfer.files.length) uploadAndAnalyze(Array.from(e.dataTransfer.files)); });
   
   // 全画面ドロップ対応（アップロードパネル非表示時でもファイルを受け付ける）
   document.addEventListener('dragover', (e)=>{ 
@@ -1001,16 +1803,36 @@ window.addEventListener('load', () => {
   });
   document.addEventListener('drop', (e)=>{ 
     e.preventDefault(); 
-    if (e.dataTransfer.files && e.dataTransfer.files[0]) {
+    if (e.dataTransfer.files && e.dataTransfer.files.length) {
       if (document.getElementById('uploader').style.display === 'none') {
         showUploadPanel();
       }
-      uploadAndAnalyze(e.dataTransfer.files[0]);
+      uploadAndAnalyze(Array.from(e.dataTransfer.files));
     }
   });
   
-  // 既存のsummary.jsonがあれば自動読み込み
-  loadExistingSummary();
+  // パフォーマンス表示（?perf=1 または Shift+P）と計測ビーコン
+  if (new URLSearchParams(location.search).get('perf') === '1') togglePerfOverlay(true);
+  document.addEventListener('keydown', (e) => {
+    const tag = e.target && e.target.tagName;
+    if (e.shiftKey && !e.ctrlKey && !e.metaKey && !e.altKey && (e.key === 'P' || e.key === 'p') && tag !== 'INPUT' && tag !== 'TEXTAREA' && tag !== 'SELECT') {
+      togglePerfOverlay();
+    }
+  });
+  if (gPerf.endpoint) {
+    setInterval(flushPerf, PERF_FLUSH_MS);
+    document.addEventListener('visibilitychange', () => { if (document.visibilityState === 'hidden') flushPerf(); });
+    window.addEventListener('pagehide', flushPerf);
+  }
+
+  // 共有用 HTML なら埋め込みデータを、そうでなければ既存の summary.json を自動読み込み
+  if (document.getElementById('investviz-share')) {
+    loadSharedDashboard().catch(e => {
+      document.getElementById('uploadStatus').textContent = '共有データを開けませんでした: ' + ((e && e.message) || e);
+    });
+  } else {
+    loadExistingSummary();
+  }
 });
   </script>
 </head>
@@ -1025,11 +1847,13 @@ window.addEventListener('load', () => {
     </div>
   </header>
   <div id="toast" class="toast"></div>
+  <div id="perfOverlay" class="perf-overlay"></div>
   <main>
     <div id="uploader" class="panel">
-      <div class="drop" id="drop">ここに CSV をドラッグ＆ドロップするか、ファイルを選択してください。</div>
+      <div class="drop" id="drop">ここに CSV（複数可）または zip をドラッグ＆ドロップするか、ファイルを選択してください。</div>
       <div style="margin-top:10px; display:flex; gap:8px; align-items:center; flex-wrap:wrap;">
-        <input type="file" id="file" accept=".csv" onchange="onSelectFile()" />
+        <input type="file" id="file" accept=".csv,.zip" multiple onchange="onSelectFile()" />
+        <button class="btn" id="cancelUpload" onclick="cancelUpload()" style="display:none;">キャンセル</button>
         <a id="downloadNormalized" href="#" class="meta" style="text-decoration:none; pointer-events:none;">normalized.csv</a>
         <a id="downloadParseLog" href="#" class="meta" style="text-decoration:none; pointer-events:none;">parse_log.json</a>
         <a id="downloadPivot" href="#" class="meta" style="text-decoration:none; pointer-events:none;">pivot_year_measure.csv</a>
@@ -1053,12 +1877,12 @@ window.addEventListener('load', () => {
               <option value="multi_panel">マルチパネル（2×2）</option>
             </select>
           </label>
-          <label id="measureLabel">系列: 
-            <select id="measure" onchange="draw()"></select>
-          </label>
-          <label id="regionFilterLabel" style="display:none;">地域: 
-            <select id="regionFilter" onchange="draw()"></select>
-          </label>
+          <div class="picker-field" id="measureLabel">系列: 
+            <div id="measure"></div>
+          </div>
+          <div class="picker-field" id="regionFilterLabel" style="display:none;">地域: 
+            <div id="regionFilter"></div>
+          </div>
           <label id="yearFilterLabel" style="display:none;">年: 
             <select id="yearFilter" onchange="draw()"></select>
           </label>
@@ -1082,7 +1906,7 @@ window.addEventListener('load', () => {
             </select>
           </label>
           <label id="scaleLabel" style="display:none;">スケール: 
-            <select id="scaleType" onchange="draw()">
+            <select id="scaleType" onchange="render()">
               <option value="linear">リニア</option>
               <option value="log">ログ</option>
             </select>
@@ -1093,7 +1917,10 @@ window.addEventListener('load', () => {
           <button class="btn" id="exportBtn" onclick="exportCurrentView()" title="現在のビュー（フィルタ適用済み）をCSVでダウンロード">📥 CSVエクスポート</button>
         </div>
       </div>
-      <canvas id="chart"></canvas>
+      <div id="chartStack">
+        <canvas id="chart"></canvas>
+        <canvas id="chartOverlay"></canvas>
+      </div>
       <div id="multiPanelContainer" style="display:none;">
         <div class="multi-panel-grid">
           <div class="panel-item">
@@ -1126,8 +1953,7 @@ window.addEventListener('load', () => {
       }
       
       const view = document.getElementById('view').value;
-      const regionFilter = document.getElementById('regionFilter');
-      const region = regionFilter && regionFilter.value ? regionFilter.value : '';
+      const region = gRegionPicker && gRegionPicker.value !== '' ? gData.regions[gRegionPicker.value] : '';
       
       // クエリパラメータを構築
       const params = new URLSearchParams();
@@ -1146,6 +1972,10 @@ window.addEventListener('load', () => {
         const topN = document.getElementById('topN') ? document.getElementById('topN').value : '10';
         params.append('top_n', topN);
         
+        // 「その他」行（円グラフ用）
+        if (view === 'country_pie' && document.getElementById('showOthers') && document.getElementById('showOthers').checked) {
+          params.append('others', '1');
+        }
         // ソート情報（棒グラフ用）
         if (view === 'country_bar') {
           const sortBy = document.getElementById('sortBy') ? document.getElementById('sortBy').value : 'value';
@@ -1212,7 +2042,9 @@ window.addEventListener('load', () => {
     function exportImage() {
       showToast('画像をエクスポート中...', 2000);
       const canvas = document.getElementById('chart');
+      const t = perfStart('export', 'image');
       canvas.toBlob((blob) => {
+        perfEnd(t, blob ? blob.size : undefined);
         const url = URL.createObjectURL(blob);
         const a = document.createElement('a');
         a.href = url;
@@ -1225,14 +2057,36 @@ window.addEventListener('load', () => {
       }, 'image/png');
     }
     
+    // 共有用 HTML（データセットと今の表示状態を埋め込んだ 1 ファイル、オフラインで開ける）
+    function exportShareHtml() {
+      const params = new URLSearchParams();
+      params.append('type', 'html');
+      params.append('state', JSON.stringify(viewState()));
+      if (gSessionId) {
+        params.append('sid', gSessionId);
+      }
+      const a = document.createElement('a');
+      a.href = `/api/export?${params.toString()}`;
+      a.download = '';
+      document.body.appendChild(a);
+      a.click();
+      document.body.removeChild(a);
+      showToast('共有用 HTML を作成しています...', 2000);
+    }
+    
     // エクスポートメニュー
     function exportMenu() {
       if (!gData) {
         alert('データがありません。CSVファイルをアップロードしてください。');
         return;
       }
+      if (gShared) {
+        // 共有用 HTML ではサーバが無いので画像だけ
+        if (confirm('画像 (PNG) をエクスポートしますか？')) exportImage();
+        return;
+      }
       
-      const choice = prompt('エクスポート種類を選択してください:\n1: 現在のビュー (CSV)\n2: 正規化データ (normalized.csv)\n3: ピボットデータ (pivot_year_measure.csv)\n4: 画像 (PNG)', '1');
+      const choice = prompt('エクスポート種類を選択してください:\\n1: 現在のビュー (CSV)\\n2: 正規化データ (normalized.csv)\\n3: ピボットデータ (pivot_year_measure.csv)\\n4: 画像 (PNG)\\n5: 共有用 HTML（オフラインで開ける 1 ファイル）', '1');
       if (!choice) return;
       
       if (choice === '1') {
@@ -1244,37 +2098,406 @@ window.addEventListener('load', () => {
         exportPivot();
       } else if (choice === '4') {
         exportImage();
+      } else if (choice === '5') {
+        exportShareHtml();
       } else {
         alert('無効な選択です');
       }
     }
     
-    document.getElementById('overlay').addEventListener('change', (e)=>{ gOverlay = e.target.checked; draw(); const legend = document.getElementById('legend'); legend.innerHTML = ''; if (gOverlay) { (gData.series||[]).forEach((s,i)=>{ const d=document.createElement('div'); d.className='item'; d.innerHTML=`<span class="swatch" style="background:${gColors[i%gColors.length]}"></span>${s.label}`; legend.appendChild(d); }); }});
+    document.getElementById('overlay').addEventListener('change', (e)=>{ gOverlay = e.target.checked; draw(); updateSeriesLegend(); });
     document.getElementById('showTrend').addEventListener('change', ()=> draw());
-    window.addEventListener('resize', ()=> draw());
+    window.addEventListener('resize', ()=> render());
   </script>
 </body>
 </html>
 """
 
+# サマリのデコーダは summary_codec と共有し、データ層（Worker のソース）と同じ script に入れる
+INDEX_HTML = INDEX_HTML.replace("/*__DATA_LAYER__*/", SUMMARY_DECODER_JS.strip() + "\n" + DATA_LAYER_JS.strip())
+INDEX_HTML = INDEX_HTML.replace("/*__DATA_CLIENT__*/", DATA_CLIENT_JS.strip())
+
+
+INDEX_ASSET = StaticAsset.from_text(INDEX_HTML)
+
 
 def write_index_html(build_dir: str) -> str:
+    """index.html を書き出す（内容が同じなら書き換えない）
+
+    サーバはメモリ上の INDEX_ASSET を配信するため、このファイルは
+    file:// での閲覧やビルド成果物としての利用向け。
+    """
     os.makedirs(build_dir, exist_ok=True)
     path = os.path.join(build_dir, "index.html")
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(INDEX_HTML)
+    try:
+        with open(path, "rb") as f:
+            if f.read() == INDEX_ASSET.body:
+                return path
+    except OSError:
+        pass
+    with open(path, "wb") as f:
+        f.write(INDEX_ASSET.body)
     return path
 
 
-class AppHandler(http.server.SimpleHTTPRequestHandler):
+# 計測ビーコン（POST /api/perf）の本文の上限
+MAX_PERF_BEACON_BYTES = 64 * 1024
+
+
+class AppHandler(CachingFileHandler):
+    # ダッシュボード HTML はメモリから配信（ETag + gzip 事前圧縮）
+    memory_assets = {"/": INDEX_ASSET, "/index.html": INDEX_ASSET}
+    # HTTP/1.1 の持続接続（全レスポンスで Content-Length を送ること）
+    protocol_version = "HTTP/1.1"
+    # 持続接続のアイドルタイムアウト（秒、serve_build_dir で設定）
+    timeout = 5.0
+    # 非同期アップロード用のジョブキュー（serve_build_dir で設定、未設定なら初回利用時に作成）
+    jobs: Optional[JobManager] = None
+    # uploads/ のライフサイクル管理（同上）
+    sessions: Optional[SessionStore] = None
+
+    # リクエスト計測（parse_request 〜 応答完了、持続接続の待ち時間は含めない）
+    _request_started: Optional[float] = None
+    _response_status: Optional[int] = None
+
+    def parse_request(self):
+        self._request_started = time.perf_counter()
+        self._response_status = None
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self._response_status = code
+        super().send_response(code, message)
+
+    def handle_one_request(self):
+        self._request_started = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self._request_started is not None and self._response_status is not None:
+                metrics.observe_request(
+                    self.path, self.command or "", self._response_status,
+                    time.perf_counter() - self._request_started,
+                )
+
+    @classmethod
+    def job_manager(cls) -> JobManager:
+        if cls.jobs is None:
+            cls.jobs = JobManager()
+        return cls.jobs
+
+    @classmethod
+    def session_store(cls) -> SessionStore:
+        if cls.sessions is None:
+            cls.sessions = SessionStore()
+        return cls.sessions
+
     def do_GET(self):
         # エクスポートAPIの処理
         if self.path.startswith("/api/export"):
             self.handle_export()
             return
+        # ジョブ状態
+        if self.path.startswith("/api/jobs/"):
+            self.handle_job_status()
+            return
+        if self.path.split("?", 1)[0] == "/metrics":
+            body = metrics.render()
+            self.send_response(200)
+            self.send_header('Content-Type', metrics.CONTENT_TYPE)
+            self.send_header('Cache-Control', 'no-store')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path.split("?", 1)[0] == "/api/summary":
+            self.handle_summary()
+            return
+        if self.path.split("?", 1)[0] == "/api/series":
+            self.handle_series()
+            return
+        if self.path.split("?", 1)[0] == "/api/query":
+            self.handle_query()
+            return
+        if self.path.split("?", 1)[0] == "/api/sessions":
+            # セッション ID は成果物の URL そのものなので一覧は返さず、使用量の集計だけを返す
+            self.send_json(200, {"usage": self.session_store().usage()})
+            return
+        if self.path.startswith("/api/sessions/"):
+            self.handle_session_info()
+            return
         # 通常のファイル提供
         super().do_GET()
+
+    def send_head(self):
+        # セッション成果物へのアクセス（GET・HEAD、304 や Range も含む）は最終アクセス時刻を更新
+        url_path = urlsplit(self.path).path
+        if url_path.startswith("/uploads/"):
+            self.session_store().touch(url_path[len("/uploads/"):].split("/", 1)[0])
+        return super().send_head()
+
+    def handle_session_info(self) -> None:
+        """GET /api/sessions/<sid> — ID を知っているセッションのサイズ・最終アクセス・ピン留め"""
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        sid = parts[2] if len(parts) == 3 else ""
+        info = self.session_store().info(sid) if self.session_store().exists(sid) else None
+        if info is None:
+            self.send_json(404, {"error": "session not found"})
+            return
+        self.send_json(200, info.to_dict())
+
+    def handle_session_pin(self, pinned: bool) -> None:
+        """POST/DELETE /api/sessions/<sid>/pin — ピン留めされたセッションは掃除対象外"""
+        from urllib.parse import urlparse
+        parts = urlparse(self.path).path.strip("/").split("/")
+        sid = parts[2] if len(parts) == 4 else ""
+        if not self.session_store().pin(sid, pinned):
+            self.send_json(404, {"error": "session not found"})
+            return
+        info = self.session_store().info(sid)
+        self.send_json(200, info.to_dict() if info else {"session_id": sid, "pinned": pinned})
+
+    def handle_perf_beacon(self) -> None:
+        """POST /api/perf — ダッシュボードの計測ビーコンを /metrics のヒストグラムに足す"""
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length <= 0 or length > MAX_PERF_BEACON_BYTES:
+            self.close_connection = True
+            self.send_json(413 if length > MAX_PERF_BEACON_BYTES else 400, {"error": "invalid beacon size"})
+            return
+        try:
+            metrics.observe_client_beacon(json.loads(self.rfile.read(length)))
+        except ValueError:
+            self.send_json(400, {"error": "invalid beacon"})
+            return
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_DELETE(self):
+        if self.path.startswith("/api/sessions/") and self.path.rstrip("/").endswith("/pin"):
+            self.handle_session_pin(False)
+            return
+        if not self.path.startswith("/api/jobs/"):
+            self.send_error(404, "Not Found")
+            return
+        job = self.job_manager().cancel(self._job_id_from_path())
+        if job is None:
+            self.send_json(404, {"error": "job not found"})
+            return
+        self.send_json(200, job.to_dict())
+
+    def _job_id_from_path(self) -> str:
+        from urllib.parse import urlparse
+        return urlparse(self.path).path[len("/api/jobs/"):].strip("/")
+
+    def handle_job_status(self):
+        """非同期アップロードの進捗（stage/percent/timings）を返す"""
+        job = self.job_manager().get(self._job_id_from_path())
+        if job is None:
+            self.send_json(404, {"error": "job not found"})
+            return
+        self.send_json(200, job.to_dict())
+
+    def send_json(
+        self,
+        status: int,
+        payload,
+        headers: Optional[Dict[str, str]] = None,
+        cache_control: str = 'no-store',
+    ) -> None:
+        """JSON レスポンスを返す（payload は dict またはエンコード済みバイト列）"""
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Cache-Control', cache_control)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     
+    def _summary_stat(self, sid: str):
+        """sid（省略時はビルド）の summary.json のパスと stat。見つからなければ (None, None)"""
+        if sid:
+            path = session_summary_path(sid) if is_session_id(sid) else None
+        else:
+            path = SUMMARY_FILE
+        try:
+            st = os.stat(path) if path else None
+        except OSError:
+            st = None
+        if st is None:
+            return None, None
+        if sid:
+            self.session_store().touch(sid)
+        return path, st
+
+    def _send_not_modified(self, etag: str) -> bool:
+        """If-None-Match が一致すれば 304 を返す"""
+        if not etag_matches(self.headers.get('If-None-Match'), etag):
+            return False
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        return True
+
+    def handle_summary(self):
+        """GET /api/summary?sid=&width= — 描画幅に合わせて長い系列を LTTB で間引いたサマリ
+
+        width を省略するか full=1 なら全解像度のまま返す（sid 省略時はビルドの summary.json）。
+        catalog=1 なら系列の値を除いたカタログを返す（値は /api/series で必要な分だけ取る）。
+        ETag は summary.json の mtime・サイズと間引き幅から作り、If-None-Match が一致すれば
+        ファイルを読まずに 304 を返す（ダッシュボードが IndexedDB の保存データを再検証する）。
+        """
+        from urllib.parse import urlparse, parse_qs
+        params = parse_qs(urlparse(self.path).query)
+        path, st = self._summary_stat(params.get('sid', [''])[0])
+        if st is None:
+            self.send_json(404, {"error": "summary not found"})
+            return
+        if params.get('catalog', [''])[0] in ('1', 'true'):
+            etag = file_etag(st)[:-1] + '-catalog"'
+            if self._send_not_modified(etag):
+                return
+            try:
+                body = SUMMARIES.derived(path, (st.st_mtime_ns, st.st_size), 'catalog', catalog_bytes)
+            except (OSError, ValueError):
+                self.send_json(404, {"error": "summary not found"})
+                return
+            self.send_json(200, body, {'ETag': etag}, cache_control='no-cache')
+            return
+        width = params.get('width', [''])[0]
+        full = not width.isdigit() or int(width) <= 0 or params.get('full', [''])[0] in ('1', 'true')
+        etag = file_etag(st)[:-1] + ('-full"' if full else f'-w{int(width)}"')
+        if self._send_not_modified(etag):
+            return
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            self.send_json(404, {"error": "summary not found"})
+            return
+        headers = {'ETag': etag}
+        if full:
+            self.send_json(200, raw, headers, cache_control='no-cache')
+            return
+        summary = downsample_summary(loads_summary(raw), int(width))
+        if not summary_is_downsampled(summary):
+            # 間引く系列が無ければコンパクト形式のまま返す
+            self.send_json(200, raw, headers, cache_control='no-cache')
+            return
+        try:
+            body = dumps_summary(summary)
+        except ValueError:
+            # 系列の長さが揃っていないサマリはコンパクト形式にできないので従来形式で返す
+            body = json.dumps(summary, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.send_json(200, body, headers, cache_control='no-cache')
+
+    def handle_series(self):
+        """GET /api/series?sid=&width=&derive=&keys=series:0,regions:3 — カタログで選んだ系列の値をまとめて返す
+
+        width を指定すると series / regions の系列を /api/summary と同じく LTTB で間引く。
+        derive（level / yoy）を指定すると、間引く前に前年差・3 点移動平均・前年の値を計算して付ける。
+        展開済みのサマリはメモリに保持し、リクエストごとに summary.json を読み直さない。
+        """
+        from urllib.parse import urlparse, parse_qs
+        params = parse_qs(urlparse(self.path).query)
+        path, st = self._summary_stat(params.get('sid', [''])[0])
+        if st is None:
+            self.send_json(404, {"error": "summary not found"})
+            return
+        width = params.get('width', [''])[0]
+        width_px = int(width) if width.isdigit() and int(width) > 0 else None
+        try:
+            keys = parse_series_keys(params.get('keys', [''])[0])
+        except SeriesKeyError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        derive = params.get('derive', [''])[0] or None
+        if derive is not None and derive not in SERIES_DERIVES:
+            self.send_json(400, {"error": f"invalid derive: {derive}"})
+            return
+        digest = hashlib.sha1(','.join(f'{b}:{i}' for b, i in keys).encode('ascii')).hexdigest()[:12]
+        etag = file_etag(st)[:-1] + f'-w{width_px or 0}-{derive or "raw"}-{digest}"'
+        if self._send_not_modified(etag):
+            return
+        try:
+            summary = SUMMARIES.get(path, (st.st_mtime_ns, st.st_size))
+            series = select_series(summary, keys, width_px, derive)
+        except SeriesKeyError as e:
+            self.send_json(404, {"error": str(e)})
+            return
+        except (OSError, ValueError):
+            self.send_json(404, {"error": "summary not found"})
+            return
+        body = json.dumps({"series": series}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.send_json(200, body, {'ETag': etag}, cache_control='no-cache')
+
+    def handle_query(self):
+        """GET /api/query — セッションの正規化データを絞り込み・集計して列指向 JSON で返す
+
+        sid, side, metric, measure, region, level（複数指定可）, year_from, year_to,
+        group_by（カンマ区切り）, agg（sum/mean/min/max/count）, sort, limit。
+        width を指定すると year でグループ化した系列を LTTB で間引き、value_min/value_max を付ける。
+        catalog=1 で利用可能な次元値の一覧を返す。
+        """
+        from urllib.parse import urlparse, parse_qs
+        params = parse_qs(urlparse(self.path).query)
+        sid = params.get('sid', [''])[0]
+        norm_path = session_normalized_path(sid)
+        if norm_path is None:
+            self.send_json(404, {"error": "No data available. Please upload a file first."})
+            return
+        if sid:
+            self.session_store().touch(sid)
+        try:
+            spec = QuerySpec.from_params(params)
+        except QueryError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        dataset = DATASETS.get(norm_path)
+        if params.get('catalog', [''])[0] in ('1', 'true'):
+            result = dataset.catalog()
+        else:
+            result = dataset.query(spec)
+        body = json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.send_json(200, body)
+
+    def handle_share_export(self, params) -> None:
+        """GET /api/export?type=html&sid=&state= — データセットと表示状態を埋め込んだ単一 HTML
+
+        state はダッシュボードの表示状態の JSON（share.share_state の項目）。
+        圧縮済みのデータは summary.json と同じ寿命でメモし、状態だけを差し替えて返す。
+        """
+        sid = params.get('sid', [''])[0]
+        path, st = self._summary_stat(sid)
+        if st is None:
+            self.send_json(404, {"error": "summary not found"})
+            return
+        try:
+            state = share_state(json.loads(params.get('state', ['{}'])[0] or '{}'))
+        except ValueError:
+            self.send_json(400, {"error": "invalid state"})
+            return
+        try:
+            payload = SUMMARIES.derived(path, (st.st_mtime_ns, st.st_size), 'share', share_payload)
+        except (OSError, ValueError):
+            self.send_json(404, {"error": "summary not found"})
+            return
+        body = share_html(payload, state, summary_bytes=st.st_size)
+        filename = 'investviz_share_' + time.strftime('%Y%m%d_%H%M%S') + '.html'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def handle_export(self):
         """フィルタ適用済みCSVエクスポート"""
         try:
@@ -1286,6 +2509,10 @@ class AppHandler(http.server.SimpleHTTPRequestHandler):
             parsed = urlparse(self.path)
             params = parse_qs(parsed.query)
             
+            if params.get('type', [''])[0] == 'html':
+                self.handle_share_export(params)
+                return
+
             # パラメータを取得
             region = params.get('region', [''])[0]
             year_from = params.get('year_from', [''])[0]
@@ -1297,101 +2524,25 @@ class AppHandler(http.server.SimpleHTTPRequestHandler):
             sort_by = params.get('sort_by', ['value'])[0]  # ソート順
             
             # normalized.csvを読み込み（セッション対応）
-            if sid:
-                # セッションIDが指定されている場合は uploads/<sid>/normalized.csv を使用
-                norm_path = os.path.join('uploads', sid, 'normalized.csv')
-            else:
-                # セッションIDがない場合は既定パス（後方互換性）
-                norm_path = 'normalized.csv'
-                if not os.path.exists(norm_path):
-                    norm_path = 'build/normalized.csv'
-            
-            if not os.path.exists(norm_path):
+            norm_path = session_normalized_path(sid)
+            if norm_path is None:
                 self.send_error(404, "No data available. Please upload a file first.")
                 return
             
             # ビュー種別に応じた処理
             if view in ['country_pie', 'country_bar']:
-                # 国別ビュー用の特別処理（集計済みデータを生成）
-                from mof_investviz.normalize import get_region_level
-                
-                # 年フィルタ
+                # 国別ビュー：事前計算済みの年別ランキング表を引いて並べ替え・切り出しのみ行う
                 target_year = year or year_to or None
-                
-                # データを集計
-                country_data = {}
-                with open(norm_path, 'r', encoding='utf-8') as f:
-                    reader = csv_module.DictReader(f)
-                    for row in reader:
-                        segment_region = row.get('segment_region', '')
-                        if not segment_region:
-                            continue
-                        
-                        # 国レベルのみを対象
-                        level = get_region_level(segment_region)
-                        if level != 'country':
-                            continue
-                        
-                        # 年フィルタ
-                        if target_year:
-                            try:
-                                row_year = int(row.get('year', 0) or 0)
-                                if row_year != int(target_year):
-                                    continue
-                            except (ValueError, TypeError):
-                                continue
-                        
-                        # 集計
-                        val = float(row.get('value_100m_yen', 0) or 0)
-                        if segment_region not in country_data:
-                            country_data[segment_region] = 0
-                        country_data[segment_region] += val
-                
-                # ソート
-                items = list(country_data.items())
-                if sort_by == 'value':
-                    items.sort(key=lambda x: x[1], reverse=True)
-                elif sort_by == 'value_asc':
-                    items.sort(key=lambda x: x[1])
-                elif sort_by == 'name':
-                    items.sort(key=lambda x: x[0])
-                elif sort_by == 'name_desc':
-                    items.sort(key=lambda x: x[0], reverse=True)
-                
-                # トップN
+                rankings = load_country_rankings(norm_path)
+                ranking = rankings.get(target_year.strip() if target_year else RANKINGS_ALL_YEARS)
                 try:
                     n = int(top_n)
-                    items = items[:n]
                 except (ValueError, TypeError):
-                    pass
-                
-                # CSV用の行を生成
-                filtered_rows = [
-                    {'country': country, 'value_100m_yen': value, 'rank': i+1}
-                    for i, (country, value) in enumerate(items)
-                ]
+                    n = None
+                others = params.get('others', [''])[0] in ('1', 'true')
+                filtered_rows = slice_country_ranking(ranking, n, sort_by, others=others) if ranking else []
             else:
-                # 通常のビュー用のフィルタ処理
-                filtered_rows = []
-                with open(norm_path, 'r', encoding='utf-8') as f:
-                    reader = csv_module.DictReader(f)
-                    for row in reader:
-                        # 地域フィルタ
-                        if region and row.get('segment_region', '') != region:
-                            continue
-                        
-                        # 年範囲フィルタ
-                        if year_from or year_to:
-                            try:
-                                row_year = int(row.get('year', 0) or 0)
-                                if year_from and row_year < int(year_from):
-                                    continue
-                                if year_to and row_year > int(year_to):
-                                    continue
-                            except (ValueError, TypeError):
-                                continue
-                        
-                        filtered_rows.append(row)
+                filtered_rows = self.select_export_rows(norm_path, region, year_from, year_to)
             
             if not filtered_rows:
                 self.send_error(404, "No data matches the specified filters.")
@@ -1458,7 +2609,10 @@ class AppHandler(http.server.SimpleHTTPRequestHandler):
             body = output.getvalue()
             self.send_response(200)
             self.send_header('Content-Type', 'text/csv; charset=utf-8')
-            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+            # 日本語の地域名を含むため RFC 5987 形式（filename*）も付ける（filename は ASCII のみ）
+            from urllib.parse import quote
+            ascii_name = filename.encode('ascii', 'replace').decode('ascii').replace('?', '_')
+            self.send_header('Content-Disposition', f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}")
             self.send_header('Content-Length', str(len(body)))
             self.end_headers()
             self.wfile.write(body)
@@ -1473,95 +2627,198 @@ class AppHandler(http.server.SimpleHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(msg)
     
+    def select_export_rows(self, norm_path, region, year_from, year_to):
+        """通常ビューのエクスポート行を地域・年範囲で絞り込む
+
+        SQLite 版 → ゾーンマップ索引 → CSV 全件走査 の順に使えるものを使う（結果はどれも同じ）。
+        年が空の行は 0 年として比較する。
+        """
+        try:
+            y_from = int(year_from) if year_from else None
+            y_to = int(year_to) if year_to else None
+        except ValueError:
+            return []
+        db_path = sqlstore.db_path_for(norm_path)
+        if os.path.isfile(db_path):
+            _, rows = sqlstore.select_rows(db_path, region=region, year_from=y_from, year_to=y_to)
+            return rows
+        # ゾーンマップがあれば一致しうるブロックだけを読む
+        rows = zonemap.select_rows(norm_path, region=region, year_from=y_from, year_to=y_to)
+        if rows is not None:
+            return rows
+        filtered_rows = []
+        with open(norm_path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                if region and row.get('segment_region', '') != region:
+                    continue
+                if y_from is not None or y_to is not None:
+                    try:
+                        row_year = int(row.get('year', 0) or 0)
+                    except (ValueError, TypeError):
+                        continue
+                    if y_from is not None and row_year < y_from:
+                        continue
+                    if y_to is not None and row_year > y_to:
+                        continue
+                filtered_rows.append(row)
+        return filtered_rows
+
+    def read_upload_form(self):
+        """multipart/form-data の file フィールド（複数可）を [(filename, data), ...] で返す
+
+        zip は中の CSV に展開する。不正な場合はエラー応答して None。
+        """
+        ctype, pdict = cgi.parse_header(self.headers.get('content-type', ''))
+        if ctype != 'multipart/form-data':
+            self.close_connection = True
+            self.send_error(400, "Expected multipart/form-data")
+            return None
+        pdict['boundary'] = bytes(pdict['boundary'], 'utf-8')
+        pdict['CONTENT-LENGTH'] = int(self.headers.get('content-length', '0'))
+        form = cgi.FieldStorage(fp=self.rfile, headers=self.headers, environ={'REQUEST_METHOD':'POST', 'CONTENT_TYPE': self.headers.get('content-type')})
+        if 'file' not in form:
+            self.send_error(400, "file field missing")
+            return None
+        items = form['file'] if isinstance(form['file'], list) else [form['file']]
+        files = []
+        for item in items:
+            data = item.file.read() if getattr(item, 'file', None) is not None else item.value
+            files.append((item.filename or 'uploaded.csv', data))
+        try:
+            return expand_upload(files)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return None
+
     def do_POST(self):
-        if self.path != "/api/upload":
+        from urllib.parse import urlparse, parse_qs
+        parsed = urlparse(self.path)
+        if parsed.path.startswith("/api/sessions/") and parsed.path.rstrip("/").endswith("/pin"):
+            self.close_connection = True
+            self.handle_session_pin(True)
+            return
+        if parsed.path == "/api/perf":
+            self.handle_perf_beacon()
+            return
+        if parsed.path != "/api/upload":
+            # 本文を読まずに応答するので接続は再利用しない
+            self.close_connection = True
             self.send_error(404, "Not Found")
             return
+        params = parse_qs(parsed.query)
         try:
-            ctype, pdict = cgi.parse_header(self.headers.get('content-type', ''))
-            if ctype != 'multipart/form-data':
-                self.send_error(400, "Expected multipart/form-data")
+            files = self.read_upload_form()
+            if files is None:
                 return
-            pdict['boundary'] = bytes(pdict['boundary'], 'utf-8')
-            pdict['CONTENT-LENGTH'] = int(self.headers.get('content-length', '0'))
-            form = cgi.FieldStorage(fp=self.rfile, headers=self.headers, environ={'REQUEST_METHOD':'POST', 'CONTENT_TYPE': self.headers.get('content-type')})
-            if 'file' not in form:
-                self.send_error(400, "file field missing")
+            if params.get('async', [''])[0] in ('1', 'true'):
+                # ジョブIDを即時に返し、正規化はワーカープールで実行
+                try:
+                    job = self.job_manager().submit_upload(files)
+                except JobQueueFull:
+                    self.send_json(503, {"error": "upload queue is full"}, {'Retry-After': '5'})
+                    return
+                self.send_json(202, {**job.to_dict(), "status_url": f"/api/jobs/{job.id}"})
                 return
-            item = form['file']
-            data = item.file.read() if hasattr(item, 'file') else item.value
-            sid = str(uuid.uuid4())
-            up_dir = os.path.join('uploads', sid)
-            os.makedirs(up_dir, exist_ok=True)
-            in_path = os.path.join(up_dir, item.filename or 'uploaded.csv')
-            with open(in_path, 'wb') as f:
-                f.write(data)
-
-            res = normalize_file(in_path)
-            write_csv(os.path.join(up_dir, 'normalized.csv'), res.rows, SCHEMA_HEADERS)
-            # Build a simple pivot: year x measure (sum of values)
-            # Collect years and measures
-            pivot_map = {}
-            measures = set()
-            for r in res.rows:
-                y = r.get('year')
-                if y is None:
-                    continue
-                m = str(r.get('measure'))
-                v = float(r.get('value_100m_yen') or 0.0)
-                measures.add(m)
-                d = pivot_map.setdefault(int(y), {})
-                d[m] = d.get(m, 0.0) + v
-            measures_sorted = sorted(measures)
-            pivot_headers = ['year'] + measures_sorted
-            pivot_rows = []
-            for y in sorted(pivot_map.keys()):
-                row = {'year': y}
-                row.update({m: pivot_map[y].get(m, 0.0) for m in measures_sorted})
-                pivot_rows.append(row)
-            write_csv(os.path.join(up_dir, 'pivot_year_measure.csv'), pivot_rows, pivot_headers)
-            summary = build_summary_multi_measure(res.rows)
-            with open(os.path.join(up_dir, 'summary.json'), 'w', encoding='utf-8') as f:
-                json.dump(summary, f, ensure_ascii=False, indent=2)
-            parse_log = {"pipeline": "upload", "inputs": [{
-                "path": res.meta.get("path"),
-                "encoding": res.meta.get("encoding"),
-                "delimiter": res.meta.get("delimiter"),
-                "header_rows": res.meta.get("header_rows"),
-                "headers": res.headers,
-                "unit_detected": res.meta.get("unit_detected"),
-                "scale_factor": res.meta.get("scale_factor"),
-                "side": res.meta.get("side"),
-                "metric": res.meta.get("metric"),
-                "stats": res.stats,
-            }], **schema_meta()}
-            with open(os.path.join(up_dir, 'parse_log.json'), 'w', encoding='utf-8') as f:
-                json.dump(parse_log, f, ensure_ascii=False, indent=2)
-            resp = {"summary": summary, "links": {"normalized_csv": f"/uploads/{sid}/normalized.csv", "parse_log": f"/uploads/{sid}/parse_log.json", "pivot_csv": f"/uploads/{sid}/pivot_year_measure.csv"}}
-            body = json.dumps(resp).encode('utf-8')
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
-            self.send_header('Cache-Control', 'no-store')
-            self.send_header('Content-Length', str(len(body)))
-            self.end_headers()
-            self.wfile.write(body)
+            # 同一内容（＋正規化/辞書バージョン）の再アップロードは既存セッションを再利用
+            sid, summary_bytes, cached = self.job_manager().create_session(files)
+            if params.get('summary', [''])[0] == 'catalog':
+                # 系列の値を除いたカタログを埋め込む（値はダッシュボードが /api/series で取る）
+                path = session_summary_path(sid)
+                st = os.stat(path)
+                summary_bytes = SUMMARIES.derived(path, (st.st_mtime_ns, st.st_size), 'catalog', catalog_bytes)
+            # summary.json は再パースせずにそのまま埋め込む
+            body = b''.join([
+                b'{"summary": ', summary_bytes,
+                b', "links": ', json.dumps(session_links(sid)).encode('utf-8'),
+                b', "session_id": ', json.dumps(sid).encode('utf-8'),
+                b', "cached": ', b'true' if cached else b'false',
+                b'}',
+            ])
+            self.send_json(200, body)
         except Exception as e:
-            msg = {"error": str(e)}
-            body = json.dumps(msg).encode('utf-8')
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
-            self.send_header('Content-Length', str(len(body)))
-            self.end_headers()
-            self.wfile.write(body)
+            self.send_json(500, {"error": str(e)})
+
+
+def register_server_metrics(httpd) -> None:
+    """サーバ状態（セッション・ディスク使用量・キュー深さ等）を読むゲージを登録する"""
+    reg = metrics.REGISTRY
+    # usage() は uploads/ を走査するので、1 回のスクレイプで 3 つのゲージが共有する
+    usage = reg.per_scrape(lambda: AppHandler.session_store().usage())
+    reg.gauge("investviz_sessions_active", "Upload sessions on disk.", lambda: usage()["sessions"])
+    reg.gauge("investviz_sessions_pinned", "Pinned upload sessions.", lambda: usage()["pinned"])
+    reg.gauge("investviz_uploads_disk_bytes", "Disk usage of the uploads directory.", lambda: usage()["bytes"])
+    reg.gauge("investviz_sessions_evicted_total", "Sessions removed by the sweeper.",
+              lambda: AppHandler.session_store().evicted, kind="counter")
+    reg.gauge("investviz_jobs_pending", "Upload jobs queued or running.", lambda: AppHandler.job_manager().pending_count())
+    reg.gauge("investviz_query_dataset_cache_total", "In-memory query dataset cache lookups.",
+              lambda: {"hit": DATASETS.hits, "miss": DATASETS.misses}, ("result",), kind="counter")
+    reg.gauge("investviz_summary_cache_total", "In-memory decoded summary cache lookups (/api/series).",
+              lambda: {"hit": SUMMARIES.hits, "miss": SUMMARIES.misses}, ("result",), kind="counter")
+    if hasattr(httpd, "queue_depth"):
+        reg.gauge("investviz_http_queue_depth", "Connections waiting for an HTTP worker.", lambda: httpd.queue_depth)
+        reg.gauge("investviz_http_busy_workers", "HTTP workers currently handling a connection.", lambda: httpd.busy_workers)
+        reg.gauge("investviz_http_workers", "Size of the HTTP worker pool.", lambda: httpd.workers)
+        reg.gauge("investviz_http_rejected_total", "Connections rejected with 503 because the queue was full.",
+                  lambda: httpd.rejected, kind="counter")
+
 
+def serve_build_dir(
+    build_dir: str,
+    host: str = "0.0.0.0",
+    port: int = 8000,
+    *,
+    job_workers: int = 2,
+    processes: Optional[int] = None,
+    server_mode: str = "pool",
+    http_workers: int = 32,
+    http_queue: int = 128,
+    idle_timeout: float = 5.0,
+    session_ttl: Optional[float] = 7 * 86400,
+    uploads_quota: Optional[int] = 2 * 1024 ** 3,
+    max_sessions: Optional[int] = 1000,
+    sweep_interval: float = 600.0,
+    sqlite: bool = False,
+    secret_path: Optional[str] = None,
+) -> None:
+    """build_dir を配信する
 
-def serve_build_dir(build_dir: str, host: str = "0.0.0.0", port: int = 8000) -> None:
+    processes=0 で正規化をリクエストスレッド内で実行する。
+    server_mode="pool" は固定ワーカー数＋上限付きキュー（満杯時 503）、
+    "threading" は接続ごとにスレッドを生成する従来方式。
+    uploads/ は TTL・容量・件数の上限でバックグラウンド掃除する（None で無制限）。
+    sqlite=True でセッションごとに normalized.sqlite を作り、エクスポートの絞り込みを SQL で行う。
+    secret_path はセッション ID の秘密鍵。配信されないよう build_dir の外に置く
+    （省略時は build_dir と同じ階層の .<build_dir 名>.session-secret）。
+    """
+    build_dir = os.path.abspath(build_dir)
+    secret_path = os.path.abspath(secret_path or default_secret_path(os.path.join(build_dir, UPLOADS_DIR)))
+    if secret_path == build_dir or secret_path.startswith(build_dir + os.sep):
+        raise ValueError(f"session secret must be outside the served directory: {secret_path}")
     os.chdir(build_dir)
-    class ThreadingHTTPServer(socketserver.ThreadingTCPServer):
-        allow_reuse_address = True
-    with ThreadingHTTPServer((host, port), AppHandler) as httpd:
-        print(f"Serving {build_dir} at http://{host}:{port}")
+    if remove_legacy_secret():
+        print(f"Removed the old session secret from {UPLOADS_DIR}/ (it was reachable over HTTP)")
+    AppHandler.sessions = SessionStore(
+        ttl=session_ttl, quota_bytes=uploads_quota,
+        max_sessions=max_sessions, sweep_interval=sweep_interval,
+    )
+    AppHandler.sessions.start_sweeper()
+    if processes is None:
+        processes = min(4, os.cpu_count() or 1)
+    pool = start_process_pool(processes) if processes > 0 else None
+    AppHandler.jobs = JobManager(
+        workers=max(job_workers, processes), process_pool=pool, sqlite=sqlite, secret_path=secret_path,
+    )
+    AppHandler.timeout = idle_timeout
+    with make_server(
+        (host, port), AppHandler,
+        mode=server_mode, workers=http_workers, queue_size=http_queue, idle_timeout=idle_timeout,
+    ) as httpd:
+        register_server_metrics(httpd)
+        print(f"Serving {build_dir} at http://{host}:{port} ({server_mode})")
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
             pass
+        finally:
+            AppHandler.jobs.shutdown()
+            AppHandler.sessions.stop()
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# normalized.csv の横に置くゾーンマップ索引（CSV の形式自体は変えない）
+INDEX_SUFFIX = ".zmap.json"
+INDEX_VERSION = 1
+# 1 ブロックあたりの行数
+BLOCK_ROWS = 512
+# 書き出し時の並び順（地域ごとに連続し、地域内は年順になる）
+SORT_KEY = ("segment_region", "year")
+
+
+def index_path_for(csv_path: str) -> str:
+    return csv_path + INDEX_SUFFIX
+
+
+def _year_of(value: object) -> int:
+    # /api/export と同じく、空・不正な年は 0 年として比較する
+    try:
+        return int(value or 0)  # type: ignore[arg-type]
+    except (TypeError, ValueError):
+        return 0
+
+
+def sort_rows(rows: List[Dict[str, object]]) -> None:
+    """(segment_region, year) の順に並べ替える（同順位は元の順序を保つ）"""
+    rows.sort(key=lambda r: (str(r.get("segment_region") or ""), _year_of(r.get("year"))))
+
+
+class _Dictionary:
+    def __init__(self) -> None:
+        self.items: List[str] = []
+        self._ids: Dict[str, int] = {}
+
+    def id(self, value: str) -> int:
+        i = self._ids.get(value)
+        if i is None:
+            i = self._ids[value] = len(self.items)
+            self.items.append(value)
+        return i
+
+
+def write_csv_with_zonemap(
+    path: str,
+    rows: Iterable[Dict[str, object]],
+    headers: List[str],
+    block_rows: int = BLOCK_ROWS,
+) -> str:
+    """io.write_csv と同じ CSV を書き、ブロックごとのゾーンマップ索引を横に書き出す
+
+    索引にはブロックのバイト範囲・行数・年の最小/最大・含まれる地域と系列を記録する。
+    rows は呼び出し側で sort_rows 済みであること（並んでいないと索引の絞り込みが効きにくい）。
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    regions = _Dictionary()
+    measures = _Dictionary()
+    blocks: List[Dict[str, object]] = []
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=headers)
+    with open(path, "wb") as f:
+        writer.writeheader()
+        f.write(buf.getvalue().encode("utf-8"))
+        offset = f.tell()
+        header_end = offset
+
+        def flush(block: Dict[str, object]) -> None:
+            nonlocal offset
+            data = buf.getvalue().encode("utf-8")
+            f.write(data)
+            block["offset"] = offset
+            block["length"] = len(data)
+            block["regions"] = sorted(block["regions"])  # type: ignore[arg-type]
+            block["measures"] = sorted(block["measures"])  # type: ignore[arg-type]
+            blocks.append(block)
+            offset += len(data)
+
+        block: Optional[Dict[str, object]] = None
+        for row in rows:
+            if block is None:
+                buf.seek(0)
+                buf.truncate()
+                block = {"rows": 0, "year_min": None, "year_max": None, "regions": set(), "measures": set()}
+            writer.writerow({k: row.get(k, "") for k in headers})
+            y = _year_of(row.get("year"))
+            block["rows"] += 1  # type: ignore[operator]
+            if block["year_min"] is None or y < block["year_min"]:  # type: ignore[operator]
+                block["year_min"] = y
+            if block["year_max"] is None or y > block["year_max"]:  # type: ignore[operator]
+                block["year_max"] = y
+            block["regions"].add(regions.id(str(row.get("segment_region") or "")))  # type: ignore[union-attr]
+            block["measures"].add(measures.id(str(row.get("measure") or "")))  # type: ignore[union-attr]
+            if block["rows"] >= block_rows:
+                flush(block)
+                block = None
+        if block is not None:
+            flush(block)
+    index = {
+        "version": INDEX_VERSION,
+        "csv_size": os.path.getsize(path),
+        "headers": headers,
+        "header_end": header_end,
+        "sort": list(SORT_KEY),
+        "regions": regions.items,
+        "measures": measures.items,
+        "blocks": blocks,
+    }
+    index_path = index_path_for(path)
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+    return index_path
+
+
+def load_zonemap(csv_path: str) -> Optional[Dict[str, object]]:
+    """CSV に対応する索引を読む（無い・古い・CSV と合わない場合は None）"""
+    index_path = index_path_for(csv_path)
+    try:
+        if os.path.getmtime(index_path) < os.path.getmtime(csv_path):
+            return None
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != INDEX_VERSION or index.get("csv_size") != os.path.getsize(csv_path):
+        return None
+    return index
+
+
+def matching_blocks(
+    index: Dict[str, object],
+    *,
+    region: str = "",
+    measure: str = "",
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+) -> List[Dict[str, object]]:
+    """条件に一致する行を含みうるブロックだけを返す"""
+    region_id = measure_id = None
+    if region:
+        if region not in index["regions"]:  # type: ignore[operator]
+            return []
+        region_id = index["regions"].index(region)  # type: ignore[union-attr]
+    if measure:
+        if measure not in index["measures"]:  # type: ignore[operator]
+            return []
+        measure_id = index["measures"].index(measure)  # type: ignore[union-attr]
+    out = []
+    for block in index["blocks"]:  # type: ignore[union-attr]
+        if year_from is not None and block["year_max"] < year_from:
+            continue
+        if year_to is not None and block["year_min"] > year_to:
+            continue
+        if region_id is not None and region_id not in block["regions"]:
+            continue
+        if measure_id is not None and measure_id not in block["measures"]:
+            continue
+        out.append(block)
+    return out
+
+
+def read_blocks(csv_path: str, index: Dict[str, object], blocks: Sequence[Dict[str, object]]) -> Iterable[Dict[str, str]]:
+    """選んだブロックだけをシークして読み、DictReader と同じ形の行を返す"""
+    headers = index["headers"]
+    with open(csv_path, "rb") as f:
+        for block in _coalesce(blocks):
+            f.seek(block[0])
+            text = f.read(block[1]).decode("utf-8")
+            yield from csv.DictReader(io.StringIO(text, newline=""), fieldnames=headers)  # type: ignore[arg-type]
+
+
+def _coalesce(blocks: Sequence[Dict[str, object]]) -> List[Tuple[int, int]]:
+    """隣接するブロックを 1 回の読み込みにまとめる (offset, length)"""
+    spans: List[Tuple[int, int]] = []
+    for block in blocks:
+        start, length = int(block["offset"]), int(block["length"])  # type: ignore[arg-type]
+        if spans and spans[-1][0] + spans[-1][1] == start:
+            spans[-1] = (spans[-1][0], spans[-1][1] + length)
+        else:
+            spans.append((start, length))
+    return spans
+
+
+def select_rows(
+    csv_path: str,
+    *,
+    region: str = "",
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+) -> Optional[List[Dict[str, str]]]:
+    """/api/export の地域・年範囲フィルタを索引で絞ってから評価する（索引が使えなければ None）"""
+    index = load_zonemap(csv_path)
+    if index is None:
+        return None
+    blocks = matching_blocks(index, region=region, year_from=year_from, year_to=year_to)
+    out = []
+    for row in read_blocks(csv_path, index, blocks):
+        if region and row.get("segment_region", "") != region:
+            continue
+        y = _year_of(row.get("year"))
+        if year_from is not None and y < year_from:
+            continue
+        if year_to is not None and y > year_to:
+            continue
+        out.append(row)
+    return out
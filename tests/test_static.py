@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import functools
+import http.client
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+# Ensure local src/ is importable when running from repo root
+_SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+if _SRC not in sys.path:
+    sys.path.insert(0, _SRC)
+
+from mof_investviz.static import CachingFileHandler
+
+
+@pytest.fixture
+def server(tmp_path):
+    sid = "0123456789abcdef0123456789abcdef"
+    (tmp_path / "uploads" / sid).mkdir(parents=True)
+    (tmp_path / "uploads" / sid / "summary.json").write_text("{}")
+    (tmp_path / "uploads" / ".session-secret").write_bytes(b"x" * 32)
+    (tmp_path / "index.html").write_text("<!doctype html>")
+    handler = functools.partial(CachingFileHandler, directory=str(tmp_path))
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address[1], sid
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(port: int, path: str):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        conn.request("GET", path)
+        res = conn.getresponse()
+        return res.status, res.read()
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("path", [
+    "/uploads/",
+    "/uploads/.session-secret",
+    "/uploads/%2esession-secret",
+])
+def test_listing_and_hidden_files_are_not_served(server, path):
+    port, sid = server
+    status, body = get(port, path)
+    assert status == 404
+    assert sid.encode() not in body
+    assert b"x" * 32 not in body
+
+
+def test_session_files_and_index_are_served(server):
+    port, sid = server
+    assert get(port, f"/uploads/{sid}/summary.json") == (200, b"{}")
+    assert get(port, "/")[0] == 200